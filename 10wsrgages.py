@@ -17,37 +17,66 @@ else:
 wd = "F:/gages_project/results"
 env.workspace = wd
 
-wsr = "F:\gages_project\data\general\National_Wild_and_Scenic_River_Segments_Feature_Layer_20180314\\National_Wild_and_Scenic_River_Segments_Feature_Layer.shp"
+wsr = "F:/gages_project/data/general/National_Wild_and_Scenic_River_Segments_Feature_Layer_20180314/National_Wild_and_Scenic_River_Segments_Feature_Layer.shp"
 
 #Project
-gages = '\\gages\\gages_analysis.gdb\\allgages_merge'
+gages = '/gages/gages_analysis.gdb/allgages_merge'
+#Columnar copy of the gages (see colstore.py and 3Gages_analysis2.py), read directly instead of the gdb feature class
+gages_store = wd + '/gages/store/allgages_merge.parquet'
 print(arcpy.Describe(gages).spatialReference.name)
 print(arcpy.Describe(wsr).spatialReference.name)
 
-#Near analysis
-#Check results through near analysis
-arcpy.CopyFeatures_management(gages,'\\gages\\gages_wildandscenic')
-in_features = '\\gages\\gages_wildandscenic.shp'
-near_features = wsr
-location = "LOCATION"
-angle = "NO_ANGLE"
-method = "GEODESIC"
-arcpy.Near_analysis(in_features, near_features, location = location, angle = angle, method = method)
+#Find all WSR segments within 500 m of every gage (see proximity.py). The STR tree over the WSR segments is built once
+#(in the coordinate system of the gages) and reloaded on later runs
+import os
+import numpy as np
+import flatgeom
+import hashjoin
+import instrument
+import proximity
+outdir = os.path.join(wd, 'gages')
+[f.name for f in arcpy.ListFields(wsr)]
+wsr_id = 'OBJECTID'
+wsr_name = 'WSR_RIVER_'
+gages_sr = arcpy.Describe(gages).spatialReference
+with instrument.stage('wsr_index'):
+    wsr_index = proximity.load_or_build(wsr, wsr_id, wsr_name, os.path.join(outdir, 'wsr_segments_index.npz'),
+                                        spatial_reference=gages_sr)
+#Gages with a null shape are (NaN, NaN) points, which are near no segment
+gages_geom, gages_tab = flatgeom.read_features(gages_store, fields=['site_no'])
+with instrument.stage('wsr_near', rows_in=len(gages_tab['site_no'])) as step:
+    near = wsr_index.near(gages_geom.xy[:,0], gages_geom.xy[:,1], radius=500)
+    step.rows_out = len(near['point'])
+wsr_near = {'site_no': hashjoin.normalize_keys(gages_tab['site_no'][near['point']], 'site_no'),
+            'WSR_FID': near['feature'], 'WSR_ID': near['feature_id'], 'RIVERNAME': near['name'],
+            'NEAR_DIST': near['distance'], 'NEAR_X': near['near_x'], 'NEAR_Y': near['near_y'],
+            'NEAR_RANK': near['rank'], 'RELATION': near['relation']}
 
 #Check those within 500 m of WSR
 """
-Add field in gages_wildandscenic fieed ConfirmWSR where Y means that a visual check was performed to confirm that gage
-is associated with the river and N means that the gage was not associated with a WSR.  Those on the stem of a WSR
-within 500 m and not separated from the last portion of WSR by a major tributary were kept (i.e. nearby tributaries, even
-large are not included).
+Field ConfirmWSR in gages_wsr_near.dbf: Y means that a visual check was performed to confirm that gage is associated
+with the river and N means that the gage was not associated with a WSR.  Those on the stem of a WSR within 500 m and
+not separated from the last portion of WSR by a major tributary were kept (i.e. nearby tributaries, even large are not
+included).
+Checks are carried over from previous runs (gages_wsr_near.dbf, then the ConfirmWSR field of the original
+gages_wildandscenic.shp, whose NEAR_FID is the FID of the nearest WSR segment), so only the pairs in
+gages_wsr_review.dbf need to be checked after a rerun. Fill in ConfirmWSR in gages_wsr_near.dbf and rerun this section.
 """
+near_tab = os.path.join(outdir, 'gages_wsr_near.dbf')
+confirm = proximity.reuse_decisions(wsr_near, ('site_no', 'WSR_ID'), [near_tab])
+legacy = proximity.reuse_decisions(wsr_near, ('site_no', 'WSR_FID'), [os.path.join(outdir, 'gages_wildandscenic.dbf')],
+                                   previous_keys=('site_no', 'NEAR_FID'))
+wsr_near['ConfirmWSR'] = np.where(confirm != '', confirm, legacy)
+hashjoin.write_table(near_tab, wsr_near)
+review = wsr_near['ConfirmWSR'] == ''
+hashjoin.write_table(os.path.join(outdir, 'gages_wsr_review.dbf'), dict((k, v[review]) for k, v in wsr_near.items()))
+print('{0} gage-WSR pairs within 500 m, {1} to review'.format(len(review), review.sum()))
 
-#Make a subselection
-arcpy.MakeFeatureLayer_management(in_features, 'gageswsrlyr')
-arcpy.SelectLayerByAttribute_management('gageswsrlyr', selection_type='NEW_SELECTION', where_clause="ConfirmWSR = 'Y'")
-arcpy.CopyFeatures_management('gageswsrlyr', '\\gages\\gages_wildandscenic_select.shp')
-
+#Make a subselection: gages confirmed on a WSR, with their closest confirmed segment
+confirmed = proximity.first_confirmed(wsr_near)
+gages_tab['site_no'] = hashjoin.normalize_keys(gages_tab['site_no'], 'site_no')
+wsr_select, rows = hashjoin.join(gages_tab, confirmed, 'site_no', 'site_no', how='inner',
+                                 fields=['WSR_ID', 'RIVERNAME', 'NEAR_DIST', 'RELATION', 'ConfirmWSR'])
 
 #Copy table
-arcpy.MakeTableView_management('gageswsrlyr', 'gageswsrtable')
-arcpy.CopyRows_management(in_rows='gageswsrtable',out_table='\\gages\\gages_wildandscenic_select.dbf')
\ No newline at end of file
+hashjoin.write_table(os.path.join(outdir, 'gages_wildandscenic_select.dbf'), wsr_select)
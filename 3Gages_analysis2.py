@@ -8,30 +8,57 @@ __author__ = 'Mathis Messager'
 #           The NHDv2 plus dataset is also divided into two datasets of flow lines: network and non-network lines
 #           non-network lines are essentially isolated flow lines or flow lines with no set direction (often diversions and artificial waterways)
 #           Therefore, the workflow is as follow:
+#           0. Index NHDv2 flowlines (only needs to be rerun when NHDv2 changes; flowlines are projected lazily, see projection.py)
 #           A. Join gages with discharge data downloaded from NWIS to gages feature points from the NHDv2Plus by ID (USGS NWIS Site Number) (21268/23569)
 #           B. For those gages that did not join to NHDv2plus, join them spatially to the network flowlines (snap to the closest flowline within 500 m) (1423/1875 (without AK and HW)
-#           C. For those gages that did not snap to a network flowline, join them spatially to non-network flowlines (snap to the closest non-network flowline within 500m) (81/452)
-#           D. For those gages that neither snapped to the network nor the non-network flowlines, inspect each individually and snap them to closest network or non-network flowlines when relevant (/371)
+#              For those gages that did not snap to a network flowline, join them spatially to non-network flowlines (snap to the closest non-network flowline within 500m) (81/452)
+#              (A. and B. are run as a single cascade over all gages, see gagesnap.cascade)
+#           C. For those gages that neither snapped to the network nor the non-network flowlines, inspect each individually and snap them to closest network or non-network flowlines when relevant (/371)
 
 import arcpy
+import numpy as np
+import fieldcalc
+#Time, memory and rows of the main steps are recorded (see instrument.py): instrument.report(path) writes them to
+#path.json/.csv (done automatically for every stage run by workflow.py)
+import instrument
 
 arcpy.env.workspace = "F:/gages_project/results/gages/gages_analysis.gdb"
 arcpy.env.overwriteOutput = True
 arcpy.env.qualifiedFieldNames = False
 
 #Import gages from NHDv2+ (Gages in NHDv2+ have been snapped to network with expert knowledge in the conterminous USA)
-NHDpath = "F:\gages_project\data\general\NHDplusv2\NHDPlusV21_NationalData_National_Seamless_Geodatabase_02\NHDPlusNationalData\NHDPlusV21_National_Seamless.gdb\\"
-proj_gage = NHDpath+"NHDEvents\\Gage"
+NHDpath = "F:/gages_project/data/general/NHDplusv2/NHDPlusV21_NationalData_National_Seamless_Geodatabase_02/NHDPlusNationalData/NHDPlusV21_National_Seamless.gdb/"
+proj_gage = NHDpath+"NHDEvents/Gage"
 #Import NHDv2 flowlines (I excluded coastlines)
-NHD_net = NHDpath+"NHDSnapshot\\NHDFlowline_Network_nocoast"
+NHD_net = NHDpath+"NHDSnapshot/NHDFlowline_Network_nocoast"
 #NHDv2 non-network flowlines (generally those flow lines that are not part of a topologically functional network -- often diversions and artificial waterways)
-NHD_nonet = NHDpath+"NHDSnapshot\\NHDFlowline_NonNetwork"
+NHD_nonet = NHDpath+"NHDSnapshot/NHDFlowline_NonNetwork"
 
-#Import flow lines to database
-NHD_net_imp = "NHDFlowline_Network_nocoast"
-arcpy.CopyFeatures_management(NHD_net, NHD_net_imp)
-NHD_nonet_imp = "NHDFlowline_NonNetwork"
-arcpy.CopyFeatures_management(NHD_nonet, NHD_nonet_imp)
+#Flowlines and gages in the gdb (names of the layers written by every section, so that sections can be run on their
+#own, see stages.py and workflow.py)
+pr = arcpy.SpatialReference('NAD 1983 Contiguous USA Albers')
+#Same coordinate systems for pyproj: NHDPlus (NAD 1983) and pr (see projection.py)
+nad83 = 'EPSG:4269'
+albers = 'ESRI:102003'
+allgages = "allgages_merge"
+index_dir = "F:/gages_project/results/gages/"
+#Segments of the flowlines in geographic coordinates and their projected tiles (see projection.py)
+net_cache = index_dir + "NHDFlowline_Network_nocoast_tiles"
+nonet_cache = index_dir + "NHDFlowline_NonNetwork_tiles"
+#Columnar copies of the gages (GeoParquet, see colstore.py), read by the later steps and by R instead of the gdb
+allgages_store = index_dir + "store/allgages_merge.parquet"
+allgages_HUC_store = index_dir + "store/allgages_merge_HUCjoin.parquet"
+
+##############################################################################
+# 0. INDEX NHDV2 FLOWLINES
+##############################################################################
+#Flowlines are neither copied to the gdb nor projected: their segments are read from NHDPlus and indexed in geographic
+#coordinates, and the index is saved to disk (it is only rebuilt when the flowlines change). Only the tiles of
+#flowlines near the gages to snap are projected, in B., and projected tiles are also kept on disk (see projection.py)
+import projection
+with instrument.stage('index_flowlines'):
+    projection.GeographicFlowlines.load_or_build(NHD_net, 'COMID', 'network', net_cache, nad83)
+    projection.GeographicFlowlines.load_or_build(NHD_nonet, 'COMID', 'nonetwork', nonet_cache, nad83)
 
 ##############################################################################
 #  A. JOIN GAGES THAT ALREADY EXIST IN THE NHDV2 DATASET TO THE NETWORK BY ID
@@ -41,25 +68,21 @@ arcpy.CopyFeatures_management(NHD_nonet, NHD_nonet_imp)
 #Alternative way would have been to export directly as .dbf in R using 'foreign' package
 gage_rec = r"F:/gages_project/results/gages/discharge_castdtinfo20180111.dbf"
 
+#Joins are done in memory on site numbers zero-padded to 8 digits rather than with AddJoin (see hashjoin.py)
+import hashjoin
 #Join USGS gage data to NHD2 gages
 NHD2gage_join =  "NHD2gage_discharge_castformat_join"
-arcpy.MakeFeatureLayer_management(proj_gage, "gage_lyr")
-arcpy.AddJoin_management("gage_lyr", in_field = "SOURCE_FEA", join_table = "discharge_castformat", join_field = "site_no", join_type = "KEEP_COMMON")
-arcpy.CopyFeatures_management("gage_lyr", NHD2gage_join)
-arcpy.Delete_management("gage_lyr")
+hashjoin.join_features(proj_gage, 'SOURCE_FEA', "discharge_castformat", 'site_no', NHD2gage_join, how='inner', key_width='site_no')
 
 #Create a table of those gages for which there is USGS discharge data but no corresponding event in NHDplus v2 exists
 NHD2gage_nojoin =  "discharge_castformat_NHD2gage_nojoin"
-arcpy.MakeTableView_management("discharge_castformat", out_view = "discharge_castformat_lyr")
-arcpy.AddJoin_management("discharge_castformat_lyr", in_field = "site_no", join_table = proj_gage, join_field = "SOURCE_FEA", join_type = "KEEP_ALL")
-arcpy.SelectLayerByAttribute_management("discharge_castformat_lyr", "NEW_SELECTION", 'SOURCE_FEA IS NULL')
-arcpy.CopyRows_management("discharge_castformat_lyr", NHD2gage_nojoin)
+hashjoin.join_table("discharge_castformat", 'site_no', proj_gage, 'SOURCE_FEA', NHD2gage_nojoin, how='anti', key_width='site_no')
 
 #####################################################################
-# B. SPATIALLY JOIN THOSE GAGES THAT ARE NOT IN NHDV2 TO THE NETWORK
+# B. POSITION ALL GAGES ON THE NETWORK IN A SINGLE CASCADE
 ####################################################################
-## Create a feature class of points for those gages that did not join with the NHDv2 dataset but that we know have discharge records
-in_XY_Table = "discharge_castformat_NHD2gage_nojoin"
+## Create a feature class of points for all gages that we know have discharge records
+in_XY_Table = "discharge_castformat"
 #Coordinate fields are in string format so need to create new identical fields for in numeric format
 [f.name for f in arcpy.ListFields(in_XY_Table, "*")]
 #Create fields
@@ -69,23 +92,15 @@ if "dec_lat_va_num" not in [f.name for f in arcpy.ListFields(in_XY_Table)]:
     arcpy.AddField_management(in_XY_Table, 'dec_lat_va_num', "DOUBLE")
 
 #Write fields (check for fields with typos such as longitude fields that are positive or latitude fields that are positive)
-with arcpy.da.UpdateCursor(in_XY_Table, ['dec_long_va','dec_lat_va','dec_long_va_num','dec_lat_va_num']) as cursor:
-    for row in cursor:
-        if float(row[0]) > 0:
-            row[2] = -float(row[0])
-        else:
-            row[2] = row[0]
-
-        if float(row[1]) < 0:
-            row[3] = -float(row[1])
-        else:
-            row[3] = row[1]
-        cursor.updateRow(row)
+#All gages are in the western and northern hemispheres, so longitudes must be negative and latitudes positive
+fieldcalc.calculate(in_XY_Table, ['dec_long_va','dec_lat_va'],
+                    lambda c: {'dec_long_va_num': -np.abs(fieldcalc.to_float(c['dec_long_va'])),
+                               'dec_lat_va_num': np.abs(fieldcalc.to_float(c['dec_lat_va']))})
 
 #XLong and YLat fields
 Long_Xfield = 'dec_long_va_num'
 Lat_Yfield = 'dec_lat_va_num'
-disgages = "gages_notinNHDv2"
+disgages = "gages_discharge"
 #Set the spatial reference - default to WGS84 "4326"
 Input_SpatialRef = arcpy.Describe(proj_gage).spatialReference
 #make XY event layer
@@ -96,116 +111,212 @@ arcpy.CopyFeatures_management("Output_eventlyr", disgages)
 ############################################################################################
 ## Join to stream network
 arcpy.env.parallelProcessingFactor = "100%"
-#Project the gages and network to accurately snap
-sr = arcpy.Describe(NHD_net_imp).SpatialReference
+#Gages are in the coordinate system of NHDv2 (NAD 1983)
+sr = arcpy.Describe(NHD_net).SpatialReference
 arcpy.DefineProjection_management(disgages, sr)
 arcpy.Describe(disgages).SpatialReference.name
 
-pr = arcpy.SpatialReference('NAD 1983 Contiguous USA Albers')
-disgages_proj = "gages_notinNHDv2_albers"
-net_proj = "NHDFlowline_Network_nocoast2_albers"
-nonet_proj = "NHDFlowline_NonNetwork_albers"
-arcpy.Project_management(disgages, disgages_proj, pr)
-arcpy.Project_management(NHD_net_imp, net_proj, pr)
-arcpy.Project_management(NHD_nonet_imp, nonet_proj, pr)
-
-#Take out gages in Alaska and Hawaii (because the NHDv2 does not include these areas
-arcpy.MakeFeatureLayer_management(disgages_proj, "gages_notinNHDv2_lyr")
-arcpy.SelectLayerByAttribute_management("gages_notinNHDv2_lyr", "NEW_SELECTION", 'dec_lat_va_num < 50 AND dec_lat_va_num > 25 ' )
-
-#Snap gages
-notinNHD_gages_snap = "gages_notinNHDv2_snap"
-arcpy.CopyFeatures_management("gages_notinNHDv2_lyr", notinNHD_gages_snap)
-snap_env = [net_proj, "EDGE", "500 Meters"]
-arcpy.Snap_edit(notinNHD_gages_snap, [snap_env])
-
-#Check results through near analysis
-in_features = notinNHD_gages_snap
-near_features = net_proj
-location = "LOCATION"
-angle = "NO_ANGLE"
-method = "GEODESIC"
-arcpy.Near_analysis(in_features, near_features, location = location, angle = angle, method = method)
-
-#Select those that snapped and output to new feature class
-arcpy.MakeFeatureLayer_management(notinNHD_gages_snap, "gages_notinNHDv2_snap_lyr")
-[f.name for f in arcpy.ListFields(notinNHD_gages_snap)]
-arcpy.SelectLayerByAttribute_management("gages_notinNHDv2_snap_lyr", "NEW_SELECTION", 'NEAR_DIST < 0.1 ' )
-notinNHD_gages_networksnapped = "gages_notinNHDv2_networksnapped"
-arcpy.CopyFeatures_management("gages_notinNHDv2_snap_lyr",notinNHD_gages_networksnapped)
-
-#Select those that did not snap and try snapping to NHDv2 plus non-network lines
-arcpy.SelectLayerByAttribute_management("gages_notinNHDv2_snap_lyr", "NEW_SELECTION", 'NEAR_DIST > 0.1 ' )
-notinNHD_gages_snap_nonetwork = "gages_notinNHDv2_snap_nonetwork"
-arcpy.CopyFeatures_management("gages_notinNHDv2_snap_lyr", notinNHD_gages_snap_nonetwork)
-snap_env = [nonet_proj, "EDGE", "500 Meters"]
-arcpy.Snap_edit(notinNHD_gages_snap_nonetwork, [snap_env])
-
-#Check results through near analysis
-in_features = notinNHD_gages_snap_nonetwork
-near_features = nonet_proj
-location = "LOCATION"
-angle = "NO_ANGLE"
-method = "GEODESIC"
-arcpy.Near_analysis(in_features, near_features, location = location, angle = angle, method = method)
-
-#Create a feature class from those that snapped
-arcpy.MakeFeatureLayer_management(notinNHD_gages_snap_nonetwork, "gages_notinNHDv2_snap_nonetwork_lyr")
-arcpy.SelectLayerByAttribute_management("gages_notinNHDv2_snap_nonetwork_lyr", "NEW_SELECTION", 'NEAR_DIST < 0.1 ' )
-notinNHD_gages_nonetworksnapped = "gages_notinNHDv2_nonetworksnapped"
-arcpy.CopyFeatures_management("gages_notinNHDv2_snap_nonetwork_lyr",notinNHD_gages_nonetworksnapped)
-#Create a feature class for those that did not snap to non-network
-arcpy.SelectLayerByAttribute_management("gages_notinNHDv2_snap_nonetwork_lyr", "NEW_SELECTION", 'NEAR_DIST > 0.1 ' )
-notinNHD_gages_nonetwork_notsnapped = "gages_notinNHDv2_nonetwork_notsnapped"
-arcpy.CopyFeatures_management("gages_notinNHDv2_snap_nonetwork_lyr",notinNHD_gages_nonetwork_notsnapped)
+#Position every gage with the first of these tiers that matches it (see gagesnap.cascade):
+#1. join to the NHDv2 gage events by site number (location snapped to the network by expert knowledge)
+#2. snap to the closest network flowline within 500 m
+#3. snap to the closest non-network flowline within 500 m
+#Gages that matched no tier keep their location and are flagged as 'notsnapped' (tier 'manual', see C.)
+#Flowline segments are indexed once in geographic coordinates (see 0.) and only the flowlines near the gages that
+#reach a snapping tier are projected (to pr), and gages are only sent to a tier if no previous tier matched them
+import flatgeom
+import gagesnap
+import projection
+with instrument.stage('flowline_index'):
+    net_index = projection.GeographicFlowlines.load_or_build(NHD_net, 'COMID', 'network', net_cache, nad83).projected(albers)
+    nonet_index = projection.GeographicFlowlines.load_or_build(NHD_nonet, 'COMID', 'nonetwork', nonet_cache, nad83).projected(albers)
+#Gages are projected in memory rather than with Project_management. Gages with a null shape have NaN coordinates: they
+#can only be positioned by the join tier, and stay notsnapped otherwise
+with instrument.stage('read_gages'):
+    gages_geom, gages_tab = flatgeom.read_features(disgages, fields=['site_no', 'dec_lat_va_num'])
+    NHDgage_geom, NHDgage_tab = flatgeom.read_features(proj_gage, fields=['SOURCE_FEA', 'FLComID'])
+    gages_x, gages_y = projection.transform(gages_geom.xy[:,0], gages_geom.xy[:,1], nad83, albers)
+    NHDgage_x, NHDgage_y = projection.transform(NHDgage_geom.xy[:,0], NHDgage_geom.xy[:,1], nad83, albers)
+tiers = [gagesnap.JoinTier('NHD2join', NHDgage_tab['SOURCE_FEA'], NHDgage_x, NHDgage_y, NHDgage_tab['FLComID']),
+         gagesnap.SnapTier(net_index, tolerance=500, positioning='snapped'),
+         gagesnap.SnapTier(nonet_index, tolerance=500, positioning='snapped')]
+with instrument.stage('snap_cascade', rows_in=len(gages_tab['site_no'])) as step:
+    gages_pos = gagesnap.cascade(gages_tab['site_no'], gages_x, gages_y, tiers, unmatched='notsnapped')
+    step.rows_out = int((gages_pos['tier_rank'] <= len(tiers)).sum())
+
+#Take out gages in Alaska and Hawaii that are not in NHDv2 (because the NHDv2 does not include these areas)
+keep = (gages_pos['tier'] == 'NHD2join') | ((gages_tab['dec_lat_va_num'] < 50) & (gages_tab['dec_lat_va_num'] > 25))
+
+#Write all gages at their new location with the tier that positioned them, the COMID of the flowline and the distance
+#they were moved (NEAR_DIST)
+flatgeom.write_points(allgages, gages_pos['x'][keep], gages_pos['y'][keep],
+                      {'site_no': gages_pos['site_no'][keep], 'positioning': gages_pos['positioning'][keep],
+                       'tier': gages_pos['tier'][keep], 'tier_rank': gages_pos['tier_rank'][keep],
+                       'COMID': gages_pos['flowline_id'][keep], 'NEAR_DIST': gages_pos['distance'][keep]}, pr)
+#Also write them to the columnar store, which the next steps read without going through arcpy
+import colstore
+colstore.write(allgages_store, {'site_no': gages_pos['site_no'][keep], 'positioning': gages_pos['positioning'][keep],
+                                'tier': gages_pos['tier'][keep], 'tier_rank': gages_pos['tier_rank'][keep],
+                                'COMID': gages_pos['flowline_id'][keep], 'NEAR_DIST': gages_pos['distance'][keep]},
+               flatgeom.FlatGeometry.from_points(gages_pos['x'][keep], gages_pos['y'][keep]), crs=pr.exportToString())
 
 ################################################################################################
 # C. MANUALLY JOIN THOSE GAGES THAT ARE NOT IN NHDV2 AND DID NOT AUTOMATICALLY SNAP TO FLOWLINES
 ################################################################################################
-#Check those points that snapped neither to the network nor to the non-network
-"F:/Miscellaneous/Hydro_classes/Gages_analysis.gdb/gages_notinNHDv2_nonetwork_notsnapped"
-
-#Add fields to these layers to show which ones were joined, which ones were snapped, and which ones were not snapped
-arcpy.AddField_management(notinNHD_gages_nonetwork_notsnapped, 'positioning', "TEXT")
-with arcpy.da.UpdateCursor(notinNHD_gages_nonetwork_notsnapped, 'positioning') as cursor:
-    for row in cursor:
-        print(row)
-        row[0] = "notsnapped"
-        cursor.updateRow(row)
-arcpy.AddField_management(notinNHD_gages_nonetworksnapped, 'positioning', "TEXT")
-with arcpy.da.UpdateCursor(notinNHD_gages_nonetworksnapped, 'positioning') as cursor:
-    for row in cursor:
-        print(row)
-        row[0] = "snapped"
-        cursor.updateRow(row)
-arcpy.AddField_management(notinNHD_gages_networksnapped, 'positioning', "TEXT")
-with arcpy.da.UpdateCursor(notinNHD_gages_networksnapped, 'positioning') as cursor:
-    for row in cursor:
-        print(row)
-        row[0] = "snapped"
-        cursor.updateRow(row)
-arcpy.AddField_management(NHD2gage_join, 'positioning', "TEXT")
-with arcpy.da.UpdateCursor(NHD2gage_join, 'positioning') as cursor:
-    for row in cursor:
-        print(row)
-        row[0] = "NHD2join"
-        cursor.updateRow(row)
-
-#Merge all layers (did it in Arcmap, crashed repeatedly in Python)
-#First make sure that NHDgage_discharge_castformat_join has a site_no field
-#-> "Gages_analysis.gdb/allgages_merge"
-#Only keep gage ID and source fields
+#Check those points that snapped neither to the network nor to the non-network: positioning = 'notsnapped' in allgages_merge
 
 ####################
 #Need to inspect each gage that did not snap individually and move manually those that should be on a nearby flowline using
 # USGS records, satellite imagery, etc.   -> Gages_analysis.gdb/allgages_merge_manual
 #WARNING: THIS STEP WAS NOT RE-DONE ON JANUARY 2018, GAGES WERE LINKED TO BASINS AND MAPPED AS IS.
 
-#Join with HUC data (Watershed Boundary Dataset WBD)
-allgages = "allgages_merge"
-HUC = NHDpath+"WBDSnapshot\HUC12"
-allgages_HUC = "allgages_merge_HUCjoin"
-arcpy.SpatialJoin_analysis(allgages, HUC, allgages_HUC, match_option="WITHIN")
-#13 gages did not join because they fell outside of any HUC, correct them manually
-#02246850,04165557,04165710,04216000,04159130,04264331,08375300,09532500,09522200,01103038,04127885,464646092052900,01103040
-#Delete Hawaii gages and export attributes to table -> results/gages/allgages_merge_HUCjoin.csv
\ No newline at end of file
+#Join with HUC data (Watershed Boundary Dataset WBD): assign every gage to the HUC12 that contains it (see
+#pointinpoly.py). Gages that fall outside of every HUC12 (13 gages in January 2018, e.g. on the coast or the Great
+#Lakes shore, which were corrected manually) are assigned to the closest HUC12 within 5 km (HUC_MATCH = 'nearest',
+#HUC_DIST = distance to the HUC12 in meters). The HUC12 polygons are prepared once and the index is saved to disk
+import colstore
+import flatgeom
+import hashjoin
+import huc
+import pointinpoly
+HUC = NHDpath+"WBDSnapshot/HUC12"
+with instrument.stage('HUC12_index'):
+    HUC_index = pointinpoly.load_or_build(HUC, 'HUC_12', index_dir + 'WBD_HUC12_index.npz', spatial_reference=pr)
+#Gages with a null shape are (NaN, NaN) points, which are assigned no HUC12 (HUC_MATCH = 'none')
+allgages_geom, allgages_tab = flatgeom.read_features(allgages_store, fields=['site_no'])
+with instrument.stage('HUC12_assign', rows_in=len(allgages_tab['site_no'])) as step:
+    gages_HUC12 = HUC_index.assign(allgages_geom.xy[:,0], allgages_geom.xy[:,1], tolerance=5000)
+    step.rows_out = int((gages_HUC12['match'] != 'none').sum())
+#Parent codes of the HUC12 of the gages at every level (see huc.py) -> HUC2 to HUC12 columns
+HUC12 = huc.to_int(gages_HUC12['feature_id'], 'HUC12')
+HUC12_hierarchy = huc.HucIndex(HUC12[HUC12 >= 0])
+allgages_HUC = {'site_no': allgages_tab['site_no']}
+allgages_HUC.update(HUC12_hierarchy.columns(HUC12))
+allgages_HUC['HUC_MATCH'] = gages_HUC12['match']
+allgages_HUC['HUC_DIST'] = gages_HUC12['distance']
+print('{0} gages outside of any HUC12 assigned to the closest HUC12, {1} not assigned'.format(
+    (gages_HUC12['match'] == 'nearest').sum(), (gages_HUC12['match'] == 'none').sum()))
+hashjoin.write_table("allgages_merge_HUCjoin", allgages_HUC)
+
+#Export attributes to the columnar store, partitioned by HUC2 -> results/gages/store/allgages_merge_HUCjoin.parquet
+#(Hawaii gages, HUC2 = 20, are left out when reading it, see 4gages_history12.R)
+colstore.write(allgages_HUC_store, allgages_HUC, partition_by='HUC2')
+
+################################################################################################
+# D. INCREMENTAL REFRESH FROM A NEW NWIS EXPORT
+################################################################################################
+#When a new NWIS export (discharge_castdtinfo*.dbf, see 2gages_hydro_12.R) only adds, removes or moves a few sites, run
+#this section instead of A.-C. and 10wsrgages.py: sites are compared to those of the previous refresh by site_no,
+#coordinates and days of record, and only the sites that changed go through the NHD ID join and snapping cascade (B.),
+#the HUC12 assignment (C.) and the WSR proximity (10wsrgages.py). Their results replace those of the same sites in the
+#outputs, and the changes are appended to gage_changes.csv (see gagerefresh.py). The first refresh processes all sites,
+#and all sites are processed again if NHDv2, WBD or the WSR layer changed.
+#Manual corrections of gage positions go in gage_corrections.csv (site_no, x, y in NAD 1983 Contiguous USA Albers, COMID,
+#note): they are applied every time a site is processed, so they are kept across refreshes (WSR checks are carried over
+#as in 10wsrgages.py). The intermediate tables of A. (discharge_castformat...) are not updated.
+import json
+import os
+import colstore
+import flatgeom
+import gagerefresh
+import gagesnap
+import hashjoin
+import huc
+import pointinpoly
+import projection
+import proximity
+new_export = index_dir + "discharge_castdtinfo20180111.dbf"
+HUC = NHDpath+"WBDSnapshot/HUC12"
+wsr = "F:/gages_project/data/general/National_Wild_and_Scenic_River_Segments_Feature_Layer_20180314/National_Wild_and_Scenic_River_Segments_Feature_Layer.shp"
+sites_store = index_dir + "store/gage_sites.parquet"
+corrections_csv = index_dir + "gage_corrections.csv"
+changes_csv = index_dir + "gage_changes.csv"
+near_tab = index_dir + "gages_wsr_near.dbf"
+
+#Indexes of the layers (only rebuilt if a layer changed) and the NHDv2 gage events (only read again if they changed)
+with instrument.stage('refresh_indexes'):
+    net_geo = projection.GeographicFlowlines.load_or_build(NHD_net, 'COMID', 'network', net_cache, nad83)
+    nonet_geo = projection.GeographicFlowlines.load_or_build(NHD_nonet, 'COMID', 'nonetwork', nonet_cache, nad83)
+    events = gagerefresh.load_events(proj_gage, ['SOURCE_FEA', 'FLComID'], index_dir + 'NHDGage_events.npz')
+    HUC_index = pointinpoly.load_or_build(HUC, 'HUC_12', index_dir + 'WBD_HUC12_index.npz', spatial_reference=pr)
+    wsr_index = proximity.load_or_build(wsr, 'OBJECTID', 'WSR_RIVER_', index_dir + 'wsr_segments_index.npz', spatial_reference=pr)
+versions = json.loads(json.dumps(dict((name, flatgeom.layer_version(layer)) for name, layer in
+                                      [('network', NHD_net), ('nonetwork', NHD_nonet), ('events', proj_gage), ('HUC12', HUC), ('wsr', wsr)])))
+
+#Sites that changed since the previous refresh, and outputs of the previous refresh
+with instrument.stage('refresh_diff') as step:
+    sites = gagerefresh.site_table(flatgeom.read_dbf(new_export))
+    previous_sites, previous_versions = gagerefresh.load_sites(sites_store)
+    gages_prev = HUC_prev = near_prev = None
+    if previous_sites is not None:
+        gages_geom, gages_prev = flatgeom.read_features(allgages_store)
+        gages_prev['x'], gages_prev['y'] = gages_geom.xy[:,0], gages_geom.xy[:,1]
+        HUC_prev = colstore.read_table(allgages_HUC_store)
+        near_prev = hashjoin.read_table(near_tab) if os.path.exists(near_tab) else None
+    corrections = gagerefresh.read_corrections(corrections_csv)
+    if previous_versions != versions:
+        reprocess = True
+    else:
+        reprocess = gagerefresh.corrections_changed(corrections, gages_prev)
+    changes = gagerefresh.diff(sites, previous_sites, reprocess=reprocess)
+    todo = np.isin(sites['site_no'], changes['site_no'][np.isin(changes['change'], gagerefresh.REPROCESS)])
+    #Records of these sites are replaced (or dropped) in the outputs
+    replaced = changes['site_no'][changes['change'] != 'records']
+    step.rows_out = int(todo.sum())
+for change in ['added', 'removed', 'moved', 'records', 'reprocess']:
+    print('{0} sites {1}'.format((changes['change'] == change).sum(), change))
+
+#Position the sites that changed (B.)
+with instrument.stage('refresh_position', rows_in=int(todo.sum())) as step:
+    x, y = projection.transform(sites['lon'][todo], sites['lat'][todo], nad83, albers)
+    events_x, events_y = projection.transform(events['x'], events['y'], nad83, albers)
+    tiers = [gagesnap.JoinTier('NHD2join', events['SOURCE_FEA'], events_x, events_y, events['FLComID']),
+             gagesnap.SnapTier(net_geo.projected(albers), tolerance=500, positioning='snapped'),
+             gagesnap.SnapTier(nonet_geo.projected(albers), tolerance=500, positioning='snapped')]
+    pos = gagesnap.cascade(sites['site_no'][todo], x, y, tiers, unmatched='notsnapped')
+    pos = gagerefresh.apply_corrections(pos, corrections)
+    keep = (pos['tier'] == 'NHD2join') | (pos['tier'] == 'correction') | ((sites['lat'][todo] < 50) & (sites['lat'][todo] > 25))
+    gages_new = {'site_no': pos['site_no'][keep], 'positioning': pos['positioning'][keep], 'tier': pos['tier'][keep],
+                 'tier_rank': pos['tier_rank'][keep], 'COMID': pos['flowline_id'][keep], 'NEAR_DIST': pos['distance'][keep],
+                 'x': pos['x'][keep], 'y': pos['y'][keep]}
+    step.rows_out = len(gages_new['site_no'])
+
+#HUC12 (C.) and WSR segments within 500 m (10wsrgages.py) of the sites that changed
+with instrument.stage('refresh_huc_wsr', rows_in=len(gages_new['site_no'])):
+    gages_HUC12 = HUC_index.assign(gages_new['x'], gages_new['y'], tolerance=5000)
+    HUC12 = huc.to_int(gages_HUC12['feature_id'], 'HUC12')
+    HUC_new = {'site_no': gages_new['site_no']}
+    HUC_new.update(huc.HucIndex(HUC12[HUC12 >= 0]).columns(HUC12))
+    HUC_new['HUC_MATCH'] = gages_HUC12['match']
+    HUC_new['HUC_DIST'] = gages_HUC12['distance']
+    near = wsr_index.near(gages_new['x'], gages_new['y'], radius=500)
+    near_new = {'site_no': gages_new['site_no'][near['point']],
+                'WSR_FID': near['feature'], 'WSR_ID': near['feature_id'], 'RIVERNAME': near['name'],
+                'NEAR_DIST': near['distance'], 'NEAR_X': near['near_x'], 'NEAR_Y': near['near_y'],
+                'NEAR_RANK': near['rank'], 'RELATION': near['relation']}
+
+#Merge into the outputs of the previous refresh, carry over WSR checks and write everything
+with instrument.stage('refresh_write') as step:
+    gages_all = gagerefresh.merge(gages_prev, gages_new, replaced)
+    HUC_all = gagerefresh.merge(HUC_prev, HUC_new, replaced)
+    wsr_near = gagerefresh.merge(near_prev, near_new, replaced)
+    gages_fields = ['site_no', 'positioning', 'tier', 'tier_rank', 'COMID', 'NEAR_DIST']
+    flatgeom.write_points(allgages, gages_all['x'], gages_all['y'], dict((f, gages_all[f]) for f in gages_fields), pr)
+    colstore.write(allgages_store, dict((f, gages_all[f]) for f in gages_fields),
+                   flatgeom.FlatGeometry.from_points(gages_all['x'], gages_all['y']), crs=pr.exportToString())
+    hashjoin.write_table("allgages_merge_HUCjoin", HUC_all)
+    colstore.write(allgages_HUC_store, HUC_all, partition_by='HUC2')
+    confirm = proximity.reuse_decisions(wsr_near, ('site_no', 'WSR_ID'), [near_tab])
+    legacy = proximity.reuse_decisions(wsr_near, ('site_no', 'WSR_FID'), [index_dir + 'gages_wildandscenic.dbf'],
+                                       previous_keys=('site_no', 'NEAR_FID'))
+    wsr_near['ConfirmWSR'] = np.where(confirm != '', confirm, legacy)
+    hashjoin.write_table(near_tab, wsr_near)
+    review = wsr_near['ConfirmWSR'] == ''
+    hashjoin.write_table(index_dir + 'gages_wsr_review.dbf', dict((k, v[review]) for k, v in wsr_near.items()))
+    wsr_select, rows = hashjoin.join({'site_no': gages_all['site_no']}, proximity.first_confirmed(wsr_near), 'site_no', 'site_no',
+                                     how='inner', fields=['WSR_ID', 'RIVERNAME', 'NEAR_DIST', 'RELATION', 'ConfirmWSR'])
+    hashjoin.write_table(index_dir + 'gages_wildandscenic_select.dbf', wsr_select)
+    gagerefresh.log_changes(changes_csv, changes, gages=gages_new, huc=HUC_new, wsr_near=near_new, source=new_export)
+    gagerefresh.save_sites(sites_store, sites, versions, source=new_export)
+    step.rows_out = len(gages_all['site_no'])
+print('{0} gages ({1} processed), {2} gage-WSR pairs within 500 m, {3} to review'.format(
+    len(gages_all['site_no']), len(gages_new['site_no']), len(review), review.sum()))
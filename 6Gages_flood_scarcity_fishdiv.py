@@ -20,7 +20,11 @@ __author__ = 'Mathis Messager'
 
 import arcpy
 import csv
-import re
+import numpy as np
+import fieldcalc
+#Time, memory and rows of the main steps are recorded (see instrument.py): instrument.report(path) writes them to
+#path.json/.csv (done automatically for every stage run by workflow.py)
+import instrument
 arcpy.CheckOutExtension("Spatial")
 arcpy.env.qualifiedFieldNames = False
 arcpy.env.overwriteOutput = True
@@ -41,61 +45,24 @@ HUC8_dat = "fish/HUC8.shp"
 county = projdir+ "data/flood/Population/gz_2010_us_050_00_5m/gz_2010_us_050_00_5m.shp"
 NDImax = projdir+"data/scarcity/Devineni_et_al_2015/NDC_NDImax.csv"
 db_scarcity = "water_Scarcity/Gage_analysis_scarcity.gdb"
-NDImax_db = db_scarcity + "\NDC_NDImax"
 
 #Generate FIPS for counties to have a common key with Devineni's data
 arcpy.AddField_management(county, "FIPS", "TEXT")
-with arcpy.da.UpdateCursor(county, ['STATE', "COUNTY", 'FIPS']) as cursor:
-    for row in cursor:
-        row[2] = row[0] + row[1]
-        cursor.updateRow(row)
-
-#Export csv to geodatabase
-arcpy.TableToGeodatabase_conversion(NDImax, db_scarcity)
-
-#Convert FIPS to string in NDImax table
-arcpy.AddField_management(NDImax_db, "FIPS_str", "TEXT")
-with arcpy.da.UpdateCursor(NDImax_db, ['FIPS', "FIPS_str", ""]) as cursor:
-    for row in cursor:
-        if row[0] < 10000:
-            row[1] = "0" + str(row[0])
-        else:
-            row[1] = str(row[0])
-        cursor.updateRow(row)
-
-#NDImax and NDC are strangely formatted, include "NaN" and 095.02E-05 and things of the like, so need to be formatted.
-arcpy.AddField_management(NDImax_db, "NDImax_numb", "DOUBLE")
-arcpy.AddField_management(NDImax_db, "NDC_numb", "DOUBLE")
-with arcpy.da.UpdateCursor(NDImax_db, ['NDImax', "NDImax_numb", "NDC", "NDC_numb"]) as cursor:
-    for row in cursor:
-        if row[0] == "NaN":
-            row[1] = None
-        elif re.search('E', row[0]):
-            row[1] = 0
-        else:
-            row[1]=row[0]
-
-        if row[2] == "NaN":
-            row[3] = None
-        elif re.search('E', row[2]):
-            row[3] = 0
-        else:
-            row[3]=row[2]
-        cursor.updateRow(row)
-
-
-#Join county shapefile to NDImax table
-county_scarcity_join = db_scarcity + "\county_NDImax_join"
-arcpy.MakeFeatureLayer_management(county, "county_lyr")
-arcpy.AddJoin_management(in_layer_or_view="county_lyr", in_field="FIPS", join_table=NDImax_db, join_field="FIPS_str", join_type="KEEP_COMMON")
-arcpy.CopyFeatures_management("county_lyr", county_scarcity_join)
-
-#Compute county area properly (using geodesic calculation)
-arcpy.AddGeometryAttributes_management(Input_Features=county_scarcity_join, Geometry_Properties="AREA_GEODESIC", Area_Unit= "SQUARE_MILES_US")
-arcpy.AlterField_management(in_table=county_scarcity_join, field = "AREA_GEO", new_field_name='COUNTYAREA_GEO')
-#Compute intersection of each county with each HUC6
-HUC6_countyscarcity_intersect = db_scarcity + "\HUC6_countyscarcity_intersect"
-arcpy.Intersect_analysis(in_features = [county_scarcity_join,HUC6_dat], out_feature_class= HUC6_countyscarcity_intersect)
+fieldcalc.calculate(county, ['STATE', 'COUNTY'], lambda c: {'FIPS': np.char.add(c['STATE'], c['COUNTY'])})
+
+#Read csv straight into typed columns (no geodatabase table). NDImax and NDC are strangely formatted, include "NaN"
+#and 095.02E-05 and things of the like: "NaN" become NaN and values with an exponent are parsed (they used to be set
+#to 0). FIPS are zero-padded to 5 characters. Null, coerced and rejected values are listed in NDC_NDImax_ingest.json
+import csvingest
+NDImax_tab, NDImax_report = csvingest.read_csv(NDImax, 'NDC_NDImax')
+csvingest.write_report(NDImax_report, "water_Scarcity/NDC_NDImax_ingest.json", name='NDC_NDImax')
+
+
+#Join county shapefile to NDImax table (in memory, FIPS of both tables are zero-padded to 5 characters, see hashjoin.py)
+import hashjoin
+county_scarcity_join = db_scarcity + "/county_NDImax_join"
+hashjoin.join_features(county, 'FIPS', NDImax_tab, 'FIPS', county_scarcity_join, how='inner', key_width='FIPS',
+                       null_value={'NDImax_numb': np.nan, 'NDC_numb': np.nan})
 
 ########################################################################################################################
 # COMPUTE AVERAGE ANNUAL RAINFALL 1949-2010 FOR EACH WATERSHED
@@ -110,8 +77,8 @@ from netCDF4 import *
 import glob
 import gc
 
-pr1949_0101='water_Scarcity\Precipitation\pr1949'
-unzipped_nc = 'water_Scarcity\Precipitation\unzipped_data\\'
+pr1949_0101='water_Scarcity/Precipitation/pr1949'
+unzipped_nc = 'water_Scarcity/Precipitation/unzipped_data/'
 
 #Convert January 1st 1949  from NetCDF to raster layer to get extent and coordinate system
 arcpy.MakeNetCDFRasterLayer_md(in_netCDF_file = 'nldas_met_update.obs.daily.pr.1949.nc',
@@ -127,116 +94,104 @@ f1949 = nc.Dataset(nc1949)
 # print variables
 f1949.variables.keys()
 aprec1949 = f1949.variables['pr']
-print aprec1949
-#Try summing across days to get annual rainfall in each pixel
-aprec1949_sum = np.sum(aprec1949, axis=0)
-#Check shape of output
-np.shape(aprec1949_sum)
-#Initial layer in raster stack
-nc_concat = aprec1949_sum
+print(aprec1949)
 
 #Compute average annual rainfall by first summing over every day for each year and then computing average over 1949-2010
-#Run into memory error so have to do it in two batches
+#Stacking every year ran into memory errors, so keep a running sum and count of annual rainfall in each pixel instead
+#(see rainfall_climatology.py). All years are done in one pass.
+import rainfall_climatology as rc
+import grid_cache
+nc_years = rc.list_years(unzipped_nc)
 #Check number of years
-len([name for name in glob.glob(unzipped_nc + '\\nldas_met*')])
-#Run through the first 31 years
-for name in glob.glob(unzipped_nc + '\\nldas_met*')[1:31]:
-    #Run through every one of the 31 years except 1949
-    if name != nc1949:
-        print(name)
-        f = nc.Dataset(name)
-        aprec = f.variables['pr']
-        #For each year, compute the sum over every day of the year to get for total annual rainfall in each pixel
-        nc_sum = np.sum(aprec, axis=0)
-        #Add the layer to the stack of years, starting with only 1949 in the stack and rewriting the stack for the next iteration
-        nc_concat = numpy.dstack((nc_concat, nc_sum))
-#Check the dimensions of the stack
-np.shape(nc_concat)
-#For each pixel, compute the mean annual rainfall across years (axis 0 and 1 are spatial, 2 is temporal)
-rainfall_avg_50_80 = np.mean(nc_concat,axis=2)
-#Check shape again
-np.shape(rainfall_avg_50_80)
-
-#Second batch, create stack with 1981 and then add to stack
-for name in glob.glob(unzipped_nc + '\\nldas_met*')[32:]:
-        print(name)
-        if name == unzipped_nc+'nldas_met_update.obs.daily.pr.1981.nc':
-            f = nc.Dataset(name)
-            aprec = f.variables['pr']
-            nc_concat = np.sum(aprec, axis=0)
-        else:
-            f = nc.Dataset(name)
-            aprec = f.variables['pr']
-            nc_sum = np.sum(aprec, axis=0)
-            nc_concat = numpy.dstack((nc_concat, nc_sum))
-
-rainfall_avg_81_10 = np.mean(nc_concat,axis=2)
-np.shape((rainfall_avg_50_80, rainfall_avg_81_10))
-
-#Compute average annual rainfall across all years (same number of years in each stack)
-rainfall_avg = np.mean((rainfall_avg_50_80, rainfall_avg_81_10),axis=0)
+len(nc_years)
+#Each year is independent, so sum years in parallel (one worker per core, set workers=1 to run years one after another).
+#Workers do not run this script again when they start (see workerpool.py)
+#Annual totals are cached (keyed by file size, date and content) so that only new or modified years are re-read
+annualtotal_cache = grid_cache.GridCache(unzipped_nc+'annualtotal_cache', max_bytes=2*10**9)
+with instrument.stage('rainfall_climatology', rows_in=len(nc_years)):
+    climatology = rc.rainfall_climatology(nc_years, variable='pr', workers=None, cache=annualtotal_cache)
+rainfall_avg = climatology.mean()
 #For some reason,the data were flipped spatially along its central parallel, so flip it the other way
-rainfall_flip = numpy.flipud(rainfall_avg)
-nodatval=np.max(rainfall_avg)
+nodatval = -9999.0
+rainfall_flip = np.flipud(rainfall_avg)
+rainfall_flip[np.isnan(rainfall_flip)] = nodatval
 np.shape(rainfall_avg)
 
 #Convert the numpy array to a raster dataset
-ras = arcpy.NumPyArrayToRaster(in_array = rainfall_flip,lower_left_corner=arcpy.Point(mx, my), x_cell_size=pr1949_0101, y_cell_size=pr1949_0101,value_to_nodata=double(nodatval))
-rainfall_avg_ras = 'water_Scarcity\Precipitation\\avgrainfall'
+ras = arcpy.NumPyArrayToRaster(in_array = rainfall_flip,lower_left_corner=arcpy.Point(mx, my), x_cell_size=pr1949_0101, y_cell_size=pr1949_0101,value_to_nodata=nodatval)
+rainfall_avg_ras = 'water_Scarcity/Precipitation/avgrainfall'
 ras.save(rainfall_avg_ras)
 
 #Check whether county average precipitation from Devineni corresponds to our estimation
-arcpy.sa.ZonalStatisticsAsTable(in_zone_data=county, zone_field="FIPS", in_value_raster=rainfall_avg_ras,
-                                out_table='water_Scarcity\Precipitation\\county_AP.dbf',
-                                ignore_nodata="DATA", statistics_type="MEAN")
+#ZonalStatisticsAsTable did not work for most of the large inputs, so compute zonal statistics directly on the numpy
+#array by rasterizing the zones on the rainfall grid (see zonal_stats.py, does not require arcpy)
+#Zones are only rasterized once on the rainfall grid and the label rasters are cached for later runs (see label_cache.py)
+import flatgeom
+import zonal_stats
+import label_cache
+rain_grid = zonal_stats.Grid(xmin=mx, ymax=my + rainfall_flip.shape[0]*myRaster.meanCellHeight, cellsize=myRaster.meanCellWidth,
+                             nrows=rainfall_flip.shape[0], ncols=rainfall_flip.shape[1])
+rain_labels = label_cache.LabelCache('water_Scarcity/Precipitation/label_cache')
+with instrument.stage('zonal_county') as step:
+    county_AP = rain_labels.get_or_rasterize(county, 'FIPS', rain_grid).zonal_stats(rainfall_flip, nodata=nodatval)
+    step.rows_out = len(county_AP['FIPS'])
+flatgeom.write_dbf('water_Scarcity/Precipitation/county_AP.dbf', county_AP, columns=['FIPS', 'COUNT', 'AREA', 'MEAN'])
 
 ########################################################################################################################
-#Compute area of intersection of county and HUCs (unit in square miles because census blocks are in square miles)
-arcpy.AddGeometryAttributes_management(Input_Features=HUC6_countyscarcity_intersect, Geometry_Properties="AREA_GEODESIC", Area_Unit= "SQUARE_MILES_US")
-
-#Compute SIC of each census block portion
-[f.name for f in arcpy.ListFields(HUC4_countyscarcity_intersect)]
-#For each HUC6
-arcpy.AddField_management(in_table=HUC6_countyscarcity_intersect,field_name='SICsub',field_type='DOUBLE')
-with arcpy.da.UpdateCursor(HUC6_countyscarcity_intersect, ['NDC_numb', "NDImax_numb", "AVR_RAINFALL",'AREA_GEO','COUNTYAREA_GEO','SICsub']) as cursor:
-    for row in cursor:
-        if row[0] is not None:
-            #SICcub=(NDC*Average Precipitation*County_Area)* Subcounty_Area/County Area
-            row[5]=(row[0]*row[2]*row[4])*row[3]/row[4]
-        else:
-            row[5]=None
-        cursor.updateRow(row)
-
-#Dissolve by HUC, summing the SIC of each census block portion within the watershed
-HUC6_SIC = db_scarcity + "\HUC6_SIC"
-arcpy.Dissolve_management(in_features=HUC6_countyscarcity_intersect, out_feature_class=HUC6_SIC, dissolve_field=["HUC6"], statistics_fields=[['AREA_GEO', 'SUM'],['SICsub', 'SUM']])
+#Compute HUC6 NDC from county NDC, weighting counties by their area of intersection with each HUC
+#SIC of each county portion = (NDC*Average Precipitation*County_Area)* Subcounty_Area/County Area = NDC*Average Precipitation*Subcounty_Area
+#SIC of each HUC = sum of SIC of county portions (NDC is null for some counties, those are left out)
+#NDC of each HUC = SIC/(Average HUC precipitation*Area of HUC covered by counties)
+#Rather than intersecting counties with HUCs, computing geodesic areas and dissolving, both layers are rasterized on a
+#fine (0.0025 degree, ~250 m) grid and the area of intersection of every county with every HUC is computed once on the
+#ellipsoid as a sparse weight matrix, which is cached and reused (see overlay.py)
+#Counties and HUC6 are both in NAD83 geographic coordinates
+import overlay
+import geodesic
+ext = arcpy.Describe(county_scarcity_join).extent
+overlay_grid = zonal_stats.Grid.from_extent(ext.XMin, ext.YMin, ext.XMax, ext.YMax, cellsize=0.0025, crs=4269)
+overlay_labels = label_cache.LabelCache('water_Scarcity/overlay_label_cache')
+with instrument.stage('county_HUC6_weights') as step:
+    county_HUC6 = overlay.AreaWeights.cached(overlay_labels.get_or_rasterize(county_scarcity_join, 'FIPS', overlay_grid),
+                                             overlay_labels.get_or_rasterize(HUC6_dat, 'HUC6', overlay_grid),
+                                             'water_Scarcity/overlay_weights', ellipsoid=geodesic.GRS80)
+    step.rows_out = len(county_HUC6.area)
+
+county_tab = fieldcalc.read_columns(county_scarcity_join, ['FIPS', 'NDC_numb', 'AVR_RAINFALL'], null_value={'NDC_numb': np.nan})
+NDC_county = county_HUC6.align(county_tab['FIPS'], county_tab['NDC_numb'], key_width='FIPS')
+AP_county = county_HUC6.align(county_tab['FIPS'], county_tab['AVR_RAINFALL'], key_width='FIPS')
+SIC_HUC6 = county_HUC6.sum(NDC_county*AP_county, unit='SQUARE_MILES_US')
+AREA_HUC6 = county_HUC6.covered_area(unit='SQUARE_MILES_US')
 
 #Calculate average annual rainfall in each HUC
-arcpy.sa.ZonalStatisticsAsTable(in_zone_data=HUC6_SIC, zone_field="HUC6", in_value_raster=rainfall_avg_ras,
-                                out_table='water_Scarcity\Precipitation\\HUC6_AP.dbf',
-                                ignore_nodata="DATA", statistics_type="MEAN")
-
-#Join rainfall statistics to HUC shapefile
-HUC6_SIC_pr = db_scarcity + "\HUC6_SIC_pr"
-arcpy.MakeFeatureLayer_management(HUC4_SIC, "HUC6_SIC_lyr")
-arcpy.AddJoin_management(in_layer_or_view="HUC6_SIC_lyr", in_field="HUC6",
-                         join_table='water_Scarcity\Precipitation\\HUC6_AP.dbf', join_field="HUC6", join_type="KEEP_COMMON")
-arcpy.CopyFeatures_management("HUC6_SIC_lyr", HUC6_SIC_pr)
-
-#Compute HUC geodesic area
-arcpy.AddGeometryAttributes_management(Input_Features=HUC6_SIC_pr, Geometry_Properties="AREA_GEODESIC", Area_Unit= "SQUARE_MILES_US")
-
-#Compute HUC NDC
-arcpy.AddField_management(in_table=HUC4_SIC_pr,field_name='NDC_HUC',field_type='DOUBLE')
-with arcpy.da.UpdateCursor(HUC4_SIC_pr, ["SUM_SICsub",'MEAN','AREA_GEO','NDC_HUC']) as cursor:
-    for row in cursor:
-        row[3]=row[0]/(row[1]*row[2])
-        cursor.updateRow(row)
-arcpy.AddField_management(in_table=HUC6_SIC_pr,field_name='NDC_HUC',field_type='DOUBLE')
-with arcpy.da.UpdateCursor(HUC6_SIC_pr, ["SUM_SICsub",'MEAN','AREA_GEO','NDC_HUC']) as cursor:
-    for row in cursor:
-        row[3]=row[0]/(row[1]*row[2])
-        cursor.updateRow(row)
+with instrument.stage('zonal_HUC6') as step:
+    HUC6_AP = rain_labels.get_or_rasterize(HUC6_dat, 'HUC6', rain_grid).zonal_stats(rainfall_flip, nodata=nodatval)
+    step.rows_out = len(HUC6_AP['HUC6'])
+flatgeom.write_dbf('water_Scarcity/Precipitation/HUC6_AP.dbf', HUC6_AP, columns=['HUC6', 'COUNT', 'AREA', 'MEAN'])
+
+#Daily precipitation series of every HUC6 and county (days x zones, 1949-2010), for statistics other than the average
+#annual rainfall (dry years, trends, seasonal totals...) without going through a raster of every statistic. The fraction
+#of every NLDAS pixel in every zone is computed once from the zones rasterized on a grid 25 times finer (0.005 degree)
+#and saved to disk, then every yearly file is read once and reduced by zone (see zonal_series.py)
+#e.g. HUC6_pr.annual_totals() -> (years, years x HUC6 annual rainfall), HUC6_pr.mean_annual_total() ~ HUC6_AP MEAN
+import zonal_series
+rain_fine = zonal_series.fine_grid(rain_grid, 25)
+with instrument.stage('pixel_weights'):
+    HUC6_pixels = zonal_series.pixel_weights(rain_grid, rain_labels.get_or_rasterize(HUC6_dat, 'HUC6', rain_fine),
+                                             'water_Scarcity/Precipitation/pixel_weights')
+    county_pixels = zonal_series.pixel_weights(rain_grid, rain_labels.get_or_rasterize(county, 'FIPS', rain_fine),
+                                               'water_Scarcity/Precipitation/pixel_weights')
+with instrument.stage('zone_series', rows_in=len(nc_years)):
+    HUC6_pr, county_pr = zonal_series.zone_series(nc_years, [HUC6_pixels, county_pixels], variable='pr', workers=None)
+HUC6_pr.save('water_Scarcity/Precipitation/HUC6_daily_pr.npz')
+county_pr.save('water_Scarcity/Precipitation/county_daily_pr.npz')
+
+#Compute HUC NDC (only for HUCs that intersect counties)
+covered = AREA_HUC6 > 0
+HUC6_NDC, rows = hashjoin.join({'HUC6': county_HUC6.target_keys[covered], 'AREA_GEO': AREA_HUC6[covered], 'SUM_SICsub': SIC_HUC6[covered]},
+                               HUC6_AP, 'HUC6', 'HUC6', how='inner', key_width='HUC6', fields=['MEAN'])
+HUC6_NDC['NDC_HUC'] = HUC6_NDC['SUM_SICsub']/(HUC6_NDC['MEAN']*HUC6_NDC['AREA_GEO'])
+hashjoin.write_table(db_scarcity + "/HUC6_SIC_pr", HUC6_NDC)
 
 #Export table as csv in arcmap
 ########################################################################################################################
@@ -245,113 +200,151 @@ with arcpy.da.UpdateCursor(HUC6_SIC_pr, ["SUM_SICsub",'MEAN','AREA_GEO','NDC_HUC
 #B. Compute endemism weighted richness and Threatened and Extinct Species Endemism weighted richness in each HUC ##
 ########################################################################################################################
 fishdiv = projdir+ "data/fish/FishDiversityMetrics.csv"
-db = "fish/Gage_analysis_fish.gdb/"
-fishdiv_db = db+"FishDiversityMetrics"
-
-#Export csv to geodatabase
-arcpy.TableToGeodatabase_conversion(fishdiv, db)
-#Add new HUC8 ID field
-arcpy.AddField_management(fishdiv_db, "HUC8_id", "TEXT")
-
-#Fill in 0s before HUC8 IDs of fish div data
-with arcpy.da.UpdateCursor(fishdiv_db, ['HUC8', 'HUC8_id']) as cursor:
-    for row in cursor:
-        if row[0] < 10000000:
-            row[1] = "0" + str(row[0])
-        else:
-            row[1] = str(row[0])
-        cursor.updateRow(row)
-
-#Join HUC8 shapefile with fish biodiv data
-HUC8div_join = db+"HUC8_fishdiv_join"
-arcpy.MakeFeatureLayer_management(HUC8_dat, "HUC8_lyr")
-arcpy.AddJoin_management(in_layer_or_view="HUC8_lyr", in_field="HUC_8", join_table=fishdiv_db, join_field="HUC8_id")
-arcpy.CopyFeatures_management("HUC8_lyr", HUC8div_join)
-
-#Add HUC6 field to layer in order to dissolve
-arcpy.AddField_management(HUC8div_join, "HUC6_id", "TEXT")
-[f.name for f in arcpy.ListFields(HUC8div_join)]
-with arcpy.da.UpdateCursor(HUC8div_join, ['HUC_8', 'HUC6_id']) as cursor:
-    for row in cursor:
-        row[1] = row[0][0:6]
-        cursor.updateRow(row)
-
-#Dissolve HUC6 levels while averaging the endemism weighted richness
-HUC6div = db+"HUC6_fishdiv"
-[f.name for f in arcpy.ListFields(HUC8div_join)]
-arcpy.AddField_management(HUC8div_join, "TE_EWU_numb", "DOUBLE")
-with arcpy.da.UpdateCursor(HUC8div_join, ['TE_EWU', "TE_EWU_numb"]) as cursor:
-    for row in cursor:
-        row[1] = row[0]
-        cursor.updateRow(row)
-arcpy.Dissolve_management(in_features=HUC8div_join, out_feature_class=HUC6div, dissolve_field=["HUC6_id"], statistics_fields=[['TotArea_x', 'SUM'],['EWU', 'MEAN'],
-                                                                                                                              ['TE_EWU_numb', 'MEAN'],['TE_Count', 'MEAN']])
+
+#Read csv straight into typed columns (no geodatabase table): HUC8 IDs are filled in with 0s to 8 characters and
+#TE_EWU is parsed as TE_EWU_numb (see csvingest.SCHEMAS). Null, coerced and rejected values are listed in
+#FishDiversityMetrics_ingest.json
+#(modules are imported in every section so that sections can be run on their own, see workflow.py)
+import csvingest
+import hashjoin
+import huc
+fishdiv_tab, fishdiv_report = csvingest.read_csv(fishdiv, 'FishDiversityMetrics')
+csvingest.write_report(fishdiv_report, "fish/FishDiversityMetrics_ingest.json", name='FishDiversityMetrics')
+
+#Join HUC8 attributes with fish biodiv data (keeping all HUC8s). Only attributes are needed to average HUC8s by HUC6,
+#so no feature class is created
+HUC8div_join, rows = hashjoin.join(hashjoin.read_table(HUC8_dat, fields=['HUC_8']), fishdiv_tab,
+                                   'HUC_8', 'HUC8', how='left', key_width='HUC8')
+
+#Average the endemism weighted richness of HUC8s in each HUC6 (the first 6 digits of HUC8 codes) with a grouped
+#reduction on the table rather than a Dissolve (change 'HUC6' to 'HUC4' to run the analysis at another level; to map
+#the result, see huc.dissolve)
+fish_level = 'HUC6'
+with instrument.stage('fish_rollup', rows_in=len(HUC8div_join['HUC_8'])) as step:
+    HUC6div = huc.rollup(HUC8div_join, 'HUC_8', fish_level, [('TotArea_x', 'TotArea_x', 'sum'), ('EWU', 'EWU', 'mean'),
+                                                             ('TE_EWU_numb', 'TE_EWU_numb', 'mean'), ('TE_Count', 'TE_Count', 'mean')],
+                         huc_level='HUC8')
+    step.rows_out = len(HUC6div[fish_level])
 
 #Export to table
-HUC6_tab = "fish\HUC6div.csv"
-[f.name for f in arcpy.ListFields(HUC6div)]
-with open(HUC6_tab, "wb") as csv_file:
+HUC6_tab = "fish/HUC6div.csv"
+with open(HUC6_tab, 'w', newline='') as csv_file:
     writer = csv.writer(csv_file)
     #Write headers
-    writer.writerow(['HUC6_id','TotArea_x', 'EWU', "TE_EWU_numb", 'TE_Count'])
-    with arcpy.da.SearchCursor(HUC6div, ['HUC6_id','SUM_TotArea_x', 'MEAN_EWU', "MEAN_TE_EWU_numb", 'MEAN_TE_Count']) as cursor:
-        for row in cursor:
-            writer.writerow(row)
+    writer.writerow([fish_level + '_id','TotArea_x', 'EWU', "TE_EWU_numb", 'TE_Count'])
+    for row in zip(HUC6div[fish_level], HUC6div['TotArea_x'], HUC6div['EWU'], HUC6div['TE_EWU_numb'], HUC6div['TE_Count']):
+        writer.writerow(row)
 
 ########################################################################################################################
 #C. Estimate number/percentage of people in each HUC6 that live in a flood zone
 ########################################################################################################################
+import colstore
+import flatgeom
+import geodesic
+import hashjoin
+import pointinpoly
+import tiled_overlay
+import zonal_stats
 flood_db = "flood/Flood_analysis.gdb/"
 pop_dat= flood_db + "Censusblock_US_merge"
 ZoneA_dat= flood_db + "S_Fld_Haz_Ar_ZoneA"
-LCD2011 = "F:\Data\\nlcd_2011_landcover_2011_edition_2014_10_10\\nlcd_2011_landcover_2011_edition_2014_10_10\\nlcd_2011_landcover_2011_edition_2014_10_10.img"
+LCD2011 = "F:/Data/nlcd_2011_landcover_2011_edition_2014_10_10/nlcd_2011_landcover_2011_edition_2014_10_10/nlcd_2011_landcover_2011_edition_2014_10_10.img"
 
 #Merge census blocks
 #In Arcmap, merge the census blocks of the 48 conterminous state into one dataset -> "F:\Miscellaneous\Hydro_classes\Analysis\Flood\Flood_analysis.gdb\Censusblock_US_merge"
-#Repair geometry of both flood zone data and popdat (a lot of self-intersections in the polygons)
-
-#Compute area of each census block
-arcpy.AddGeometryAttributes_management(Input_Features=pop_dat, Geometry_Properties="AREA_GEODESIC", Area_Unit= "SQUARE_KILOMETERS")
-arcpy.AlterField_management(in_table=pop_dat, field = "AREA_GEO", new_field_name='COUNTYAREA_GEO')
-
-#Convert LCD2011 original dataset to GRID format
-arcpy.CopyRaster_management(LCD2011, flood_db+"lcd2011", pixel_type="8_BIT_UNSIGNED")
-
-#Reclassify LCD2011 to have all urbanized pixels as 1 and all other pixels as NoData (could not get to run in Python)
-lcd2011_reclass = arcpy.sa.Reclassify(in_raster=LCD2011, reclass_field="VALUE", remap= arcpy.sa.RemapRange([[21,24,1],[0,20,0],[25,100,0]]), missing_values="DATA")
-lcd2011_reclass.save(flood_db + "lcd2011_reclass")
-
-#Compute intersection of each census block with each 100-yr flood zone
-censusflood_inters = flood_db + "censusflood_intersect"
-arcpy.Intersect_analysis(in_features = [pop_dat,ZoneA_dat], out_feature_class= censusflood_inters)
+#Geometries of both flood zone data and popdat have a lot of self-intersections: they are repaired tile by tile during
+#the intersections below (see tiled_overlay.py), the layers are not modified
+
+#Compute area of each census block (geodesic areas of all blocks are computed at once, in parallel, see geodesic.py)
+with instrument.stage('censusblock_area'):
+    geodesic.add_geodesic_area(pop_dat, field='COUNTYAREA_GEO', unit='SQUARE_KILOMETERS')
+
+#LCD2011 is not converted to GRID format nor reclassified to a new raster: the original dataset is read one window of
+#rows at a time and reclassified in memory (urbanized pixels as 1, all other pixels as 0) wherever it is needed, and
+#every raster calculator expression below is tallied directly by census block (see raster_algebra.py)
+import raster_algebra
+lcd_grid = zonal_stats.Grid.from_arcpy(LCD2011)
+lcd2011 = raster_algebra.ArcpyRaster(LCD2011, lcd_grid)
+#The expressions are sent to worker processes, so they are defined in raster_algebra.py rather than in this script
+lcd2011_reclass = raster_algebra.lcd2011_reclass
+urban = raster_algebra.urban
+flooded_urban = raster_algebra.flooded_urban
+
+#Compute intersection of each census block with each 100-yr flood zone, with the geodesic area of every piece
+#(AREA_GEO, km2) -> censusflood_intersect.parquet (FID_Censusblock_US_merge, FID_S_Fld_Haz_Ar_ZoneA: OBJECTIDs of the
+#census block and flood zone). The layers are intersected on a grid of 1-degree tiles, by a pool of worker processes
+censusflood_inters = "flood/censusflood_intersect.parquet"
+with instrument.stage('censusflood_intersect') as step:
+    step.rows_out = tiled_overlay.intersect_features([pop_dat, ZoneA_dat], ['OBJECTID', 'OBJECTID'], censusflood_inters,
+                                                     area_field='AREA_GEO', unit='SQUARE_KILOMETERS')
 
 #Lots of issues with these. Zonal statistics didn't work for most of these so had to do analysis in raster format on several different computers
 #Easier to troubleshoot in Arcmap, so did most of the following analysis in Arcmap.
+#Raster calculator steps now run within a fixed memory budget with one worker per core
+memory_budget = 8*1024**3
 
 #Convert census blocks to raster (with lcd2011_reclass extent, field = OBJECTID, output_cell size = 30m) -> censusblock_ras
+#Rasterizing the census blocks is the most expensive step of the flood analysis, so label rasters are cached and reused
+#for every overlay with land cover and FEMA data (see label_cache.py)
+import label_cache
+flood_labels = label_cache.LabelCache("flood/label_cache")
+with instrument.stage('censusblock_labels'):
+    censusblock_ras = flood_labels.get_or_rasterize(pop_dat, 'OBJECTID', lcd_grid)
 #Raster calculator: Con("lcd2011_reclass" == 1, "censusblock_ras", 0) -> output table to get the number of pixels in each census block that are urban -> censusblock_lcd_inters
+with instrument.stage('censusblock_urban') as step:
+    censusblock_lcd_inters = raster_algebra.count_by_label(censusblock_ras, {'lcd': lcd2011}, urban, memory_budget=memory_budget)
+    step.rows_out = len(censusblock_lcd_inters['Value'])
+flatgeom.write_dbf("flood/censusblock_lcd_inters_tab.dbf", censusblock_lcd_inters)
 
 #Convert censusflood_intersect to raster (with lcd2011_reclass extent, field = OBJECTID, output_cell size = 30m) -> censusflood_inters_ras_OBJECTID
+with instrument.stage('censusflood_labels'):
+    censusflood_inters_ras = flood_labels.get_or_rasterize(censusflood_inters, 'OBJECTID', lcd_grid)
 #With raster calculator: Con(("censusflood_inters_ras" > 1) & ("lcd2011_reclass" == 1), "censusflood_inters_ras", 0) -> censusflood_urban (same extent as previous layer)
+#-> number of urban pixels in each census block x flood zone intersection
+with instrument.stage('censusflood_urban') as step:
+    censusflood_urban = raster_algebra.count_by_label(censusflood_inters_ras, {'lcd': lcd2011}, urban, memory_budget=memory_budget)
+    step.rows_out = len(censusflood_urban['Value'])
+flatgeom.write_dbf("flood/censusflood_urbansum.dbf", censusflood_urban)
 
 #Rename census block area to AREA_GEOBLOCK
 #Add area of intersection between census block and flood zone to censusflood_intersect_2_proj table -> AREA_INTERS
 censusflood_intersect_2_proj = flood_db+"censusflood_intersect_2_proj"
-arcpy.AddGeometryAttributes_management(Input_Features=censusflood_intersect_2_proj, Geometry_Properties="AREA_GEODESIC", Area_Unit= "SQUARE_KILOMETERS")
+geodesic.add_geodesic_area(censusflood_intersect_2_proj, field='AREA_GEO', unit='SQUARE_KILOMETERS')
 #Export table -> censusflood_intersect_2.dbf
 
 #Project FEMA data to Albers Conical Equal Area -> S_Fled_Haz_Ar_proj
+ZoneA_proj = flood_db + "S_Fld_Haz_Ar_proj"
+arcpy.Project_management(ZoneA_dat, ZoneA_proj, arcpy.Describe(LCD2011).spatialReference)
 #Convert FEMA data to raster -> S_Fld_Haz_Ar_ras
+S_Fld_Haz_Ar_ras = flood_labels.get_or_rasterize(ZoneA_proj, 'OBJECTID', lcd_grid)
 #With raster calculator:  Con((S_Fld_Haz_Ar_ras == 1) & (LCD2011_reclass == 1), censusblock, 0)  -> censusFEMAdat_lcd_inters
 #Build raster attribute table and export table -> censusFEMAdat_lcd_inters_tab.dbf
+with instrument.stage('censusblock_flooded_urban') as step:
+    censusFEMAdat_lcd_inters = raster_algebra.count_by_label(censusblock_ras, {'lcd': lcd2011, 'flood': S_Fld_Haz_Ar_ras}, flooded_urban,
+                                                             memory_budget=memory_budget)
+    step.rows_out = len(censusFEMAdat_lcd_inters['Value'])
+flatgeom.write_dbf("flood/censusFEMAdat_lcd_inters_tab.dbf", censusFEMAdat_lcd_inters)
 
 #Select those census blocks with a population but no urban pixel that are not in Hawaii -> censusblock_nourban
 #Intersect with FEMA zone -> censusnourban_FEMA_intersect
 #Rename census block area to AREA_GEOBLOCK
 #Add area of intersection between census block and FEMA data to AREA_INTERS
 
-#Intersect census blocks with HUC6 -> Censusblock_HUC6_inters
-
-#Compute area
-censushuc6 = flood_db+"Censusblock_HUC6_inters"
-arcpy.AddGeometryAttributes_management(Input_Features=censushuc6, Geometry_Properties="AREA_GEODESIC", Area_Unit= "SQUARE_KILOMETERS")
\ No newline at end of file
+#Intersect census blocks with HUC6 and compute area -> Censusblock_HUC6_inters.parquet (columnar store, see colstore.py)
+#The layers are intersected HUC4 by HUC4 (tiles made of the HUC6s of every HUC4), by a pool of worker processes, and
+#the geodesic area of every piece is computed (see tiled_overlay.py)
+pop_sr = arcpy.Describe(pop_dat).spatialReference
+HUC6_index = pointinpoly.load_or_build(HUC6_dat, 'HUC6', "flood/HUC6_index.npz", spatial_reference=pop_sr)
+HUC4_tiles = tiled_overlay.PolygonTiles(HUC6_index, keys=[str(h)[:4] for h in HUC6_index.feature_ids])
+with instrument.stage('censusblock_HUC6_intersect') as step:
+    step.rows_out = tiled_overlay.intersect_features([pop_dat, HUC6_dat], ['OBJECTID', 'HUC6'], "flood/censusblock_HUC6_intersect.parquet",
+                                                     tiles=HUC4_tiles, area_field='AREA_BLOCK', unit='SQUARE_KILOMETERS')
+census_HUC6 = colstore.read_table("flood/censusblock_HUC6_intersect.parquet", fields=['FID_Censusblock_US_merge', 'FID_HUC6', 'AREA_BLOCK'])
+censushuc6, rows = hashjoin.join({'OBJECTID': census_HUC6['FID_Censusblock_US_merge'], 'HUC6': census_HUC6['FID_HUC6'],
+                                  'AREA_BLOCK': census_HUC6['AREA_BLOCK']},
+                                 fieldcalc.read_columns(pop_dat, ['OBJECTID', 'BLOCKID10', 'POP10', 'COUNTYAREA_GEO']), 'OBJECTID', 'OBJECTID',
+                                 how='inner', fields=['BLOCKID10', 'POP10', 'COUNTYAREA_GEO'])
+#7Flood_analysis.R weights the population of every block (POP10) by the share of its geodesic area (AREA_GEOBL) in each HUC6
+hashjoin.write_table("flood/Censusblock_HUC6_inters.parquet", {'OBJECTID': censushuc6['OBJECTID'], 'BLOCKID10': censushuc6['BLOCKID10'],
+                                                              'POP10': censushuc6['POP10'], 'AREA_GEOBL': censushuc6['COUNTYAREA_GEO'],
+                                                              'HUC6': censushuc6['HUC6'], 'AREA_BLOCK': censushuc6['AREA_BLOCK']})
\ No newline at end of file
@@ -0,0 +1,430 @@
+#Creation date: October 2026
+
+#Objective: Time the heavy stages of the analysis on synthetic inputs (see synthetic.py) and save the results as JSON,
+#           so that the performance of two commits can be compared
+#           - snap_cascade: join + snap of gages to network and non-network flowlines (gagesnap.cascade, 3Gages B.)
+#           - lazy_snap: snap of gages to flowlines indexed in geographic coordinates, projecting only the tiles near
+#             the gages, with no projected tile on disk yet (projection.py, 3Gages B.)
+#           - gage_refresh: diff of a new NWIS export against the previous sites, cascade of the sites that changed and
+#             merge into the previous positions (gagerefresh.py, 3Gages D.)
+#           - rainfall_climatology: average annual rainfall over yearly daily NetCDF files (6Gages A.)
+#           - zone_series: daily precipitation series of every HUC6 from the same files (6Gages A.)
+#           - zonal_stats: rasterization of counties on the rainfall grid and statistics by county (6Gages A.)
+#           - zonal_stats_labels: statistics of a flood mask by census block from a cached label raster (6Gages C.)
+#           - area_weights: county x HUC6 overlay on a fine geographic grid and SIC sum by HUC6 (6Gages A.)
+#           - tiled_intersect: census blocks x flood zones intersection and geodesic areas, tile by tile (6Gages C.)
+#           - fish_rollup: parsing of the fish diversity csv, join with HUC8s and average by HUC6 (6Gages B.)
+#           - wsr_proximity: Wild and Scenic River segments within 500 m of every gage (10wsrgages.py)
+#           Every benchmark runs in its own process, so that its peak resident memory (peak_rss_mb) is not inflated
+#           by the others. Inputs are generated before the timed runs (setup_time, setup_rss_mb), and the size of
+#           every input is multiplied by --scale (scale 1 runs in less than a minute; timings of different scales are not
+#           comparable).
+#           Throughput is the number of items (gages, cells, records...) processed per second in the median run.
+#
+#           python benchmarks.py [benchmark ...] [--scale 1] [--repeat 3] [--out results.json] [--fixtures dir]
+#                                [--compare previous.json]
+#           --fixtures keeps the NetCDF files and label rasters in dir to reuse them in later runs, --compare prints
+#           the ratio of every median time to that of a previous result file and exits with status 1 if any
+#           benchmark is more than 10% slower.
+
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+
+import numpy as np
+
+import synthetic
+from instrument import peak_rss
+
+scripts = os.path.dirname(os.path.abspath(__file__))
+
+
+def _size(n, scale):
+    return max(1, int(round(n * scale)))
+
+
+########################################################################################################################
+# BENCHMARKS
+#Every benchmark generates its inputs and returns (number of items, unit, parameters, timed function)
+def snap_cascade(scale, fixtures):
+    import gagesnap
+    network = synthetic.flowlines(_size(50000, scale), seed=1)
+    nonetwork = synthetic.flowlines(_size(10000, scale), seed=2)
+    net_index = gagesnap.FlowlineIndex.from_geometry(network, np.arange(len(network)), 'network')
+    nonet_index = gagesnap.FlowlineIndex.from_geometry(nonetwork, np.arange(len(nonetwork)) + len(network), 'nonetwork')
+    g = synthetic.gages(network, _size(20000, scale), seed=3)
+    #About a third of the gages are NHDPlus gage events
+    events = np.arange(0, len(g['x']), 3)
+    tiers = [gagesnap.JoinTier('NHD2join', g['site_no'][events], g['x'][events], g['y'][events], g['feature'][events]),
+             gagesnap.SnapTier(net_index, tolerance=500, positioning='snapped'),
+             gagesnap.SnapTier(nonet_index, tolerance=500, positioning='snapped')]
+    params = {'gages': len(g['x']), 'network_segments': len(net_index.x0), 'nonetwork_segments': len(nonet_index.x0)}
+    return len(g['x']), 'gages', params, lambda: gagesnap.cascade(g['site_no'], g['x'], g['y'], tiers)
+
+
+def lazy_snap(scale, fixtures):
+    import flatgeom
+    import gagesnap
+    import projection
+    albers, nad83 = 'ESRI:102003', 'EPSG:4269'
+    network = synthetic.flowlines(_size(200000, scale), seed=1)
+    #A few thousand gages reach the snapping tiers
+    g = synthetic.gages(network, _size(3000, scale), seed=3)
+    lon, lat = projection.transform(network.xy[:, 0], network.xy[:, 1], albers, nad83)
+    geo = flatgeom.FlatGeometry(np.column_stack([lon, lat]), network.part_offsets, network.geom_offsets, network.kind)
+    index = gagesnap.FlowlineIndex.from_geometry(geo, np.arange(len(network)), 'network')
+    layer = projection.GeographicFlowlines(index, nad83, os.path.join(fixtures, 'lazy_snap_{0:g}'.format(scale)),
+                                           version=['synthetic', len(network)])
+
+    def run():
+        projected = layer.projected(albers)
+        shutil.rmtree(projected.tile_dir, ignore_errors=True)
+        return projected.snap(g['x'], g['y'], tolerance=500)
+
+    return len(g['x']), 'gages', {'gages': len(g['x']), 'segments': len(index.x0)}, run
+
+
+def gage_refresh(scale, fixtures):
+    import gagerefresh
+    import gagesnap
+    network = synthetic.flowlines(_size(50000, scale), seed=1)
+    net_index = gagesnap.FlowlineIndex.from_geometry(network, np.arange(len(network)), 'network')
+    g = synthetic.gages(network, _size(25000, scale), seed=3)
+    n = len(g['x'])
+    rng = np.random.RandomState(11)
+    days = rng.randint(0, 366, (n, 60)).astype(np.float64)
+    #Previous export (coordinates are in the projected system here), and previous positions of all the sites
+    export = dict(('{0}'.format(1950 + i), days[:, i]) for i in range(days.shape[1]))
+    export.update({'site_no': g['site_no'], 'dec_long_va': -g['x'], 'dec_lat_va': g['y']})
+    previous = gagerefresh.site_table(export)
+    tiers = [gagesnap.SnapTier(net_index, tolerance=500, positioning='snapped')]
+    pos = gagesnap.cascade(previous['site_no'], g['x'], g['y'], tiers)
+    fields = ['site_no', 'positioning', 'tier', 'tier_rank', 'flowline_id', 'distance', 'x', 'y']
+    positions = dict((f, pos[f]) for f in fields)
+    #New export: a few dozen sites added, removed, moved and with new records
+    k = _size(30, scale)
+    new = dict((f, v[k:]) for f, v in export.items())
+    new['dec_long_va'] = new['dec_long_va'].copy()
+    new['dec_long_va'][:k] -= 1000.0
+    new['1950'] = new['1950'].copy()
+    new['1950'][k:2 * k] += 1
+    extra = synthetic.gages(network, k, seed=12)
+    for f, v in [('site_no', extra['site_no']), ('dec_long_va', -extra['x']), ('dec_lat_va', extra['y'])]:
+        new[f] = np.concatenate([new[f], v])
+    for i in range(days.shape[1]):
+        new['{0}'.format(1950 + i)] = np.concatenate([new['{0}'.format(1950 + i)], np.full(k, 100.0)])
+
+    def run():
+        sites = gagerefresh.site_table(new)
+        changes = gagerefresh.diff(sites, previous, tolerance=1e-3)
+        todo = np.isin(sites['site_no'], changes['site_no'][np.isin(changes['change'], gagerefresh.REPROCESS)])
+        pos = gagesnap.cascade(sites['site_no'][todo], -sites['lon'][todo], sites['lat'][todo], tiers)
+        return gagerefresh.merge(positions, dict((f, pos[f]) for f in fields),
+                                 changes['site_no'][changes['change'] != 'records'])
+
+    return n, 'sites', {'sites': n, 'changed': 4 * k}, run
+
+
+def rainfall_climatology(scale, fixtures):
+    import rainfall_climatology as rc
+    years = range(1949, 1949 + _size(4, scale))
+    paths = synthetic.precip_years(os.path.join(fixtures, 'nldas'), years, seed=4)
+    nlat, nlon, days = 224, 464, 365
+    params = {'years': len(paths), 'nlat': nlat, 'nlon': nlon}
+    return len(paths) * days * nlat * nlon, 'cell-days', params, lambda: rc.rainfall_climatology(paths).mean()
+
+
+def zone_series(scale, fixtures):
+    import label_cache
+    import zonal_series
+    import zonal_stats
+    #Daily series of 300 HUC6 from the same files as rainfall_climatology (weights computed on a 10 times finer grid)
+    years = range(1949, 1949 + _size(4, scale))
+    paths = synthetic.precip_years(os.path.join(fixtures, 'nldas'), years, seed=4)
+    nlat, nlon, days = 224, 464, 365
+    xmin, ymin = synthetic.CONUS_NAD83[:2]
+    grid = zonal_stats.Grid(xmin, ymin + nlat * 0.125, 0.125, nlat, nlon, crs=4269)
+    hucs = synthetic.tiling(20, 15, extent=(grid.xmin, grid.ymin, grid.xmax, grid.ymax), jitter=0.4, seed=8)
+    fine = zonal_series.fine_grid(grid, 10)
+    cache = label_cache.LabelCache(os.path.join(fixtures, 'label_cache'))
+    huc_layer = os.path.join(fixtures, 'HUC6_series')
+    labels = cache.get(huc_layer, 'HUC6', fine) or cache.put(huc_layer, 'HUC6', fine, hucs, synthetic.codes(len(hucs), 6, seed=8))
+    weights = zonal_series.pixel_weights(grid, labels, os.path.join(fixtures, 'pixel_weights'))
+    params = {'years': len(paths), 'nlat': nlat, 'nlon': nlon, 'hucs': len(hucs), 'weights': len(weights.area)}
+    return len(paths) * days * nlat * nlon, 'cell-days', params, lambda: zonal_series.zone_series(paths, weights)
+
+
+def _rain_grid(scale):
+    import zonal_stats
+    #NLDAS grid (1/8 degree) refined with the scale
+    cellsize = 0.125 / np.sqrt(scale)
+    xmin, ymin, xmax, ymax = synthetic.CONUS_NAD83
+    return zonal_stats.Grid.from_extent(xmin, ymin, xmax, ymax, cellsize, crs=4269)
+
+
+def zonal_stats(scale, fixtures):
+    import zonal_stats
+    grid = _rain_grid(scale)
+    counties = synthetic.tiling(_size(70, np.sqrt(scale)), _size(45, np.sqrt(scale)), seed=5)
+    fips = synthetic.codes(len(counties), 5, seed=5)
+    rainfall = np.random.RandomState(5).gamma(2.0, 400.0, grid.shape)
+    params = {'counties': len(counties), 'nrows': grid.nrows, 'ncols': grid.ncols}
+    return grid.nrows * grid.ncols, 'cells', params, lambda: zonal_stats.zonal_stats(counties, fips, rainfall, grid)
+
+
+def zonal_stats_labels(scale, fixtures):
+    import label_cache
+    import zonal_stats
+    #Census blocks on a 30 m grid (Albers) of about 16 million cells at scale 1
+    n = _size(4000, np.sqrt(scale))
+    xmin, ymin = synthetic.CONUS_ALBERS[:2]
+    grid = zonal_stats.Grid(xmin, ymin + n * 30.0, 30.0, n, n)
+    blocks = synthetic.tiling(_size(300, np.sqrt(scale)), _size(300, np.sqrt(scale)),
+                              extent=(grid.xmin, grid.ymin, grid.xmax, grid.ymax), seed=6)
+    cache = label_cache.LabelCache(os.path.join(fixtures, 'label_cache'))
+    layer = os.path.join(fixtures, 'censusblocks_{0}'.format(n))
+    labels = cache.get(layer, 'OBJECTID', grid) or cache.put(layer, 'OBJECTID', grid, blocks,
+                                                             np.arange(1, len(blocks) + 1))
+    flood = synthetic.flood_mask(grid, fraction=0.1, seed=6, path=os.path.join(fixtures, 'flood_{0}.npy'.format(n)))
+    params = {'blocks': len(blocks), 'nrows': grid.nrows, 'ncols': grid.ncols}
+    return grid.nrows * grid.ncols, 'cells', params, lambda: labels.zonal_stats(flood)
+
+
+def area_weights(scale, fixtures):
+    import geodesic
+    import label_cache
+    import overlay
+    import zonal_stats
+    #0.0025 degree grid of 6.6 million cells at scale 1 (the extent grows with the scale)
+    xmin, ymin = synthetic.CONUS_NAD83[:2]
+    side = np.sqrt(scale)
+    extent = (xmin, ymin, xmin + 8.0 * side, ymin + 8.0 * side)
+    grid = zonal_stats.Grid.from_extent(extent[0], extent[1], extent[2], extent[3], 0.0025, crs=4269)
+    counties = synthetic.tiling(_size(40, side), _size(40, side), extent=extent, seed=7)
+    hucs = synthetic.tiling(_size(10, side), _size(10, side), extent=extent, jitter=0.4, seed=8)
+    cache = label_cache.LabelCache(os.path.join(fixtures, 'label_cache'))
+    fips = synthetic.codes(len(counties), 5, seed=7)
+    county_layer, huc_layer = [os.path.join(fixtures, '{0}_{1:g}'.format(name, scale)) for name in ('counties', 'HUC6')]
+    county_labels = cache.get(county_layer, 'FIPS', grid) or cache.put(county_layer, 'FIPS', grid, counties, fips)
+    huc_labels = cache.get(huc_layer, 'HUC6', grid) or cache.put(huc_layer, 'HUC6', grid, hucs,
+                                                                 synthetic.codes(len(hucs), 6, seed=8))
+    sic = np.random.RandomState(7).uniform(0, 2, len(counties))
+
+    def run():
+        weights = overlay.AreaWeights.from_labels(county_labels, huc_labels, ellipsoid=geodesic.GRS80)
+        return weights.sum(weights.align(fips, sic, key_width='FIPS')), weights.covered_area()
+
+    params = {'counties': len(counties), 'hucs': len(hucs), 'nrows': grid.nrows, 'ncols': grid.ncols}
+    return grid.nrows * grid.ncols, 'cells', params, run
+
+
+def tiled_intersect(scale, fixtures):
+    import shutil
+    import tiled_overlay
+    #60,000 census blocks intersected with 1,200 flood zones at scale 1 (the extent grows with the scale)
+    xmin, ymin = synthetic.CONUS_NAD83[:2]
+    side = np.sqrt(scale)
+    extent = (xmin, ymin, xmin + 6.0 * side, ymin + 4.0 * side)
+    blocks = synthetic.tiling(_size(300, side), _size(200, side), extent=extent, seed=11)
+    zones = synthetic.tiling(_size(40, side), _size(30, side), extent=extent, jitter=0.45, seed=12)
+    out = os.path.join(fixtures, 'tiled_intersect_{0:g}.parquet'.format(scale))
+
+    def run():
+        #Chunks written by a previous repetition would be reused
+        shutil.rmtree(out, ignore_errors=True)
+        return tiled_overlay.intersect(blocks, zones, out, np.arange(len(blocks)), np.arange(len(zones)))
+
+    params = {'blocks': len(blocks), 'zones': len(zones)}
+    return len(blocks), 'features', params, run
+
+
+def fish_rollup(scale, fixtures):
+    import csv
+    import csvingest
+    import hashjoin
+    import huc
+    fish = synthetic.huc8_table(_size(2000, scale), seed=9)
+    #HUC8 polygons, with leading zeros, and a few HUC8s with no fish data
+    huc8 = {'HUC_8': np.char.zfill(np.concatenate([fish['HUC8'], ['99999901', '99999902']]), 8)}
+    path = os.path.join(fixtures, 'FishDiversityMetrics_{0:g}.csv'.format(scale))
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(list(fish))
+        writer.writerows(zip(*fish.values()))
+
+    def run():
+        fish_tab, report = csvingest.read_csv(path, 'FishDiversityMetrics')
+        table, rows = hashjoin.join(huc8, fish_tab, 'HUC_8', 'HUC8', how='left', key_width='HUC8')
+        return huc.rollup(table, 'HUC_8', 'HUC6', [('TotArea_x', 'TotArea_x', 'sum'), ('EWU', 'EWU', 'mean'),
+                                                   ('TE_EWU_numb', 'TE_EWU_numb', 'mean'),
+                                                   ('TE_Count', 'TE_Count', 'mean')], huc_level='HUC8')
+
+    return len(huc8['HUC_8']), 'records', {'huc8': len(huc8['HUC_8'])}, run
+
+
+def wsr_proximity(scale, fixtures):
+    import proximity
+    rivers = synthetic.flowlines(_size(300, scale), vertices=200, step=300.0, seed=10)
+    index = proximity.ReachIndex.from_geometry(rivers, np.arange(1, len(rivers) + 1),
+                                               np.array(['River {0}'.format(i) for i in range(len(rivers))]), 'wsr')
+    #Most gages are away from the rivers, as in the real data
+    near = synthetic.gages(rivers, _size(2000, scale), offset=300.0, seed=11)
+    xmin, ymin, xmax, ymax = synthetic.CONUS_ALBERS
+    rng = np.random.RandomState(11)
+    n = _size(18000, scale)
+    x = np.concatenate([near['x'], rng.uniform(xmin, xmax, n)])
+    y = np.concatenate([near['y'], rng.uniform(ymin, ymax, n)])
+    params = {'gages': len(x), 'segments': len(index.x0)}
+    return len(x), 'gages', params, lambda: index.near(x, y, radius=500.0)
+
+
+BENCHMARKS = [('snap_cascade', snap_cascade), ('lazy_snap', lazy_snap), ('gage_refresh', gage_refresh),
+              ('rainfall_climatology', rainfall_climatology), ('zone_series', zone_series), ('zonal_stats', zonal_stats),
+              ('zonal_stats_labels', zonal_stats_labels), ('area_weights', area_weights), ('tiled_intersect', tiled_intersect), ('fish_rollup', fish_rollup),
+              ('wsr_proximity', wsr_proximity)]
+
+
+########################################################################################################################
+# RUNNER
+def _mb(nbytes):
+    return None if nbytes is None else round(nbytes / 2.0 ** 20, 1)
+
+
+def _measure(name, scale, repeat, fixtures, queue):
+    #Runs in a child process
+    try:
+        func = dict(BENCHMARKS)[name]
+        start = time.time()
+        n, unit, params, run = func(scale, fixtures)
+        setup_time = time.time() - start
+        setup_rss = peak_rss()
+        times, cpu = [], []
+        for i in range(repeat):
+            t0, c0 = time.time(), time.process_time()
+            run()
+            times.append(time.time() - t0)
+            cpu.append(time.process_time() - c0)
+        median = float(np.median(times))
+        queue.put({'name': name, 'n': n, 'unit': unit, 'params': params, 'times': times, 'cpu_times': cpu,
+                   'best': min(times), 'median': median,
+                   'throughput': n / median if median > 0 else None, 'throughput_unit': unit + '/s',
+                   'setup_time': setup_time, 'setup_rss_mb': _mb(setup_rss), 'peak_rss_mb': _mb(peak_rss())})
+    except Exception:
+        queue.put({'name': name, 'error': traceback.format_exc()})
+
+
+def run_benchmark(name, scale=1.0, repeat=3, fixtures=None):
+    """Run benchmark name in a child process and return its result (a dict, with 'error' if it failed)."""
+    queue = multiprocessing.Queue()
+    proc = multiprocessing.Process(target=_measure, args=(name, scale, repeat, fixtures, queue))
+    proc.start()
+    result = queue.get()
+    proc.join()
+    return result
+
+
+def _git(*args):
+    try:
+        return subprocess.check_output(('git',) + args, cwd=scripts, stderr=subprocess.STDOUT).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    """Commit (and whether the working tree has uncommitted changes), date and machine of a run."""
+    status = _git('status', '--porcelain', '--untracked-files=no')
+    return {'commit': _git('rev-parse', 'HEAD'), 'dirty': bool(status) if status is not None else None,
+            'date': datetime.datetime.now().isoformat(), 'python': platform.python_version(),
+            'numpy': np.__version__, 'platform': platform.platform(), 'cpu_count': multiprocessing.cpu_count()}
+
+
+def run(names=None, scale=1.0, repeat=3, fixtures=None, out=None):
+    """Run benchmarks (all of them if names is None) and save the results to out (JSON) if given.
+
+    fixtures is the directory where NetCDF files and label rasters are written (a temporary directory, deleted at the
+    end, if None).
+    """
+    unknown = set(names or []) - set(dict(BENCHMARKS))
+    if unknown:
+        raise ValueError('Unknown benchmarks: {0}'.format(', '.join(sorted(unknown))))
+    tmp = None
+    if fixtures is None:
+        fixtures = tmp = tempfile.mkdtemp(prefix='benchmarks_')
+    results = dict(environment(), scale=scale, repeat=repeat, results={})
+    try:
+        for name, func in BENCHMARKS:
+            if names and name not in names:
+                continue
+            res = run_benchmark(name, scale=scale, repeat=repeat, fixtures=fixtures)
+            results['results'][name] = res
+            if 'error' in res:
+                print('{0}: FAILED\n{1}'.format(name, res['error']))
+            else:
+                print('{0}: {1:.3f} s median, {2:.4g} {3}, peak RSS {4} MB'.format(
+                    name, res['median'], res['throughput'] or 0, res['throughput_unit'], res['peak_rss_mb']))
+    finally:
+        if tmp is not None:
+            shutil.rmtree(tmp, ignore_errors=True)
+    if out is not None:
+        with open(out, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    return results
+
+
+def compare(previous, current, tolerance=0.1):
+    """Ratio of the median time of every benchmark in current to that in previous (results or paths to JSON files).
+
+    Returns a list of (name, previous median, current median, ratio, regressed), regressed being True if the ratio is
+    above 1 + tolerance. Only benchmarks that succeeded in both runs are compared.
+    """
+    if not isinstance(previous, dict):
+        with open(previous) as f:
+            previous = json.load(f)
+    if not isinstance(current, dict):
+        with open(current) as f:
+            current = json.load(f)
+    if previous.get('scale') != current.get('scale'):
+        print('Warning: comparing runs at different scales ({0} and {1})'.format(previous.get('scale'),
+                                                                                  current.get('scale')))
+    out = []
+    for name, func in BENCHMARKS:
+        old, new = previous['results'].get(name, {}), current['results'].get(name, {})
+        if 'median' not in old or 'median' not in new:
+            continue
+        ratio = new['median'] / old['median'] if old['median'] > 0 else float('inf')
+        out.append((name, old['median'], new['median'], ratio, ratio > 1 + tolerance))
+    return out
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    options = {}
+    for opt in ('--scale', '--repeat', '--out', '--fixtures', '--compare'):
+        if opt in args:
+            i = args.index(opt)
+            options[opt] = args[i + 1]
+            del args[i:i + 2]
+    scale = float(options.get('--scale', 1))
+    out = options.get('--out')
+    if out is None:
+        #One file per commit and scale
+        commit = (_git('rev-parse', '--short', 'HEAD') or 'nocommit')
+        out = 'benchmarks_{0}_scale{1:g}.json'.format(commit, scale)
+    results = run(names=args or None, scale=scale, repeat=int(options.get('--repeat', 3)),
+                  fixtures=options.get('--fixtures'), out=out)
+    print('Results saved to {0}'.format(out))
+    if '--compare' in options:
+        regressed = False
+        for name, old, new, ratio, slower in compare(options['--compare'], results):
+            print('{0:<22} {1:9.3f} s -> {2:9.3f} s  x{3:.2f}{4}'.format(name, old, new, ratio,
+                                                                         '  REGRESSION' if slower else ''))
+            regressed |= slower
+        sys.exit(1 if regressed else 0)
@@ -0,0 +1,447 @@
+#Creation date: October 2026
+
+#Objective: Store intermediate tables and features as columnar files (GeoParquet, or Arrow IPC/Feather) instead of
+#           full copies to file geodatabases, shapefiles and .dbf tables, so that every step (and the R scripts, with
+#           the arrow package) only reads the columns and rows that it uses
+#           - Geometries are stored as WKB in a 'geometry' column with the GeoParquet metadata (encoding, geometry
+#             types, CRS, bbox), plus a 'bbox' column (xmin, ymin, xmax, ymax) so that reads can be restricted to an
+#             extent. Points are written as Point, polylines as MultiLineString and polygons as MultiPolygon (rings
+#             are grouped into polygons by orientation, rings keep their order and orientation)
+#           - WKB is encoded and decoded for all features at once from the flat arrays of a FlatGeometry (see
+#             flatgeom.py), without a geometry object per feature
+#           - Reads only load the requested columns (column projection) and skip the row groups and partitions that
+#             can not match filters on keys (predicate pushdown), e.g. {'HUC2': ['01', '02']} or {'site_no': ids}.
+#             Keys named as in hashjoin.KEY_WIDTHS (FIPS, HUC8, site_no...) are zero-padded before filtering
+#           - Datasets can be partitioned by a key (e.g. HUC2: one folder HUC2=01, HUC2=02... per value), so that
+#             reading one region does not even open the files of the others
+#           - Arrow IPC files (.arrow, .feather) are read memory-mapped: numeric columns without nulls are numpy
+#             views of the file (zero-copy)
+#           The format is chosen from the extension of the path ('.parquet', or '.arrow'/'.feather'/'.ipc'); a
+#           partitioned dataset is a folder with that extension. Requires pyarrow.
+#           In R: arrow::open_dataset('x.parquet') %>% filter(HUC2 != '20') %>% select(site_no, HUC6) %>% collect()
+
+import os
+import shutil
+
+import numpy as np
+
+import flatgeom
+import hashjoin
+from flatgeom import FlatGeometry, POINT, POLYLINE, POLYGON, MULTIPOINT, _gather, _local_index, _ranges
+
+FORMATS = {'.parquet': 'parquet', '.arrow': 'ipc', '.feather': 'ipc', '.ipc': 'ipc'}
+GEOMETRY = 'geometry'
+BBOX = 'bbox'
+
+#WKB type of every kind of FlatGeometry, and GeoParquet name of every WKB type
+WKB_TYPE = {POINT: 1, MULTIPOINT: 4, POLYLINE: 5, POLYGON: 6}
+WKB_NAME = {1: 'Point', 2: 'LineString', 3: 'Polygon', 4: 'MultiPoint', 5: 'MultiLineString', 6: 'MultiPolygon'}
+WKB_KIND = {1: POINT, 4: MULTIPOINT, 2: POLYLINE, 5: POLYLINE, 3: POLYGON, 6: POLYGON}
+
+
+def is_store(path):
+    """True if path is a columnar file or dataset (by extension)."""
+    return os.path.splitext(os.path.normpath(str(path)))[1].lower() in FORMATS
+
+
+def _format(path):
+    ext = os.path.splitext(os.path.normpath(path))[1].lower()
+    if ext not in FORMATS:
+        raise ValueError('Unknown columnar format {0!r}, must be one of {1}'.format(ext, sorted(FORMATS)))
+    return FORMATS[ext]
+
+
+########################################################################################################################
+# WKB
+def _u32(values, n):
+    return np.broadcast_to(np.asarray(values, dtype='<u4'), (n,)).copy().view(np.uint8).reshape(n, 4)
+
+
+def _wkb_header(wkb_type, n, count=None):
+    #Byte order (1: little endian), type and count (if given) of n geometries, as an (n, 5 or 9) uint8 array
+    parts = [np.ones((n, 1), dtype=np.uint8), _u32(wkb_type, n)]
+    if count is not None:
+        parts.append(_u32(count, n))
+    return np.hstack(parts)
+
+
+def _ring_groups(geoms):
+    #Polygon of every ring: a ring starts a new polygon if it is the first ring of its feature or if it has the same
+    #orientation as that first ring (outer rings are clockwise in shapefiles and geodatabases, counter-clockwise in
+    #OGC data, so the first ring of a feature gives the convention)
+    x, y = geoms.xy[:, 0], geoms.xy[:, 1]
+    cross = np.zeros(len(x))
+    cross[:-1] = x[:-1] * y[1:] - x[1:] * y[:-1]
+    first = geoms.part_offsets[:-1]
+    last = geoms.part_offsets[1:] - 1
+    #Pairs of vertices that span two rings do not count (rings are closed, so the last pair of a ring is kept)
+    cross[last[last >= 0]] = 0
+    nonempty = last >= first
+    area = np.zeros(len(first))
+    if nonempty.any():
+        area[nonempty] = np.add.reduceat(cross, first[nonempty])
+    nrings = np.diff(geoms.geom_offsets)
+    ring_geom = np.repeat(np.arange(len(geoms)), nrings)
+    first_ring = np.zeros(len(first), dtype=bool)
+    first_ring[geoms.geom_offsets[:-1][nrings > 0]] = True
+    starts = first_ring | (np.sign(area) == np.sign(area[geoms.geom_offsets[:-1][ring_geom]]))
+    return starts, ring_geom
+
+
+def to_wkb(geoms):
+    """WKB of every feature of a FlatGeometry, as (offsets, data): feature i is data[offsets[i]:offsets[i + 1]].
+    Features with no parts (null geometries) are empty."""
+    n = len(geoms)
+    nparts = np.diff(geoms.geom_offsets)
+    npoints = np.diff(geoms.part_offsets)
+    part_geom = np.repeat(np.arange(n), nparts)
+    first_part = np.zeros(len(npoints), dtype=bool)
+    first_part[geoms.geom_offsets[:-1][nparts > 0]] = True
+    #Header bytes written before the coordinates of every part: (present, bytes) blocks, in order
+    every = np.ones(len(npoints), dtype=bool)
+    if geoms.kind == POINT:
+        blocks = [(first_part, _wkb_header(1, len(npoints)))]
+    elif geoms.kind == MULTIPOINT:
+        blocks = [(first_part, _wkb_header(4, len(npoints), nparts[part_geom])),
+                  (every, _wkb_header(1, len(npoints)))]
+    elif geoms.kind == POLYLINE:
+        blocks = [(first_part, _wkb_header(5, len(npoints), nparts[part_geom])),
+                  (every, _wkb_header(2, len(npoints), npoints))]
+    elif geoms.kind == POLYGON:
+        starts, ring_geom = _ring_groups(geoms)
+        poly = np.cumsum(starts) - 1
+        npolys = np.bincount(ring_geom[starts], minlength=n)
+        nrings = np.bincount(poly, minlength=poly[-1] + 1 if len(poly) else 0)
+        blocks = [(first_part, _wkb_header(6, len(npoints), npolys[part_geom])),
+                  (starts, _wkb_header(3, len(npoints), nrings[poly])), (every, _u32(npoints, len(npoints)))]
+    else:
+        raise ValueError('Unknown geometry kind {0!r}'.format(geoms.kind))
+    present = np.hstack([np.repeat(m[:, None], b.shape[1], axis=1) for m, b in blocks])
+    header = np.hstack([b for m, b in blocks])[present]
+    header_len = present.sum(axis=1)
+    coords = np.ascontiguousarray(geoms.xy, dtype='<f8').view(np.uint8).ravel()
+    data = np.insert(coords, np.repeat(16 * geoms.part_offsets[:-1], header_len), header)
+    part_len = header_len + 16 * npoints
+    size = np.bincount(part_geom, weights=part_len, minlength=n).astype(np.int64)
+    return np.concatenate([[0], np.cumsum(size)]), data
+
+
+def _children(data, pos, wkb_type):
+    #Start and type of every child of multi geometries (the geometry itself for single geometries), in order
+    multi = wkb_type >= 4
+    count = np.where(multi, _gather(data, '<u4', pos + 5).astype(np.int64) if len(pos) else 0, 1)
+    owner = np.repeat(np.arange(len(pos)), count)
+    k = _local_index(count)
+    start = np.zeros(len(owner), dtype=np.int64)
+    first = k == 0
+    start[first] = np.where(multi, pos + 9, pos)[owner[first]]
+    #Children follow each other: the start of child k is the end of child k - 1
+    for j in range(1, int(count.max(initial=0))):
+        cur = np.flatnonzero(k == j)
+        start[cur] = start[cur - 1] + _sizes(data, start[cur - 1])
+    return owner, k, start
+
+
+def _sizes(data, pos):
+    #Size in bytes of single geometries (Point, LineString, Polygon) starting at pos
+    wkb_type = _gather(data, '<u4', pos + 1)
+    out = np.full(len(pos), 21, dtype=np.int64)
+    line = wkb_type == 2
+    out[line] = 9 + 16 * _gather(data, '<u4', pos[line] + 5).astype(np.int64)
+    poly = np.flatnonzero(wkb_type == 3)
+    if len(poly):
+        owner, k, start, npts = _rings(data, pos[poly])
+        out[poly] = 9 + np.bincount(owner, weights=4 + 16 * npts, minlength=len(poly)).astype(np.int64)
+    return out
+
+
+def _rings(data, pos):
+    #Polygon, index in the polygon, start and number of points of every ring of the Polygons starting at pos
+    nrings = _gather(data, '<u4', pos + 5).astype(np.int64)
+    owner = np.repeat(np.arange(len(pos)), nrings)
+    k = _local_index(nrings)
+    start = np.zeros(len(owner), dtype=np.int64)
+    start[k == 0] = pos[owner[k == 0]] + 9
+    npts = np.zeros(len(owner), dtype=np.int64)
+    #Rings follow each other: the start of ring j is the end of ring j - 1 (in the same polygon)
+    for j in range(int(nrings.max(initial=0))):
+        cur = np.flatnonzero(k == j)
+        if j > 0:
+            start[cur] = start[cur - 1] + 4 + 16 * npts[cur - 1]
+        npts[cur] = _gather(data, '<u4', start[cur]).astype(np.int64)
+    return owner, k, start, npts
+
+
+def from_wkb(offsets, data, valid=None):
+    """FlatGeometry of WKB geometries (feature i is data[offsets[i]:offsets[i + 1]], null if valid[i] is False or if
+    it is empty). Only 2-D little-endian WKB of a single kind (points, lines or polygons) is supported."""
+    offsets = np.asarray(offsets, dtype=np.int64)
+    data = np.asarray(data, dtype=np.uint8)
+    n = len(offsets) - 1
+    present = np.diff(offsets) > 0
+    if valid is not None:
+        present &= np.asarray(valid, dtype=bool)
+    geom = np.flatnonzero(present)
+    pos = offsets[:-1][geom]
+    if np.any(data[pos] != 1):
+        raise ValueError('Only little-endian WKB is supported')
+    wkb_type = _gather(data, '<u4', pos + 1).astype(np.int64)
+    if np.any((wkb_type < 1) | (wkb_type > 6)):
+        raise ValueError('Unsupported WKB types {0}'.format(sorted(set(wkb_type[(wkb_type < 1) | (wkb_type > 6)]))))
+    kinds = set(WKB_KIND[t] for t in np.unique(wkb_type))
+    if len(kinds) > 1:
+        raise ValueError('Geometries of several kinds can not be stored in one FlatGeometry')
+    kind = kinds.pop() if kinds else POINT
+    owner, k, start = _children(data, pos, wkb_type)
+    child_type = _gather(data, '<u4', start + 1).astype(np.int64)
+    #Parts: every point, every line, every ring (in the order of the features)
+    if kind in (POINT, MULTIPOINT):
+        part_owner, vstart, npts = owner, start + 5, np.ones(len(start), dtype=np.int64)
+    elif kind == POLYLINE:
+        part_owner, vstart = owner, start + 9
+        npts = _gather(data, '<u4', start + 5).astype(np.int64)
+    else:
+        ring_child, ring_k, rstart, npts = _rings(data, start)
+        part_owner, vstart = owner[ring_child], rstart + 4
+    vpos = np.repeat(vstart, npts) + 16 * _local_index(npts)
+    xy = np.column_stack([_gather(data, '<f8', vpos), _gather(data, '<f8', vpos + 8)])
+    if kind == POINT:
+        #Null points are (NaN, NaN), as empty WKB points are
+        out = np.full((n, 2), np.nan)
+        out[geom] = xy
+        return FlatGeometry.from_points(out[:, 0], out[:, 1])
+    nparts = np.zeros(n, dtype=np.int64)
+    nparts[geom] = np.bincount(part_owner, minlength=len(geom))
+    return FlatGeometry(xy, np.concatenate([[0], np.cumsum(npts)]), np.concatenate([[0], np.cumsum(nparts)]), kind)
+
+
+########################################################################################################################
+# WRITE
+def _geo_metadata(geoms, crs):
+    import json
+    bounds = geoms.bounds()
+    ok = ~np.isnan(bounds[:, 0])
+    bbox = ([float(bounds[ok, 0].min()), float(bounds[ok, 1].min()), float(bounds[ok, 2].max()),
+             float(bounds[ok, 3].max())] if ok.any() else [])
+    column = {'encoding': 'WKB', 'geometry_types': [WKB_NAME[WKB_TYPE[geoms.kind]]], 'bbox': bbox,
+              'covering': {'bbox': dict((k, [BBOX, k]) for k in ('xmin', 'ymin', 'xmax', 'ymax'))}}
+    if crs is not None:
+        column['crs'] = _projjson(crs)
+    return json.dumps({'version': '1.1.0', 'primary_column': GEOMETRY, 'columns': {GEOMETRY: column}})
+
+
+def _projjson(crs):
+    #PROJJSON of a CRS (EPSG code, WKT or PROJJSON), through pyproj if it is available
+    import json
+    try:
+        import pyproj
+        return json.loads(pyproj.CRS.from_user_input(crs).to_json())
+    except ImportError:
+        if isinstance(crs, int):
+            return {'id': {'authority': 'EPSG', 'code': crs}}
+        return crs
+
+
+def _arrow_table(table, geoms=None, crs=None, key_width=None):
+    import pyarrow as pa
+    columns, names = [], []
+    for name, values in table.items():
+        values = np.asarray(values)
+        width = (key_width or {}).get(name, name if name in hashjoin.KEY_WIDTHS else None)
+        mask = None
+        if values.dtype.kind in 'OSU' and width is not None:
+            #Blank codes are stored as nulls (their own partition, not HUC2=00)
+            values = hashjoin.normalize_keys(values, width)
+            mask = values == ''
+        elif values.dtype.kind in 'OSU':
+            values = values.astype(str)
+        columns.append(pa.array(values, mask=mask if mask is not None and mask.any() else None))
+        names.append(name)
+    metadata = None
+    if geoms is not None:
+        offsets, data = to_wkb(geoms)
+        large = offsets[-1] >= 2 ** 31
+        valid = np.diff(offsets) > 0
+        columns.append(pa.Array.from_buffers(
+            pa.large_binary() if large else pa.binary(), len(geoms),
+            [pa.py_buffer(np.packbits(valid, bitorder='little')), pa.py_buffer(offsets.astype(np.int64 if large else np.int32)),
+             pa.py_buffer(data)], null_count=int((~valid).sum())))
+        names.append(GEOMETRY)
+        bounds = geoms.bounds()
+        columns.append(pa.StructArray.from_arrays([pa.array(bounds[:, i]) for i in range(4)],
+                                                  ['xmin', 'ymin', 'xmax', 'ymax']))
+        names.append(BBOX)
+        metadata = {b'geo': _geo_metadata(geoms, crs).encode('utf-8')}
+    return pa.Table.from_arrays(columns, names=names, metadata=metadata)
+
+
+def write(path, table, geoms=None, crs=None, partition_by=None, row_group_size=2 ** 17, key_width=None):
+    """Write table (dict of arrays) and geoms (FlatGeometry, one feature per record, optional) to path.
+
+    crs is the coordinate system of geoms (EPSG code, WKT or PROJJSON). Text keys named as in hashjoin.KEY_WIDTHS, or
+    in key_width (dict of field: width), are zero-padded, and blank keys are null (read back as ''). If partition_by
+    is given (e.g. 'HUC2'), path is a folder with one subfolder per value of that field. Row groups of row_group_size records keep the minimum and maximum
+    of every column, which lets filtered reads skip them (sort the table by the filtered key for best effect).
+    Existing files or datasets at path are replaced.
+    """
+    import pyarrow.dataset as ds
+    import pyarrow.ipc as ipc
+    import pyarrow.parquet as pq
+    fmt = _format(path)
+    tab = _arrow_table(table, geoms=geoms, crs=crs, key_width=key_width)
+    tmp = path + '.tmp'
+    for p in (tmp,):
+        if os.path.isdir(p):
+            shutil.rmtree(p)
+        elif os.path.exists(p):
+            os.remove(p)
+    if partition_by is not None:
+        import pyarrow as pa
+        ds.write_dataset(tab, tmp, format='parquet' if fmt == 'parquet' else 'ipc',
+                         partitioning=ds.partitioning(pa.schema([tab.schema.field(partition_by)]), flavor='hive'),
+                         max_rows_per_group=row_group_size, min_rows_per_group=min(row_group_size, 2 ** 14),
+                         existing_data_behavior='overwrite_or_ignore')
+    elif fmt == 'parquet':
+        pq.write_table(tab, tmp, row_group_size=row_group_size, compression='zstd')
+    else:
+        with ipc.new_file(tmp, tab.schema) as writer:
+            writer.write_table(tab, max_chunksize=row_group_size)
+    #The previous version is only replaced once the new one is complete
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+    os.rename(tmp, path)
+
+
+########################################################################################################################
+# READ
+def _dataset(path):
+    import pyarrow.dataset as ds
+    import pyarrow.fs as fs
+    fmt = _format(path)
+    #Partition keys are read as text (HUC2=01 is '01', not 1) and IPC files are memory-mapped, so that columns are
+    #views of the file
+    partitioning = None
+    if os.path.isdir(path):
+        import pyarrow as pa
+        keys, sub = [], path
+        while True:
+            folders = [d for d in os.listdir(sub) if '=' in d and os.path.isdir(os.path.join(sub, d))]
+            if not folders:
+                break
+            keys.append(folders[0].split('=')[0])
+            sub = os.path.join(sub, folders[0])
+        partitioning = ds.partitioning(pa.schema([(k, pa.string()) for k in keys]), flavor='hive')
+    return ds.dataset(path, format=fmt, partitioning=partitioning, filesystem=fs.LocalFileSystem(use_mmap=fmt == 'ipc'))
+
+
+def _expression(filters, schema):
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    expr = None
+    for field, values in filters.items():
+        if isinstance(values, ds.Expression):
+            cond = values
+        else:
+            values = np.atleast_1d(np.asarray(values))
+            ftype = schema.field(field).type
+            if pa.types.is_dictionary(ftype):
+                ftype = ftype.value_type
+            if pa.types.is_string(ftype) or pa.types.is_large_string(ftype):
+                values = hashjoin.normalize_keys(values, hashjoin.KEY_WIDTHS.get(field))
+            cond = ds.field(field).isin(values.tolist())
+        expr = cond if expr is None else expr & cond
+    return expr
+
+
+def _bbox_expression(bbox):
+    import pyarrow.dataset as ds
+    xmin, ymin, xmax, ymax = bbox
+    return ((ds.field(BBOX, 'xmax') >= xmin) & (ds.field(BBOX, 'xmin') <= xmax) &
+            (ds.field(BBOX, 'ymax') >= ymin) & (ds.field(BBOX, 'ymin') <= ymax))
+
+
+def _to_numpy(column):
+    #numpy array of an Arrow column: numeric columns without nulls are not copied (views of the memory-mapped file for
+    #IPC), nulls become NaN in numbers and '' in text
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    if column.num_chunks == 1:
+        column = column.chunk(0)
+    else:
+        column = column.combine_chunks()
+    if pa.types.is_dictionary(column.type):
+        column = column.cast(column.type.value_type)
+    if pa.types.is_string(column.type) or pa.types.is_large_string(column.type):
+        return np.asarray(pc.fill_null(column, '').to_numpy(zero_copy_only=False)).astype(str)
+    if column.null_count and (pa.types.is_integer(column.type) or pa.types.is_boolean(column.type)):
+        column = column.cast(pa.float64())
+    if column.null_count and pa.types.is_floating(column.type):
+        column = pc.fill_null(column, np.nan)
+    return column.to_numpy(zero_copy_only=False)
+
+
+def read_table(path, fields=None, filters=None, bbox=None):
+    """Columns of a columnar file or dataset as a dict of numpy arrays (geometry excluded).
+
+    fields lists the columns to read (all if None); filters is a dict of field: value or list of values (or a pyarrow
+    expression) that records must match; bbox (xmin, ymin, xmax, ymax) keeps the features whose extent intersects it.
+    """
+    return _read(path, fields, filters, bbox, geometry=False)[1]
+
+
+def read_features(path, fields=None, filters=None, bbox=None):
+    """FlatGeometry and columns (dict of numpy arrays) of the records of a columnar file or dataset (see
+    read_table)."""
+    return _read(path, fields, filters, bbox, geometry=True)
+
+
+def _read(path, fields, filters, bbox, geometry):
+    dataset = _dataset(path)
+    schema = dataset.schema
+    if fields is None:
+        fields = [f for f in schema.names if f not in (GEOMETRY, BBOX)]
+    fields = list(fields)
+    expr = _expression(filters, schema) if filters else None
+    if bbox is not None:
+        expr = _bbox_expression(bbox) if expr is None else expr & _bbox_expression(bbox)
+    tab = dataset.to_table(columns=fields + ([GEOMETRY] if geometry else []), filter=expr)
+    table = dict((f, _to_numpy(tab.column(f))) for f in fields)
+    geoms = None
+    if geometry:
+        geoms = geometry_column(tab.column(GEOMETRY))
+    return geoms, table
+
+
+def crs(path):
+    """Coordinate system of the geometries of a columnar file or dataset (PROJJSON text), None if it is unknown.
+    Geometries without a coordinate system are in longitude, latitude (OGC:CRS84), as in GeoParquet."""
+    import json
+    metadata = _dataset(path).schema.metadata or {}
+    if b'geo' not in metadata:
+        return None
+    column = json.loads(metadata[b'geo'].decode('utf-8'))['columns'][GEOMETRY]
+    if 'crs' not in column:
+        return 'OGC:CRS84'
+    return json.dumps(column['crs']) if column['crs'] is not None else None
+
+
+def geometry_column(column):
+    """FlatGeometry of a WKB column of an Arrow table."""
+    column = column.combine_chunks() if hasattr(column, 'combine_chunks') else column
+    validity, offsets, data = column.buffers()
+    large = str(column.type) == 'large_binary'
+    offsets = np.frombuffer(offsets, dtype=np.int64 if large else np.int32)[column.offset:column.offset + len(column) + 1]
+    data = np.frombuffer(data, dtype=np.uint8) if data is not None else np.zeros(0, dtype=np.uint8)
+    valid = None
+    if validity is not None and column.null_count:
+        valid = np.unpackbits(np.frombuffer(validity, dtype=np.uint8), bitorder='little')[
+            column.offset:column.offset + len(column)].astype(bool)
+    return from_wkb(offsets, data, valid)
+
+
+def columns(path):
+    """Names of the attribute columns of a columnar file or dataset (including partition keys)."""
+    return [f for f in _dataset(path).schema.names if f not in (GEOMETRY, BBOX)]
+
@@ -0,0 +1,183 @@
+#Creation date: October 2026
+
+#Objective: Read CSV tables (Devineni et al. 2015 NDC_NDImax.csv, FishDiversityMetrics.csv) straight into typed numpy
+#           columns that can be joined in memory (see hashjoin.py), instead of importing them to a geodatabase with
+#           TableToGeodatabase and converting fields row by row
+#           - Every table has a declarative schema: (CSV column, output field, kind) for every column to convert.
+#             Keys ('key') are zero-padded to the width of their field in hashjoin.KEY_WIDTHS (FIPS: 5, HUC8: 8),
+#             numbers ('float') are parsed whole columns at a time, including scientific notation (e.g. 095.02E-05 is
+#             9.502e-4) and with blank, 'NaN', 'NA' and 'NULL' values as NaN. Other columns are kept as text
+#           - Every distinct text is only converted once, so conversion time depends on the number of distinct values
+#           - A report gives, for every converted column, the number of null values, of values that were coerced
+#             (keys padded or written as decimals, numbers in scientific notation or with leading zeros) and of
+#             values that were rejected (not a number, keys too long or not integers), with examples
+#           Files are parsed with pyarrow if it is installed, with the csv module otherwise.
+
+import csv
+import json
+
+import numpy as np
+
+import hashjoin
+
+#(CSV column, output field, kind) of the columns to convert in every table
+SCHEMAS = {'NDC_NDImax': [('FIPS', 'FIPS', 'key'), ('NDImax', 'NDImax_numb', 'float'), ('NDC', 'NDC_numb', 'float'),
+                          ('AVR_RAINFALL', 'AVR_RAINFALL', 'float')],
+           'FishDiversityMetrics': [('HUC8', 'HUC8', 'key'), ('TotArea_x', 'TotArea_x', 'float'),
+                                    ('EWU', 'EWU', 'float'), ('TE_EWU', 'TE_EWU_numb', 'float'),
+                                    ('TE_Count', 'TE_Count', 'float')]}
+NULL_TOKENS = ('', 'NaN', 'nan', 'NAN', 'NA', 'na', 'N/A', 'n/a', 'NULL', 'null', 'Null', 'None', 'NONE')
+EXAMPLES = 5
+
+
+def read_text(path):
+    """Columns of a CSV file (with a header line) as a dict of str arrays, in the order of the file."""
+    try:
+        import pyarrow as pa
+        import pyarrow.csv as pacsv
+    except ImportError:
+        pa = None
+    with open(path, newline='') as f:
+        header = next(csv.reader(f))
+    if pa is not None:
+        #Every column is read as text (blank values are '' rather than null), conversions are done in convert()
+        tab = pacsv.read_csv(path, convert_options=pacsv.ConvertOptions(
+            column_types=dict((name, pa.string()) for name in header), strings_can_be_null=False,
+            quoted_strings_can_be_null=False))
+        return dict((name, np.asarray(tab.column(name).to_pylist(), dtype=str)) for name in tab.column_names)
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        next(reader)
+        rows = list(reader)
+    columns = list(zip(*rows)) if rows else [()] * len(header)
+    return dict((name, np.array(values, dtype=str)) for name, values in zip(header, columns))
+
+
+def _parse(text):
+    #Float of every text (NaN if not a number) and whether it was rejected
+    try:
+        return text.astype(np.float64), np.zeros(len(text), dtype=bool)
+    except ValueError:
+        values = np.full(len(text), np.nan)
+        bad = np.ones(len(text), dtype=bool)
+        for i, v in enumerate(text):
+            try:
+                values[i] = float(v)
+                bad[i] = False
+            except ValueError:
+                pass
+        return values, bad
+
+
+def _distinct(values):
+    #Distinct texts (sorted), the index of every value in them and their number of occurrences
+    values = np.asarray(values)
+    if values.dtype.kind != 'U':
+        values = values.astype(str)
+    uniq, inverse = np.unique(values, return_inverse=True)
+    return uniq, inverse.ravel(), np.bincount(inverse.ravel(), minlength=len(uniq))
+
+
+def _report(kind, counts, null, coerced, rejected, uniq):
+    #Counts of rows and examples from masks over the distinct texts uniq
+    return {'kind': kind, 'rows': int(counts.sum()), 'null': int(counts[null].sum()),
+            'coerced': int(counts[coerced].sum()), 'rejected': int(counts[rejected].sum()),
+            'examples_coerced': [str(v) for v in uniq[coerced][:EXAMPLES]],
+            'examples_rejected': [str(v) for v in uniq[rejected][:EXAMPLES]]}
+
+
+def to_float(text):
+    """Text as float64 (NaN for null and rejected values) and its report (see convert)."""
+    uniq, inverse, counts = _distinct(text)
+    stripped = np.char.strip(uniq)
+    null = np.isin(stripped, NULL_TOKENS)
+    values = np.full(len(uniq), np.nan)
+    rejected = np.zeros(len(uniq), dtype=bool)
+    rest = np.flatnonzero(~null)
+    values[rest], rejected[rest] = _parse(stripped[rest])
+    #Values that are numbers but not written as plain decimals
+    unsigned = np.char.lstrip(stripped, '+-')
+    exponent = (np.char.find(stripped, 'E') >= 0) | (np.char.find(stripped, 'e') >= 0)
+    coerced = ~null & ~rejected & ((stripped != uniq) | exponent |
+                                   (np.char.startswith(unsigned, '0') & (np.char.str_len(unsigned) > 1) &
+                                    ~np.char.startswith(unsigned, '0.')))
+    return values[inverse], _report('float', counts, null, coerced, rejected, uniq)
+
+
+def to_key(text, width):
+    """Text as codes zero-padded to width ('' for null and rejected values) and its report (see convert). Integer
+    values written as decimals (e.g. '1001.0') are accepted."""
+    uniq, inverse, counts = _distinct(text)
+    stripped = np.char.strip(uniq)
+    null = np.isin(stripped, NULL_TOKENS)
+    digits = np.char.isdigit(stripped)
+    keys = np.where(digits, stripped, '')
+    #Keys that are not only digits must be integers written as numbers
+    other = np.flatnonzero(~null & ~digits)
+    rejected = np.zeros(len(uniq), dtype=bool)
+    if len(other):
+        values, bad = _parse(stripped[other])
+        bad |= ~np.isfinite(values) | (values != np.round(values)) | (values < 0)
+        keys[other[~bad]] = values[~bad].astype(np.int64).astype(str)
+        rejected[other[bad]] = True
+    rejected |= np.char.str_len(keys) > width
+    keys = np.where(rejected | null, '', np.char.zfill(keys, width))
+    coerced = ~null & ~rejected & (keys != uniq)
+    report = _report('key', counts, null, coerced, rejected, uniq)
+    valid = keys != ''
+    report['duplicates'] = int(counts[valid].sum() - len(np.unique(keys[valid])))
+    return keys[inverse], report
+
+
+def convert(columns, schema):
+    """Typed columns of a table of text columns (see read_text) and a report of the conversion of every column.
+
+    schema is a list of (column, field, kind) with kind 'key' (zero-padded to hashjoin.KEY_WIDTHS[field]), 'float'
+    or 'text'. Columns that are not in the schema are kept as text. The report is a dict with, for every field of the
+    schema: kind, rows, null, coerced and rejected counts and examples of coerced and rejected values (and for keys,
+    the number of duplicated keys).
+    """
+    missing = [column for column, field, kind in schema if column not in columns]
+    if missing:
+        raise ValueError('Columns {0} are not in the table (columns: {1})'.format(missing, list(columns)))
+    converted = dict((column, (field, kind)) for column, field, kind in schema)
+    table, report = {}, {}
+    for name, text in columns.items():
+        if name not in converted:
+            table[name] = text
+            continue
+        field, kind = converted[name]
+        if kind == 'key':
+            table[field], report[field] = to_key(text, hashjoin.KEY_WIDTHS[field])
+        elif kind == 'float':
+            table[field], report[field] = to_float(text)
+        elif kind == 'text':
+            uniq, inverse, counts = _distinct(text)
+            stripped = np.char.strip(uniq)
+            none = np.zeros(len(uniq), dtype=bool)
+            table[field] = stripped[inverse]
+            report[field] = _report('text', counts, stripped == '', none, none, uniq)
+        else:
+            raise ValueError('Unknown kind {0!r} for column {1!r}'.format(kind, name))
+    return table, report
+
+
+def read_csv(path, schema):
+    """Typed columns of a CSV file and the report of their conversion (see convert). schema is a list of
+    (column, field, kind) or the name of one of SCHEMAS."""
+    if isinstance(schema, str):
+        schema = SCHEMAS[schema]
+    return convert(read_text(path), schema)
+
+
+def write_report(report, path=None, name=''):
+    """Print the fields of report with null, coerced or rejected values and save report to path (JSON) if given."""
+    for field, r in report.items():
+        if r['null'] or r['coerced'] or r['rejected'] or r.get('duplicates'):
+            print('{0}{1} ({2}): {3} rows, {4} null, {5} coerced {6}, {7} rejected {8}{9}'.format(
+                name + '.' if name else '', field, r['kind'], r['rows'], r['null'], r['coerced'], r['examples_coerced'],
+                r['rejected'], r['examples_rejected'],
+                ', {0} duplicated keys'.format(r['duplicates']) if r.get('duplicates') else ''))
+    if path is not None:
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=1)
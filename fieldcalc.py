@@ -0,0 +1,111 @@
+#Creation date: October 2026
+
+#Objective: Compute attribute fields on whole columns at once instead of row by row with arcpy.da.UpdateCursor
+#           (FIPS codes, zero-padded IDs, numeric conversions, HUC prefixes, scarcity indices...)
+#           - The fields needed for a computation are read into numpy arrays in one call: directly from the .dbf of
+#             shapefiles and dBASE tables, or with arcpy.da.TableToNumPyArray for geodatabase tables
+#           - Expressions are evaluated on the arrays with numpy
+#           - Results are written back in one bulk operation: in place in the .dbf, or with arcpy.da.ExtendTable
+#           Output fields must already exist (e.g. created with arcpy.AddField_management) so that their type is set
+#           explicitly.
+
+import os
+
+import numpy as np
+
+import flatgeom
+
+
+def _is_dbf(table):
+    return os.path.splitext(table)[1].lower() in ('.dbf', '.shp')
+
+
+def _dbf_path(table):
+    return os.path.splitext(table)[0] + '.dbf'
+
+
+def read_columns(table, fields, null_value=None):
+    """Columns of table as a dict of numpy arrays, in the order of the records of the table.
+
+    null_value is passed to arcpy.da.TableToNumPyArray for geodatabase tables (e.g. {'NDC_numb': np.nan}) so that
+    fields with nulls can be read. Blank numeric values in .dbf files are read as NaN.
+    """
+    if _is_dbf(table):
+        return flatgeom.read_dbf(_dbf_path(table), fields=fields)
+    import arcpy
+    arr = arcpy.da.TableToNumPyArray(table, list(fields), null_value=null_value)
+    return dict((f, arr[f]) for f in fields)
+
+
+def write_columns(table, columns):
+    """Write arrays (one value per record, in the order of read_columns) to existing fields of table."""
+    if _is_dbf(table):
+        flatgeom.update_dbf(_dbf_path(table), columns)
+        return
+    import arcpy
+    oid_field = arcpy.Describe(table).OIDFieldName
+    oid = arcpy.da.TableToNumPyArray(table, ['OID@'])['OID@']
+    key = '_OID_JOIN'
+    dtype = [(key, np.int64)] + [(name, flatgeom.numpy_dtype(values)) for name, values in columns.items()]
+    arr = np.empty(len(oid), dtype=dtype)
+    arr[key] = oid
+    for name, values in columns.items():
+        arr[name] = values
+    #With append_only=False, ExtendTable updates the fields that already exist in the table
+    arcpy.da.ExtendTable(table, oid_field, arr, key, append_only=False)
+
+
+def calculate(table, fields, func, null_value=None):
+    """Read fields of table, compute new columns with func(columns) -> dict of arrays and write them back."""
+    columns = read_columns(table, fields, null_value=null_value)
+    write_columns(table, func(columns))
+
+
+########################################################################################################################
+# VECTORIZED EXPRESSIONS
+def as_str(values):
+    """Values as a str array, with integer-valued floats written without decimals (e.g. 1001.0 -> '1001')."""
+    values = np.asarray(values)
+    if values.dtype.kind == 'f':
+        whole = np.isfinite(values) & (values == np.round(values))
+        out = values.astype(str)
+        out[whole] = values[whole].astype(np.int64).astype(str)
+        return out
+    return values.astype(str)
+
+
+def zero_pad(values, width):
+    """Codes left-padded with zeros to width characters (FIPS: 5, HUC8: 8, USGS site numbers: 8...)."""
+    return np.char.zfill(as_str(values), width)
+
+
+def substr(values, start, stop):
+    """values[start:stop] for every string of values."""
+    values = np.asarray(values).astype(str)
+    width = values.dtype.itemsize // 4
+    if width == 0:
+        return values
+    chars = np.ascontiguousarray(values).view('U1').reshape(len(values), width)[:, start:stop]
+    if chars.shape[1] == 0:
+        return np.full(len(values), '')
+    return np.ascontiguousarray(chars).view('U{0}'.format(chars.shape[1])).ravel()
+
+
+def to_float(values):
+    """Text values as float64, with blank, 'NaN' and other non-numeric values as NaN (numbers are only cast)."""
+    values = np.asarray(values)
+    if values.dtype.kind in 'fiub':
+        return values.astype(np.float64)
+    text = np.char.strip(np.asarray(values).astype(str))
+    text = np.where(text == '', 'nan', text)
+    try:
+        return text.astype(np.float64)
+    except ValueError:
+        #Only fall back to converting values one by one if some of them are not numbers
+        out = np.full(len(text), np.nan)
+        for i, v in enumerate(text):
+            try:
+                out[i] = float(v)
+            except ValueError:
+                pass
+        return out
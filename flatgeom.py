@@ -0,0 +1,426 @@
+#Creation date: October 2026
+
+#Objective: Read and write vector data as flat numpy arrays rather than one object per feature, so that the analyses
+#           can run on machines without an ArcGIS license
+#           - Geometries are stored as one array of vertex coordinates, an array of offsets of the parts (rings for
+#             polygons, paths for polylines) into the vertices and an array of offsets of the features into the parts
+#           - Shapefiles are read in bulk using the .shx index, attribute tables (.dbf) are read as one numpy array per
+#             column
+#           - Feature classes in file geodatabases can be read with arcpy when it is available
+
+import glob
+import os
+import struct
+
+import numpy as np
+
+import instrument
+
+POINT, POLYLINE, POLYGON, MULTIPOINT = 1, 3, 5, 8
+#Z and M shape types share the layout of their 2-D counterpart for the x,y part of the record
+SHAPE_KIND = {0: None, 1: POINT, 11: POINT, 21: POINT, 3: POLYLINE, 13: POLYLINE, 23: POLYLINE,
+              5: POLYGON, 15: POLYGON, 25: POLYGON, 8: MULTIPOINT, 18: MULTIPOINT, 28: MULTIPOINT}
+
+
+class FlatGeometry(object):
+    """Geometries of a layer as flat arrays.
+
+    xy: (n_vertices, 2) float64 coordinates
+    part_offsets: (n_parts + 1) vertex offsets of each ring/path (each point is its own part)
+    geom_offsets: (n_features + 1) part offsets of each feature (null geometries have no parts)
+    kind: POINT, POLYLINE or POLYGON
+
+    Null points are a (NaN, NaN) point rather than no part, so that xy of a point layer has one row per feature.
+    """
+
+    def __init__(self, xy, part_offsets, geom_offsets, kind):
+        self.xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+        self.part_offsets = np.asarray(part_offsets, dtype=np.int64)
+        self.geom_offsets = np.asarray(geom_offsets, dtype=np.int64)
+        self.kind = kind
+
+    def __len__(self):
+        return len(self.geom_offsets) - 1
+
+    @classmethod
+    def from_points(cls, x, y):
+        n = len(x)
+        return cls(np.column_stack([x, y]), np.arange(n + 1), np.arange(n + 1), POINT)
+
+    def vertex_geom(self):
+        """Index of the feature of each vertex."""
+        part_geom = np.repeat(np.arange(len(self)), np.diff(self.geom_offsets))
+        return np.repeat(part_geom, np.diff(self.part_offsets))
+
+    def edges(self):
+        """Segments of every part as (x0, y0, x1, y1, feature index) arrays.
+
+        Polygon rings that are not explicitly closed (first vertex repeated at the end) are closed.
+        """
+        n = len(self.xy)
+        first, lastv = self.part_offsets[:-1], self.part_offsets[1:] - 1
+        nonempty = lastv >= first
+        first, lastv = first[nonempty], lastv[nonempty]
+        last = np.zeros(n, dtype=bool)
+        last[lastv] = True
+        start = np.flatnonzero(~last)
+        end = start + 1
+        geom = self.vertex_geom()
+        if self.kind == POLYGON:
+            open_ring = np.any(self.xy[first] != self.xy[lastv], axis=1)
+            start = np.concatenate([start, lastv[open_ring]])
+            end = np.concatenate([end, first[open_ring]])
+        return (self.xy[start, 0], self.xy[start, 1], self.xy[end, 0], self.xy[end, 1], geom[start])
+
+    def bounds(self):
+        """(n_features, 4) array of xmin, ymin, xmax, ymax (NaN for null geometries)."""
+        out = np.full((len(self), 4), np.nan)
+        vstart = self.part_offsets[self.geom_offsets[:-1]]
+        vend = self.part_offsets[self.geom_offsets[1:]]
+        nonempty = vend > vstart
+        if nonempty.any():
+            starts = vstart[nonempty]
+            out[nonempty, 0] = np.minimum.reduceat(self.xy[:, 0], starts)
+            out[nonempty, 1] = np.minimum.reduceat(self.xy[:, 1], starts)
+            out[nonempty, 2] = np.maximum.reduceat(self.xy[:, 0], starts)
+            out[nonempty, 3] = np.maximum.reduceat(self.xy[:, 1], starts)
+        return out
+
+    def take(self, idx):
+        """Subset of features, in the order of idx."""
+        idx = np.asarray(idx, dtype=np.int64)
+        g0, g1 = self.geom_offsets[idx], self.geom_offsets[idx + 1]
+        nparts = g1 - g0
+        part_idx = _ranges(g0, g1)
+        p0, p1 = self.part_offsets[part_idx], self.part_offsets[part_idx + 1]
+        xy = self.xy[_ranges(p0, p1)]
+        part_offsets = np.concatenate([[0], np.cumsum(p1 - p0)])
+        geom_offsets = np.concatenate([[0], np.cumsum(nparts)])
+        return FlatGeometry(xy, part_offsets, geom_offsets, self.kind)
+
+
+def _local_index(counts):
+    """For every item of every group of the given sizes, its position within its group."""
+    counts = np.asarray(counts, dtype=np.int64)
+    starts = np.cumsum(counts) - counts
+    return np.arange(counts.sum()) - np.repeat(starts, counts)
+
+
+def _ranges(starts, ends):
+    """Concatenation of np.arange(s, e) for every pair of starts and ends."""
+    lengths = np.asarray(ends, dtype=np.int64) - starts
+    return np.repeat(starts, lengths) + _local_index(lengths)
+
+
+########################################################################################################################
+# SHAPEFILES
+def _gather(buf, dtype, pos):
+    """Values of dtype at arbitrary (possibly unaligned) byte positions pos of the uint8 buffer buf."""
+    dt = np.dtype(dtype)
+    width = dt.itemsize
+    out = np.empty(len(pos), dtype=dt)
+    shift = pos % width
+    for s in range(width):
+        sel = shift == s
+        if sel.any():
+            view = buf[s:s + width * ((len(buf) - s) // width)].view(dt)
+            out[sel] = view[(pos[sel] - s) // width]
+    return out
+
+
+def read_shp(path):
+    """Read the geometries of a shapefile (.shp + .shx) as a FlatGeometry."""
+    base = os.path.splitext(path)[0]
+    shx = np.fromfile(base + '.shx', dtype='>i4', offset=100).reshape(-1, 2)
+    content = shx[:, 0].astype(np.int64) * 2 + 8
+    buf = np.memmap(base + '.shp', dtype=np.uint8, mode='r')
+    kind = SHAPE_KIND[int(_gather(buf, '<i4', np.array([32]))[0])]
+    rec_type = _gather(buf, '<i4', content)
+    null = rec_type == 0
+    if kind == POINT:
+        xy = np.full((len(content), 2), np.nan)
+        xy[~null, 0] = _gather(buf, '<f8', content[~null] + 4)
+        xy[~null, 1] = _gather(buf, '<f8', content[~null] + 12)
+        return FlatGeometry.from_points(xy[:, 0], xy[:, 1])
+    if kind == MULTIPOINT:
+        #Every point of a multipoint is its own part
+        npoints = np.where(null, 0, _gather(buf, '<i4', content + 36)).astype(np.int64)
+        nparts = npoints
+        pts_start = content + 40
+    else:
+        nparts = np.where(null, 0, _gather(buf, '<i4', content + 36)).astype(np.int64)
+        npoints = np.where(null, 0, _gather(buf, '<i4', content + 40)).astype(np.int64)
+        parts_start = content + 44
+        pts_start = parts_start + 4 * nparts
+    vert_pos = np.repeat(pts_start, npoints) + 16 * _local_index(npoints)
+    x = _gather(buf, '<f8', vert_pos)
+    y = _gather(buf, '<f8', vert_pos + 8)
+    if kind == MULTIPOINT:
+        part_offsets = np.arange(npoints.sum() + 1)
+    else:
+        part_pos = np.repeat(parts_start, nparts) + 4 * _local_index(nparts)
+        part_rel = _gather(buf, '<i4', part_pos).astype(np.int64)
+        vert_base = np.concatenate([[0], np.cumsum(npoints)[:-1]])
+        part_offsets = np.concatenate([part_rel + np.repeat(vert_base, nparts), [npoints.sum()]])
+    geom_offsets = np.concatenate([[0], np.cumsum(nparts)])
+    return FlatGeometry(np.column_stack([x, y]), part_offsets, geom_offsets, kind)
+
+
+def dbf_fields(path):
+    """Number of records, header length, record length and (name, type, offset, width, decimals) of every field."""
+    with open(path, 'rb') as f:
+        header = f.read(32)
+        nrec, hlen, rlen = struct.unpack('<IHH', header[4:12])
+        desc = f.read(hlen - 32)
+    specs = []
+    pos = 1
+    for i in range(0, len(desc) - 1, 32):
+        if desc[i:i + 1] == b'\r':
+            break
+        name = desc[i:i + 11].split(b'\x00')[0].decode('latin-1')
+        ftype = desc[i + 11:i + 12].decode('latin-1')
+        width, dec = desc[i + 16], desc[i + 17]
+        specs.append((name, ftype, pos, width, dec))
+        pos += width
+    return nrec, hlen, rlen, specs
+
+
+def _dbf_records(path, mode='r'):
+    nrec, hlen, rlen, specs = dbf_fields(path)
+    if nrec == 0:
+        return np.zeros((0, rlen), dtype=np.uint8), specs
+    return np.memmap(path, dtype=np.uint8, mode=mode, offset=hlen, shape=(nrec, rlen)), specs
+
+
+def read_dbf(path, fields=None):
+    """Read a dBASE table as a dict of numpy arrays, one per column (only those in fields if given).
+
+    Character and date fields are returned as str arrays (stripped), numeric fields as float64 (NaN when blank) or
+    int64 when the field has no decimals and no blanks, logical fields as bool. Deleted records are skipped.
+    """
+    data, specs = _dbf_records(path)
+    keep = data[:, 0] != ord('*')
+    table = {}
+    for name, ftype, pos, width, dec in specs:
+        if fields is not None and name not in fields:
+            continue
+        raw = np.ascontiguousarray(data[keep, pos:pos + width]).view('S{0}'.format(width)).ravel()
+        table[name] = _convert(raw, ftype, dec)
+    return table
+
+
+def update_dbf(path, columns):
+    """Overwrite the values of existing fields of a dBASE table in place, in bulk.
+
+    columns maps field names to arrays with one value per record (deleted records excluded, i.e. in the order of
+    read_dbf). The structure of the table (field types, widths and decimals) is left untouched, so values that do not
+    fit in their field raise a ValueError.
+    """
+    data, specs = _dbf_records(path, mode='r+')
+    keep = np.flatnonzero(data[:, 0] != ord('*'))
+    specs = dict((s[0], s[1:]) for s in specs)
+    for name, values in columns.items():
+        if name not in specs:
+            raise ValueError('Field {0} does not exist in {1}, add it first'.format(name, path))
+        ftype, pos, width, dec = specs[name]
+        txt = _format_field(np.asarray(values), ftype, width, dec)
+        if np.char.str_len(txt).max(initial=0) > width:
+            raise ValueError('Values of {0} do not fit in a field of width {1}'.format(name, width))
+        if ftype == 'C':
+            txt = np.char.ljust(txt, width)
+        else:
+            txt = np.char.rjust(txt, width)
+        data[keep, pos:pos + width] = np.frombuffer(txt.astype('S{0}'.format(width)).tobytes(),
+                                                    dtype=np.uint8).reshape(len(keep), width)
+    if isinstance(data, np.memmap):
+        data.flush()
+
+
+def _format_field(values, ftype, width, dec):
+    if values.dtype.kind == 'O':
+        missing = np.array([v is None for v in values], dtype=bool)
+        values = np.where(missing, np.nan if ftype in 'NF' else '', values)
+        values = values.astype(np.float64 if ftype in 'NF' else str)
+    if ftype in 'NF':
+        vals = values.astype(np.float64)
+        txt = np.char.mod('%.{0}f'.format(dec), vals).astype('S')
+        txt[np.isnan(vals)] = b''
+        return txt
+    if ftype == 'L':
+        return np.where(values.astype(bool), b'T', b'F').astype('S1')
+    return np.char.encode(values.astype(str), 'latin-1')
+
+
+def _convert(raw, ftype, dec):
+    text = np.char.strip(raw)
+    if ftype in 'NF':
+        blank = (text == b'') | np.char.startswith(text, b'*')
+        vals = np.where(blank, b'nan', text).astype(np.float64)
+        if dec == 0 and not blank.any() and np.all(np.abs(vals) < 2**53):
+            return vals.astype(np.int64)
+        return vals
+    if ftype == 'L':
+        return np.isin(text, [b'T', b't', b'Y', b'y'])
+    return np.char.decode(text, 'latin-1')
+
+
+def _max_len(txt):
+    return max(int(np.char.str_len(txt).max()) if len(txt) else 0, 1)
+
+
+def write_dbf(path, table, columns=None):
+    """Write a dict of equal-length numpy arrays as a dBASE table.
+
+    Integer columns are written as N fields without decimals, floats as N fields with 15 significant digits (NaN as blank),
+    bool as L, everything else as C fields (strings, up to 254 characters).
+    """
+    columns = list(table) if columns is None else columns
+    nrec = len(table[columns[0]]) if columns else 0
+    specs, encoded = [], []
+    for name in columns:
+        col = np.asarray(table[name])
+        if col.dtype.kind == 'O':
+            col = np.array(['' if v is None else v for v in col])
+        if col.dtype.kind in 'iu':
+            txt = col.astype(str).astype('S')
+            width, dec, ftype = _max_len(txt), 0, b'N'
+        elif col.dtype.kind == 'f':
+            txt = np.char.mod('%.15g', col).astype('S')
+            txt[np.isnan(col)] = b''
+            width, dec, ftype = 24, 10, b'N'
+        elif col.dtype.kind == 'b':
+            txt = np.where(col, b'T', b'F').astype('S1')
+            width, dec, ftype = 1, 0, b'L'
+        else:
+            txt = np.char.encode(col.astype(str), 'latin-1')
+            width, dec, ftype = min(_max_len(txt), 254), 0, b'C'
+        if ftype == b'C':
+            txt = np.char.ljust(txt.astype('S{0}'.format(width)), width)
+        else:
+            txt = np.char.rjust(txt.astype('S{0}'.format(width)), width)
+        specs.append((name, ftype, width, dec))
+        encoded.append(txt)
+    rlen = 1 + sum(s[2] for s in specs)
+    hlen = 32 + 32 * len(specs) + 1
+    with open(path, 'wb') as f:
+        f.write(struct.pack('<BBBBIHH20x', 3, 126, 1, 1, nrec, hlen, rlen))
+        for name, ftype, width, dec in specs:
+            f.write(struct.pack('<11sc4xBB14x', name[:10].encode('latin-1'), ftype, width, dec))
+        f.write(b'\r')
+        rows = np.full((nrec, rlen), ord(' '), dtype=np.uint8)
+        pos = 1
+        for (name, ftype, width, dec), txt in zip(specs, encoded):
+            rows[:, pos:pos + width] = np.frombuffer(txt.tobytes(), dtype=np.uint8).reshape(nrec, width)
+            pos += width
+        f.write(rows.tobytes())
+        f.write(b'\x1a')
+
+
+def read_shapefile(path, fields=None):
+    """Geometries (FlatGeometry) and attribute table (dict of arrays) of a shapefile."""
+    return read_shp(path), read_dbf(os.path.splitext(path)[0] + '.dbf', fields=fields)
+
+
+########################################################################################################################
+# ARCPY FEATURE CLASSES
+def read_arcpy(in_features, fields=(), spatial_reference=None):
+    """Geometries and attributes of any feature class that arcpy can read (e.g. in a file geodatabase), projected on
+    the fly to spatial_reference if given."""
+    import arcpy
+    fields = list(fields)
+    xy, part_offsets, geom_offsets = [], [0], [0]
+    table = dict((f, []) for f in fields)
+    kind = {'Point': POINT, 'Polyline': POLYLINE, 'Polygon': POLYGON, 'Multipoint': MULTIPOINT}[
+        arcpy.Describe(in_features).shapeType]
+    shape_token = 'SHAPE@XY' if kind == POINT else 'SHAPE@'
+    with arcpy.da.SearchCursor(in_features, [shape_token] + fields, spatial_reference=spatial_reference) as cursor:
+        for row in instrument.progress(cursor, 'read {0}'.format(os.path.basename(str(in_features)))):
+            shape = row[0]
+            if kind == POINT:
+                xy.append(shape if shape is not None and shape[0] is not None else (np.nan, np.nan))
+                part_offsets.append(len(xy))
+            elif shape is not None:
+                for part in shape:
+                    ring = []
+                    for pnt in part:
+                        #Polygon parts separate interior rings with None
+                        if pnt is None:
+                            xy.extend(ring)
+                            part_offsets.append(len(xy))
+                            ring = []
+                        else:
+                            ring.append((pnt.X, pnt.Y))
+                    xy.extend(ring)
+                    part_offsets.append(len(xy))
+            geom_offsets.append(len(part_offsets) - 1)
+            for f, v in zip(fields, row[1:]):
+                table[f].append(v)
+    return FlatGeometry(xy, part_offsets, geom_offsets, kind), dict((f, np.array(v)) for f, v in table.items())
+
+
+def layer_files(layer):
+    """Files of a layer: the .shp, .shx and .dbf of a shapefile, the file itself for other files, every file of a
+    folder (e.g. a partitioned columnar store, see colstore.py) and every file of the geodatabase for feature classes
+    and tables in a file geodatabase (paths relative to arcpy.env.workspace included)."""
+    if not os.path.exists(layer) and not os.path.isabs(layer):
+        try:
+            import arcpy
+            if arcpy.env.workspace:
+                layer = os.path.join(arcpy.env.workspace, layer)
+        except ImportError:
+            pass
+    if os.path.exists(layer) and not os.path.isdir(layer):
+        base = os.path.splitext(layer)[0]
+        files = [f for f in glob.glob(base + '.*') if os.path.splitext(f)[1].lower() in ('.shp', '.shx', '.dbf')]
+        return files or [layer]
+    if os.path.isdir(layer) and not layer.rstrip('/\\').lower().endswith('.gdb'):
+        return sorted(os.path.join(d, f) for d, dirs, names in os.walk(layer) for f in names)
+    gdb = layer
+    while gdb and not gdb.lower().endswith('.gdb'):
+        parent = os.path.dirname(gdb)
+        gdb = parent if parent != gdb else ''
+    return glob.glob(os.path.join(gdb, '*')) if gdb else []
+
+
+def layer_version(layer):
+    """Size and modification time of the files of a layer (see layer_files), used to detect that a layer was
+    modified.
+
+    For feature classes in a file geodatabase, the most recent modification of any file of the geodatabase is used.
+    """
+    return sorted([os.path.basename(f), os.path.getsize(f), os.path.getmtime(f)] for f in layer_files(layer))
+
+
+def read_features(in_features, fields=None, spatial_reference=None):
+    """Read a shapefile or a columnar store (.parquet, .arrow, see colstore.py) directly, or any other feature class
+    (or layer, honoring its selection) through arcpy.
+
+    Features are only projected (through arcpy) if spatial_reference is given.
+    """
+    if in_features.lower().endswith('.shp') and spatial_reference is None:
+        return read_shapefile(in_features, fields=fields)
+    import colstore
+    if colstore.is_store(in_features) and spatial_reference is None:
+        return colstore.read_features(in_features, fields=fields)
+    return read_arcpy(in_features, fields=fields or (), spatial_reference=spatial_reference)
+
+
+def numpy_dtype(values):
+    """dtype of a column in a structured array passed to arcpy (strings as fixed-width unicode)."""
+    values = np.asarray(values)
+    if values.dtype.kind in 'OSU':
+        return 'U{0}'.format(max(int(np.char.str_len(values.astype(str)).max(initial=1)), 1))
+    return values.dtype
+
+
+def write_points(out_fc, x, y, table, spatial_reference):
+    """Write points with the columns of table (dict of arrays) to a new feature class with arcpy, in one call."""
+    import arcpy
+    dtype = [('SHAPE_X', np.float64), ('SHAPE_Y', np.float64)] + [(k, numpy_dtype(v)) for k, v in table.items()]
+    arr = np.empty(len(x), dtype=dtype)
+    arr['SHAPE_X'], arr['SHAPE_Y'] = x, y
+    for k, v in table.items():
+        arr[k] = v
+    if arcpy.Exists(out_fc):
+        arcpy.Delete_management(out_fc)
+    arcpy.da.NumPyArrayToFeatureClass(arr, out_fc, ('SHAPE_X', 'SHAPE_Y'), spatial_reference)
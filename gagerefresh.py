@@ -0,0 +1,240 @@
+#Creation date: October 2026
+
+#Objective: Refresh the gage outputs (positions on NHDv2 and HUC12 of 3Gages_analysis2.py, Wild and Scenic Rivers
+#           within 500 m of 10wsrgages.py) from a new NWIS export (discharge_castdtinfo*.dbf) by only processing the
+#           sites that changed since the previous refresh, instead of rerunning everything
+#           - The sites of every refresh (site_no, coordinates and a signature of the days of record of every year) are
+#             kept in the store with the versions of the layers they were processed with (see flatgeom.layer_version)
+#           - Sites of the new export are compared to them by site_no: sites are added, removed, moved (coordinates
+#             changed) or have new record dates. Added and moved sites, and sites whose manual correction changed, go
+#             through the NHD ID join and snapping cascade, the HUC12 assignment and the WSR proximity again; records
+#             of the other sites are kept as they are, and records of removed sites are dropped. If one of the layers
+#             changed, all sites are processed again
+#           - Manual corrections of gage positions (gage_corrections.csv: site_no, x, y in the coordinate system of the
+#             outputs, COMID and an optional note) are applied on top of the cascade every time a site is processed,
+#             so they are kept across refreshes; checks of gage-WSR pairs are carried over as in 10wsrgages.py
+#           - Every refresh appends its changes to a change log (csv) with the old and new coordinates and the new
+#             position, HUC12 and number of WSR segments of every site that changed
+#           The first refresh (without previous sites) processes all the sites.
+
+import csv
+import datetime
+import json
+import os
+import re
+
+import numpy as np
+
+import fieldcalc
+import flatgeom
+import hashjoin
+
+#Changes that send a site through the spatial steps again
+REPROCESS = ('added', 'moved', 'reprocess')
+#Fields of the days of record of every year in the NWIS exports (1950, or X1950 after a round trip through R)
+_YEAR = re.compile(r'^X?(\d{4})$')
+LOG_FIELDS = ['date', 'source', 'site_no', 'change', 'lon_old', 'lat_old', 'lon', 'lat', 'positioning', 'tier',
+              'COMID', 'HUC12', 'WSR_NEAR']
+
+
+def _signature(years, days):
+    #64-bit hash (hexadecimal) of the (year, days of record) of the years with records of every row of days
+    h = np.full(len(days), 14695981039346656037, dtype=np.uint64)
+    for j, year in enumerate(years):
+        d = np.nan_to_num(days[:, j]).astype(np.uint64)
+        value = (np.uint64(year) << np.uint64(32)) | d
+        h = np.where(d > 0, (h ^ value) * np.uint64(1099511628211), h)
+    return np.char.mod('%016x', h)
+
+
+def site_table(records):
+    """Sites of an NWIS export (dict of arrays, e.g. flatgeom.read_dbf of discharge_castdtinfo*.dbf): site_no
+    (zero-padded), lon, lat (longitudes negative and latitudes positive, as in 3Gages B.) and records, a signature of
+    the days of record of every year (fields named by the year). Years without records are ignored, so adding the
+    field of a new year only changes the signature of the sites with records that year."""
+    site_no = hashjoin.normalize_keys(records['site_no'], 'site_no')
+    uniq, counts = np.unique(site_no, return_counts=True)
+    if (counts > 1).any():
+        raise ValueError('Duplicated sites in the export: {0}'.format(uniq[counts > 1][:5].tolist()))
+    fields = sorted((int(_YEAR.match(f).group(1)), f) for f in records if _YEAR.match(f))
+    days = (np.column_stack([fieldcalc.to_float(records[f]) for y, f in fields]) if fields else
+            np.zeros((len(site_no), 0)))
+    return {'site_no': site_no, 'lon': -np.abs(fieldcalc.to_float(records['dec_long_va'])),
+            'lat': np.abs(fieldcalc.to_float(records['dec_lat_va'])),
+            'records': _signature([y for y, f in fields], days)}
+
+
+def _same(a, b, tolerance):
+    return (np.abs(a - b) <= tolerance) | (np.isnan(a) & np.isnan(b))
+
+
+def diff(sites, previous=None, reprocess=(), tolerance=1e-7):
+    """Sites that changed between previous (site_table of the previous refresh, None for a first refresh) and sites.
+
+    Returns a dict of arrays, one record per site that changed sorted by site_no: site_no, change ('added',
+    'removed', 'moved' if a coordinate differs by more than tolerance degrees, 'reprocess' for the other sites in
+    reprocess (reprocess=True for all sites), including those whose days of record changed, or 'records' if only the
+    days of record changed), and the coordinates before (lon_old, lat_old) and after (lon, lat) the change (NaN if
+    none).
+    """
+    if previous is None:
+        previous = {'site_no': np.zeros(0, dtype='U8'), 'lon': np.zeros(0), 'lat': np.zeros(0),
+                    'records': np.zeros(0, dtype='U16')}
+    pos = hashjoin.match(sites['site_no'], previous['site_no'])
+    found = pos >= 0
+    lon_old, lat_old = hashjoin._take(previous['lon'], pos), hashjoin._take(previous['lat'], pos)
+    moved = found & ~(_same(sites['lon'], lon_old, tolerance) & _same(sites['lat'], lat_old, tolerance))
+    records = found & ~moved & (sites['records'] != hashjoin._take(previous['records'], pos))
+    again = np.ones(len(pos), dtype=bool) if reprocess is True else np.isin(sites['site_no'], np.asarray(reprocess))
+    change = np.full(len(pos), '', dtype='U9')
+    change[records] = 'records'
+    change[found & again & ~moved] = 'reprocess'
+    change[moved] = 'moved'
+    change[~found] = 'added'
+    gone = hashjoin.match(previous['site_no'], sites['site_no']) < 0
+    out = {'site_no': np.concatenate([sites['site_no'], previous['site_no'][gone]]),
+           'change': np.concatenate([change, np.full(gone.sum(), 'removed')]),
+           'lon_old': np.concatenate([lon_old, previous['lon'][gone]]),
+           'lat_old': np.concatenate([lat_old, previous['lat'][gone]]),
+           'lon': np.concatenate([sites['lon'], np.full(gone.sum(), np.nan)]),
+           'lat': np.concatenate([sites['lat'], np.full(gone.sum(), np.nan)])}
+    keep = out['change'] != ''
+    order = np.argsort(out['site_no'][keep], kind='stable')
+    return dict((k, v[keep][order]) for k, v in out.items())
+
+
+def load_sites(path):
+    """Sites (see site_table) and layer versions of the previous refresh saved with save_sites, (None, None) if
+    there was none."""
+    import colstore
+    if not os.path.exists(path):
+        return None, None
+    sites = colstore.read_table(path)
+    with open(os.path.splitext(path)[0] + '.json') as f:
+        meta = json.load(f)
+    return sites, meta['versions']
+
+
+def save_sites(path, sites, versions, source=None):
+    """Save the sites of a refresh (see site_table) to path (columnar store, see colstore.py) and the versions of the
+    layers they were processed with next to it (.json)."""
+    import colstore
+    colstore.write(path, sites)
+    with open(os.path.splitext(path)[0] + '.json', 'w') as f:
+        json.dump({'date': datetime.date.today().isoformat(), 'source': source, 'sites': len(sites['site_no']),
+                   'versions': versions}, f, indent=1)
+
+
+def load_events(layer, fields, path):
+    """Columns (fields) and coordinates (x, y) of the points of layer (e.g. the NHDPlus gage events), loaded from
+    path (.npz) if they were read from the current version of layer, otherwise read (through arcpy for feature
+    classes in a geodatabase) and saved to path. Points without a location (null shapes, see flatgeom.FlatGeometry)
+    are left out, as they can not position a gage."""
+    version = json.loads(json.dumps(flatgeom.layer_version(layer)))
+    if os.path.exists(path):
+        with np.load(path) as dat:
+            if json.loads(str(dat['version'])) == version:
+                return dict((k, dat[k]) for k in dat.files if k != 'version')
+    geoms, table = flatgeom.read_features(layer, fields=fields)
+    located = np.isfinite(geoms.xy).all(axis=1)
+    table = dict((k, np.asarray(v)[located]) for k, v in table.items())
+    table['x'], table['y'] = geoms.xy[located, 0], geoms.xy[located, 1]
+    np.savez(path, version=np.array(json.dumps(version)), **table)
+    return table
+
+
+########################################################################################################################
+# MANUAL CORRECTIONS
+def read_corrections(path):
+    """Manual corrections of gage positions (csv with site_no, x, y, COMID and optionally note), an empty table if
+    path does not exist. Records without coordinates are ignored."""
+    import csvingest
+    if not os.path.exists(path):
+        return {'site_no': np.zeros(0, dtype='U8'), 'x': np.zeros(0), 'y': np.zeros(0), 'COMID': np.zeros(0)}
+    table, report = csvingest.read_csv(path, [('site_no', 'site_no', 'text'), ('x', 'x', 'float'),
+                                              ('y', 'y', 'float'), ('COMID', 'COMID', 'float')])
+    csvingest.write_report(report, name=os.path.basename(path))
+    table['site_no'] = hashjoin.normalize_keys(table['site_no'], 'site_no')
+    valid = ~np.isnan(table['x']) & ~np.isnan(table['y'])
+    return dict((k, v[valid]) for k, v in table.items())
+
+
+def corrections_changed(corrections, gages, tolerance=0.01):
+    """Sites whose correction is not the current position in gages (dict with site_no, x, y and positioning):
+    corrections that were added or modified, and manual positions whose correction was removed."""
+    pos = hashjoin.match(corrections['site_no'], gages['site_no'])
+    p = np.maximum(pos, 0)
+    current = (pos >= 0) & (gages['positioning'][p] == 'manual') if len(gages['site_no']) else pos >= 0
+    if len(gages['site_no']):
+        current &= (np.abs(gages['x'][p] - corrections['x']) <= tolerance) & \
+                   (np.abs(gages['y'][p] - corrections['y']) <= tolerance)
+    dropped = (gages['positioning'] == 'manual') & (hashjoin.match(gages['site_no'], corrections['site_no']) < 0)
+    return np.union1d(corrections['site_no'][~current], gages['site_no'][dropped])
+
+
+def apply_corrections(positions, corrections):
+    """Positions (output of gagesnap.cascade) with the manual corrections applied: x, y and flowline_id from the
+    correction, positioning 'manual', tier 'correction', tier_rank 0 and distance from the original position."""
+    pos = hashjoin.match(hashjoin.normalize_keys(positions['site_no'], 'site_no'), corrections['site_no'])
+    fix = np.flatnonzero(pos >= 0)
+    if not len(fix):
+        return positions
+    out = dict(positions)
+    c = pos[fix]
+    for field, width in (('positioning', 6), ('tier', 10)):
+        out[field] = out[field].astype('U{0}'.format(max(width, out[field].dtype.itemsize // 4)))
+    out['x'], out['y'] = positions['x'].copy(), positions['y'].copy()
+    out['distance'] = np.array(positions['distance'], dtype=np.float64)
+    out['distance'][fix] = np.hypot(corrections['x'][c] - out['x'][fix], corrections['y'][c] - out['y'][fix])
+    out['x'][fix], out['y'][fix] = corrections['x'][c], corrections['y'][c]
+    out['flowline_id'] = positions['flowline_id'].copy()
+    out['flowline_id'][fix] = np.where(np.isnan(corrections['COMID'][c]), -1, corrections['COMID'][c])
+    out['positioning'][fix] = 'manual'
+    out['tier'][fix] = 'correction'
+    out['tier_rank'] = positions['tier_rank'].copy()
+    out['tier_rank'][fix] = 0
+    return out
+
+
+########################################################################################################################
+# MERGE AND CHANGE LOG
+def merge(previous, new, replaced, key='site_no'):
+    """Records of previous (dict of arrays, None if there is none) whose key is not in replaced, and the records of
+    new, sorted by key (records of the same key keep their order)."""
+    if previous is None:
+        table = new
+    else:
+        keep = ~np.isin(hashjoin.normalize_keys(previous[key], 'site_no'), replaced)
+        table = dict((k, np.concatenate([np.asarray(previous[k])[keep], np.asarray(new[k])])) for k in new)
+    order = np.argsort(hashjoin.normalize_keys(table[key], 'site_no'), kind='stable')
+    return dict((k, np.asarray(v)[order]) for k, v in table.items())
+
+
+def log_changes(path, changes, gages=None, huc=None, wsr_near=None, source=None, date=None):
+    """Append changes (see diff) to the change log at path (csv), with the new positioning, tier and COMID (gages),
+    HUC12 (huc) and number of WSR segments within the radius (wsr_near) of every site (blank if not given, or if the
+    site is not in them)."""
+    n = len(changes['site_no'])
+    cols = dict((k, changes[k]) for k in ('site_no', 'change', 'lon_old', 'lat_old', 'lon', 'lat'))
+    cols['date'] = np.full(n, date or datetime.date.today().isoformat())
+    cols['source'] = np.full(n, os.path.basename(source) if source else '')
+    for name, table, field in (('positioning', gages, 'positioning'), ('tier', gages, 'tier'),
+                               ('COMID', gages, 'COMID'), ('HUC12', huc, 'HUC12')):
+        cols[name] = np.full(n, '', dtype=object)
+        if table is not None:
+            pos = hashjoin.match(changes['site_no'], hashjoin.normalize_keys(table['site_no'], 'site_no'))
+            cols[name][pos >= 0] = np.asarray(table[field])[pos[pos >= 0]]
+    cols['WSR_NEAR'] = np.full(n, '', dtype=object)
+    if wsr_near is not None:
+        sites, counts = np.unique(hashjoin.normalize_keys(wsr_near['site_no'], 'site_no'), return_counts=True)
+        pos = hashjoin.match(changes['site_no'], sites)
+        cols['WSR_NEAR'][np.isin(changes['change'], REPROCESS)] = 0
+        cols['WSR_NEAR'][pos >= 0] = counts[pos[pos >= 0]]
+    new = not os.path.exists(path)
+    with open(path, 'a', newline='') as f:
+        writer = csv.writer(f)
+        if new:
+            writer.writerow(LOG_FIELDS)
+        for row in zip(*[cols[k] for k in LOG_FIELDS]):
+            writer.writerow(['' if isinstance(v, float) and np.isnan(v) else v for v in row])
+    return n
@@ -0,0 +1,191 @@
+#Creation date: October 2026
+
+#Objective: Snap gages to the nearest flowline segment within a tolerance, for all gages at once (replaces the
+#           arcpy.Snap_edit + Near_analysis + selection + CopyFeatures sequence of 3Gages_analysis2.py)
+#           - An STR tree (see strtree.py) is built once over the segments of a flowline layer and saved to disk with the
+#             ID (COMID) of the flowline of every segment, so that later runs only have to load it
+#           - For every gage, the segments whose box is within the tolerance are retrieved from the tree, the gage is
+#             projected onto each of them and the closest projection is kept
+#           - A cascade of tiers (join to the NHDPlus gage events by ID, then snap to network flowlines, then to
+#             non-network flowlines...) positions every gage in a single pass: each gage is only sent to the next tier
+#             if no previous tier matched it, and the output records which tier positioned it
+#           Coordinates must be in a projected coordinate system (e.g. NAD 1983 Contiguous USA Albers) so that the
+#           tolerance and distances are in meters.
+
+import json
+import os
+
+import numpy as np
+
+import flatgeom
+import hashjoin
+from strtree import STRtree
+
+
+class FlowlineIndex(object):
+    """Segments of a flowline layer (name, e.g. 'network'), the ID of their flowline and an STR tree over them."""
+
+    def __init__(self, x0, y0, x1, y1, ids, name, tree=None):
+        self.x0, self.y0, self.x1, self.y1 = x0, y0, x1, y1
+        self.ids = ids
+        self.name = name
+        if tree is None:
+            tree = STRtree(np.column_stack([np.minimum(x0, x1), np.minimum(y0, y1),
+                                            np.maximum(x0, x1), np.maximum(y0, y1)]))
+        self.tree = tree
+
+    @classmethod
+    def from_geometry(cls, geoms, feature_ids, name):
+        """Index of the segments of a FlatGeometry of polylines, with feature_ids[i] the ID of feature i."""
+        x0, y0, x1, y1, geom = geoms.edges()
+        return cls(x0, y0, x1, y1, np.asarray(feature_ids)[geom], name)
+
+    def save(self, path, version=None):
+        self.tree.save(path, x0=self.x0, y0=self.y0, x1=self.x1, y1=self.y1, ids=self.ids,
+                       name=np.array(self.name), version=np.array(json.dumps(version)))
+
+    @classmethod
+    def load(cls, path):
+        tree, extra = STRtree.load(path)
+        index = cls(extra['x0'], extra['y0'], extra['x1'], extra['y1'], extra['ids'], str(extra['name']), tree=tree)
+        index.version = json.loads(str(extra['version']))
+        return index
+
+    def candidates(self, x, y, tolerance):
+        """(gage index, segment index, distance, projected x, projected y, position along segment) of every segment
+        within tolerance of every gage. Gages without a location (NaN x or y, see flatgeom.FlatGeometry) have none."""
+        located = np.flatnonzero(np.isfinite(x) & np.isfinite(y))
+        gi, seg = self.tree.query_points(x[located], y[located], tolerance)
+        gi = located[gi]
+        ax, ay = self.x0[seg], self.y0[seg]
+        dx, dy = self.x1[seg] - ax, self.y1[seg] - ay
+        len2 = dx * dx + dy * dy
+        with np.errstate(invalid='ignore', divide='ignore'):
+            t = np.where(len2 > 0, ((x[gi] - ax) * dx + (y[gi] - ay) * dy) / len2, 0.0)
+        t = np.clip(t, 0.0, 1.0)
+        px, py = ax + t * dx, ay + t * dy
+        dist = np.hypot(x[gi] - px, y[gi] - py)
+        keep = dist <= tolerance
+        return gi[keep], seg[keep], dist[keep], px[keep], py[keep], t[keep]
+
+    def snap(self, x, y, tolerance=500.0):
+        """Snap every gage (x, y arrays) to the closest segment within tolerance.
+
+        Returns a dict of arrays: x, y (snapped location, original location if not snapped), distance (NaN if not
+        snapped), id (flowline ID of the segment), segment, position (0-1 along the segment), matched and network.
+        """
+        x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+        gi, seg, dist, px, py, t = self.candidates(x, y, tolerance)
+        #Closest segment of each gage (ties go to the first segment in the layer)
+        order = np.lexsort((seg, dist, gi))
+        first = order[np.concatenate([[True], gi[order][1:] != gi[order][:-1]])] if len(order) else order
+        n = len(x)
+        out = {'x': x.copy(), 'y': y.copy(), 'distance': np.full(n, np.nan), 'segment': np.full(n, -1),
+               'position': np.full(n, np.nan), 'matched': np.zeros(n, dtype=bool)}
+        g = gi[first]
+        out['x'][g], out['y'][g] = px[first], py[first]
+        out['distance'][g] = dist[first]
+        out['segment'][g] = seg[first]
+        out['position'][g] = t[first]
+        out['matched'][g] = True
+        fill = -1 if self.ids.dtype.kind in 'iu' else ''
+        ids = np.full(n, fill, dtype=self.ids.dtype)
+        ids[g] = self.ids[seg[first]]
+        out['id'] = ids
+        out['network'] = np.where(out['matched'], self.name, '')
+        return out
+
+
+def load_or_build(layer, id_field, name, path):
+    """FlowlineIndex of layer, loaded from path if it was built from the current version of layer, otherwise built
+    from the layer and saved to path."""
+    version = flatgeom.layer_version(layer)
+    if os.path.exists(path):
+        index = FlowlineIndex.load(path)
+        if index.version == json.loads(json.dumps(version)):
+            return index
+    geoms, table = flatgeom.read_features(layer, fields=[id_field])
+    index = FlowlineIndex.from_geometry(geoms, table[id_field], name)
+    index.save(path, version=version)
+    index.version = json.loads(json.dumps(version))
+    return index
+
+
+########################################################################################################################
+# TIERED CASCADE
+class JoinTier(object):
+    """Tier that positions gages whose ID is in keys at the matching (x, y), e.g. NHDPlus gage events by site number.
+
+    IDs and keys are normalized with hashjoin.normalize_keys(key_width). When a key is duplicated, the first record is
+    used. Records without a location (NaN x or y) are left out.
+    """
+
+    def __init__(self, name, keys, x, y, flowline_ids, positioning=None, key_width='site_no'):
+        self.name = name
+        self.positioning = positioning or name
+        self.key_width = key_width
+        x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+        located = np.isfinite(x) & np.isfinite(y)
+        self.keys = hashjoin.normalize_keys(keys, key_width)[located]
+        self.x, self.y = x[located], y[located]
+        self.flowline_ids = np.asarray(flowline_ids)[located]
+
+    def match(self, ids, x, y):
+        pos = hashjoin.match(hashjoin.normalize_keys(ids, self.key_width), self.keys)
+        matched = pos >= 0
+        pos = np.where(matched, pos, 0)
+        if not len(self.keys):
+            return {'matched': matched, 'x': np.asarray(x, dtype=np.float64), 'y': np.asarray(y, dtype=np.float64),
+                    'id': np.full(len(matched), -1), 'distance': np.full(len(matched), np.nan)}
+        return {'matched': matched, 'x': self.x[pos], 'y': self.y[pos], 'id': self.flowline_ids[pos],
+                'distance': np.hypot(self.x[pos] - x, self.y[pos] - y)}
+
+
+class SnapTier(object):
+    """Tier that snaps gages to the closest segment of a FlowlineIndex within tolerance."""
+
+    def __init__(self, index, tolerance=500.0, positioning='snapped', name=None):
+        self.index = index
+        self.tolerance = tolerance
+        self.positioning = positioning
+        self.name = name or index.name
+
+    def match(self, ids, x, y):
+        return self.index.snap(x, y, tolerance=self.tolerance)
+
+
+def cascade(ids, x, y, tiers, unmatched='notsnapped', unmatched_tier='manual'):
+    """Position every gage with the first tier (in order) that matches it.
+
+    tiers are objects with a name, a positioning tag and a match(ids, x, y) method returning a dict of arrays with
+    matched, x, y, distance and id (see JoinTier and SnapTier).
+    Returns a dict of columns, one row per gage: site_no, x, y (position given by the tier, original position if no
+    tier matched), positioning, tier (name of the tier, or unmatched_tier), tier_rank (1 for the first tier,
+    len(tiers) + 1 if no tier matched), distance (between the original and new position) and flowline_id (-1 if no
+    tier matched).
+    """
+    ids = np.asarray(ids)
+    x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+    n = len(ids)
+    width = max([len(unmatched)] + [len(t.positioning) for t in tiers])
+    tier_width = max([len(unmatched_tier)] + [len(t.name) for t in tiers])
+    out = {'site_no': ids, 'x': x.copy(), 'y': y.copy(),
+           'positioning': np.full(n, unmatched, dtype='U{0}'.format(width)),
+           'tier': np.full(n, unmatched_tier, dtype='U{0}'.format(tier_width)),
+           'tier_rank': np.full(n, len(tiers) + 1, dtype=np.int32),
+           'distance': np.full(n, np.nan), 'flowline_id': np.full(n, -1, dtype=np.int64)}
+    todo = np.arange(n)
+    for rank, tier in enumerate(tiers):
+        if not len(todo):
+            break
+        res = tier.match(ids[todo], x[todo], y[todo])
+        m = np.asarray(res['matched'])
+        sel = todo[m]
+        out['x'][sel], out['y'][sel] = res['x'][m], res['y'][m]
+        out['distance'][sel] = res['distance'][m]
+        out['flowline_id'][sel] = res['id'][m]
+        out['positioning'][sel] = tier.positioning
+        out['tier'][sel] = tier.name
+        out['tier_rank'][sel] = rank + 1
+        todo = todo[~m]
+    return out
@@ -0,0 +1,149 @@
+#Creation date: October 2026
+
+#Objective: Areas on the ellipsoid (equivalent of the AREA_GEODESIC of arcpy.AddGeometryAttributes_management)
+#           - Area of latitude/longitude cells, so that rasters in geographic coordinates can be used to measure areas
+#           - Area of polygons for whole layers at once (flat coordinate arrays, see flatgeom.py), split over a pool of
+#             worker processes for large layers. Latitudes are converted to authalic latitudes, which maps the ellipsoid
+#             onto a sphere of the same area (Snyder 1987), and the area of every ring is the sum of the spherical
+#             excess of the trapezoids between each edge and the equator. Edges are thus great circles on the authalic
+#             sphere rather than geodesics on the ellipsoid (as in ArcGIS AREA_GEODESIC). Compared with exact
+#             ellipsoidal geodesic areas (Karney 2013, as computed by pyproj.Geod), areas of compact polygons 30 m to
+#             300 km across differ by less than 1e-5 in relative terms (typically 1e-7, and less than 0.1 m2 for the
+#             smallest), thin polygons with edges of hundreds of km can differ by up to 0.1%.
+#           Latitudes and longitudes are in decimal degrees, areas are returned in square meters unless a unit of
+#           AREA_UNITS is given.
+
+import numpy as np
+
+import fieldcalc
+import workerpool
+import flatgeom
+
+#(semi-major axis in meters, flattening)
+GRS80 = (6378137.0, 1 / 298.257222101)
+WGS84 = (6378137.0, 1 / 298.257223563)
+
+#Square meters to each unit (US survey mile = 6336000/3937 m)
+AREA_UNITS = {'SQUARE_METERS': 1.0, 'HECTARES': 1e-4, 'SQUARE_KILOMETERS': 1e-6,
+              'SQUARE_MILES_US': (3937.0 / 6336000.0) ** 2, 'ACRES_US': (3937.0 / 6336000.0) ** 2 * 640}
+
+
+def convert_area(area, unit):
+    """Area in square meters converted to unit (one of AREA_UNITS)."""
+    try:
+        return area * AREA_UNITS[unit]
+    except KeyError:
+        raise ValueError('Unknown area unit {0!r}, must be one of {1}'.format(unit, sorted(AREA_UNITS)))
+
+
+def _q(lat, e):
+    #Authalic function q of the latitude (Snyder 1987, eq. 3-12)
+    s = np.sin(np.radians(lat))
+    if e == 0:
+        return 2 * s
+    return (1 - e * e) * (s / (1 - e * e * s * s) - np.log((1 - e * s) / (1 + e * s)) / (2 * e))
+
+
+def zone_area(lat0, lat1, dlon, ellipsoid=GRS80, unit='SQUARE_METERS'):
+    """Exact area of the quadrangle between latitudes lat0 and lat1 and dlon degrees of longitude wide."""
+    a, f = ellipsoid
+    e = np.sqrt(f * (2 - f))
+    area = np.abs(a * a / 2 * (_q(lat1, e) - _q(lat0, e)) * np.radians(dlon))
+    return convert_area(area, unit)
+
+
+def cell_areas(grid, ellipsoid=GRS80, unit='SQUARE_METERS'):
+    """Area of the cells of every row of a grid in decimal degrees (see zonal_stats.Grid)."""
+    top = grid.ymax - np.arange(grid.nrows) * grid.cellsize
+    return zone_area(top - grid.cellsize, top, grid.cellsize, ellipsoid=ellipsoid, unit=unit)
+
+
+def _eccentricity(ellipsoid):
+    a, f = ellipsoid
+    return np.sqrt(f * (2 - f))
+
+
+def authalic_radius(ellipsoid=GRS80):
+    """Radius of the sphere with the same area as the ellipsoid."""
+    return ellipsoid[0] * np.sqrt(_q(90.0, _eccentricity(ellipsoid)) / 2)
+
+
+def authalic_latitude(lat, ellipsoid=GRS80):
+    """Authalic latitude (radians) of geodetic latitudes (degrees)."""
+    e = _eccentricity(ellipsoid)
+    return np.arcsin(np.clip(_q(lat, e) / _q(90.0, e), -1, 1))
+
+
+def _edge_excess(lon0, lat0, lon1, lat1, ellipsoid):
+    t0 = np.tan(authalic_latitude(lat0, ellipsoid) / 2)
+    t1 = np.tan(authalic_latitude(lat1, ellipsoid) / 2)
+    #Longitude difference wrapped to [-180, 180)
+    dlon = np.radians((lon1 - lon0 + 180) % 360 - 180)
+    return 2 * np.arctan2(np.tan(dlon / 2) * (t0 + t1), 1 + t0 * t1)
+
+
+#Edges of the layer being processed, set in every worker process when it starts (see _init_worker)
+_edges = {}
+
+
+def _init_worker(edges):
+    _edges['edges'] = edges
+
+
+def _chunk_excess(bounds):
+    i, j = bounds
+    lon0, lat0, lon1, lat1, geom, ellipsoid = _edges['edges']
+    g0 = geom[i] if j > i else 0
+    #Excess summed by feature within the chunk (edges are in feature order)
+    return g0, np.bincount(geom[i:j] - g0, weights=_edge_excess(lon0[i:j], lat0[i:j], lon1[i:j], lat1[i:j], ellipsoid))
+
+
+def polygon_areas(geoms, unit='SQUARE_METERS', ellipsoid=GRS80, workers=1, chunk_size=2 * 10 ** 6):
+    """Area of every polygon of geoms (a FlatGeometry in decimal degrees), in unit (one of AREA_UNITS).
+
+    Rings wound in opposite directions are subtracted from each other, so holes must be wound in the opposite
+    direction of outer rings (as in shapefiles and arcpy geometries). Null geometries have an area of 0.
+    Edges are processed in chunks of chunk_size; with workers > 1 (or None, one worker per core), chunks are
+    processed by a pool of worker processes (see workerpool.py), which receive the edges once when they start.
+    """
+    lon0, lat0, lon1, lat1, geom = geoms.edges()
+    #Closing edges of open rings are appended at the end by edges(), put edges back in feature order
+    order = np.argsort(geom, kind='stable')
+    edges = (lon0[order], lat0[order], lon1[order], lat1[order], geom[order], ellipsoid)
+    chunks = [(i, min(i + chunk_size, len(geom))) for i in range(0, len(geom), chunk_size)]
+    excess = np.zeros(len(geoms))
+    pool = None
+    try:
+        if workers == 1 or len(chunks) <= 1:
+            _init_worker(edges)
+            results = map(_chunk_excess, chunks)
+        else:
+            pool = workerpool.pool(workers, initializer=_init_worker, initargs=(edges,))
+            results = pool.imap_unordered(_chunk_excess, chunks)
+        for g0, e in results:
+            excess[g0:g0 + len(e)] += e
+    except Exception:
+        if pool is not None:
+            pool.terminate()
+        raise
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        _edges.clear()
+    area = np.abs(excess) * authalic_radius(ellipsoid) ** 2
+    return convert_area(area, unit)
+
+
+def add_geodesic_area(in_features, field='AREA_GEO', unit='SQUARE_METERS', ellipsoid=GRS80, workers=None):
+    """Equivalent of arcpy.AddGeometryAttributes_management(in_features, "AREA_GEODESIC", Area_Unit=unit): write the
+    area of every polygon to field (created if needed). Projected layers are read in the geographic coordinate
+    system of their datum."""
+    import arcpy
+    sr = arcpy.Describe(in_features).spatialReference
+    if field not in [f.name for f in arcpy.ListFields(in_features)]:
+        arcpy.AddField_management(in_features, field, 'DOUBLE')
+    geoms, table = flatgeom.read_features(in_features, spatial_reference=sr.GCS if sr.type == 'Projected' else None)
+    area = polygon_areas(geoms, unit=unit, ellipsoid=ellipsoid, workers=workers)
+    fieldcalc.write_columns(in_features, {field: area})
+    return area
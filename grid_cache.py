@@ -0,0 +1,113 @@
+#Creation date: October 2026
+
+#Objective: Content-addressed on-disk cache of numpy grids computed from source files (e.g. the annual precipitation
+#           total of each yearly NLDAS NetCDF file, see rainfall_climatology.py)
+#           - Each grid is keyed by the size, modification time and SHA-1 hash of its source file plus the name of the
+#             variable it was computed from, and stored as a .npy file. Grids are read back into memory rather than
+#             memory-mapped, so that no cache file stays open and files can be evicted or replaced while grids read
+#             from them are still in use (Windows does not allow removing or replacing a mapped file)
+#           - The hash of a source file is only recomputed when its size or modification time changed, so checking the
+#             cache does not require re-reading files that were already hashed
+#           - The total size of the cache is capped and the least recently used grids are evicted first
+#           Only one process should write to a given cache directory at a time.
+
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+
+def file_hash(path, blocksize=2**20):
+    """SHA-1 hex digest of the content of path."""
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        block = f.read(blocksize)
+        while block:
+            h.update(block)
+            block = f.read(blocksize)
+    return h.hexdigest()
+
+
+class GridCache(object):
+    """Cache of .npy grids in cache_dir, holding at most max_bytes of data (None for no limit)."""
+
+    def __init__(self, cache_dir, max_bytes=None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        self.index_path = os.path.join(cache_dir, 'index.json')
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                index = json.load(f)
+        else:
+            index = {'entries': {}, 'sources': {}}
+        self.entries = index['entries']
+        self.sources = index['sources']
+
+    def save(self):
+        tmp = self.index_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'entries': self.entries, 'sources': self.sources}, f)
+        os.replace(tmp, self.index_path)
+
+    def key(self, path, variable):
+        """Cache key of the grid computed from variable in source file path."""
+        st = os.stat(path)
+        src = self.sources.get(os.path.abspath(path))
+        if src is None or src['size'] != st.st_size or src['mtime'] != st.st_mtime:
+            src = {'size': st.st_size, 'mtime': st.st_mtime, 'sha1': file_hash(path)}
+            self.sources[os.path.abspath(path)] = src
+        return hashlib.sha1('{0}|{1}|{2}|{3}'.format(
+            src['size'], src['mtime'], src['sha1'], variable).encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Grid stored under key (read into memory), or None if it is not in the cache."""
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        path = os.path.join(self.cache_dir, entry['file'])
+        if not os.path.exists(path):
+            del self.entries[key]
+            return None
+        entry['last_used'] = time.time()
+        return np.load(path)
+
+    def put(self, key, grid):
+        """Store grid under key, then evict the least recently used grids until the cache fits in max_bytes."""
+        name = key + '.npy'
+        tmp = os.path.join(self.cache_dir, key + '.tmp.npy')
+        np.save(tmp, np.asarray(grid))
+        os.replace(tmp, os.path.join(self.cache_dir, name))
+        self.entries[key] = {'file': name, 'bytes': os.path.getsize(os.path.join(self.cache_dir, name)),
+                             'last_used': time.time()}
+        self.evict(keep=key)
+        self.save()
+
+    def evict(self, keep=None):
+        if self.max_bytes is None:
+            return
+        total = sum(e['bytes'] for e in self.entries.values())
+        for key in sorted(self.entries, key=lambda k: self.entries[k]['last_used']):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            entry = self.entries.pop(key)
+            fpath = os.path.join(self.cache_dir, entry['file'])
+            if os.path.exists(fpath):
+                os.remove(fpath)
+            total -= entry['bytes']
+
+    def get_or_compute(self, path, variable, func):
+        """Cached grid for variable in path, computing it with func(path) and storing it if it is not cached."""
+        key = self.key(path, variable)
+        grid = self.get(key)
+        if grid is None:
+            grid = np.asarray(func(path))
+            self.put(key, grid)
+        else:
+            self.save()
+        return grid
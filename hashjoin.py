@@ -0,0 +1,201 @@
+#Creation date: October 2026
+
+#Objective: Join tables by key in memory instead of with MakeFeatureLayer/MakeTableView + AddJoin_management +
+#           CopyFeatures/CopyRows (gages to discharge records by site number, counties to Devineni et al.'s data by
+#           FIPS, HUC8 to fish diversity metrics...)
+#           - Tables are handled as columns (dict of numpy arrays, see fieldcalc.read_columns)
+#           - Keys of both tables are normalized (stripped and zero-padded, e.g. FIPS 1001 and '01001') before
+#             matching, so no intermediate padded key field has to be computed
+#           - The join table is loaded into a hash table once and every record of the input table is looked up in it
+#           - Inner, left and anti (records with no match, which replaces a KEEP_ALL join with an IS NULL selection)
+#             joins are supported. As with AddJoin, every input record is joined to at most one record: the first
+#             one with the same key
+#           - Joined attributes are added to a plain copy of the input features rather than to a joined layer, and only
+#             the features that are kept are copied
+
+import os
+
+import numpy as np
+
+import fieldcalc
+import flatgeom
+
+#Width of zero-padded codes
+KEY_WIDTHS = {'FIPS': 5, 'HUC2': 2, 'HUC4': 4, 'HUC6': 6, 'HUC8': 8, 'HUC12': 12, 'site_no': 8}
+
+
+def normalize_keys(values, width=None):
+    """Keys as stripped strings, left-padded with zeros to width if given (a number or a KEY_WIDTHS name). Null keys
+    (None, NaN or blank) are left empty."""
+    values = np.asarray(values)
+    keys = np.char.strip(fieldcalc.as_str(values))
+    null = keys == ''
+    if values.dtype.kind == 'f':
+        null |= np.isnan(values)
+    elif values.dtype.kind == 'O':
+        null |= np.array([v is None or v != v for v in values.ravel()], dtype=bool).reshape(values.shape)
+    keys[null] = ''
+    width = KEY_WIDTHS[width] if isinstance(width, str) else width
+    if width and keys.size:
+        keys = np.where(null, keys, np.char.zfill(keys, width))
+    return keys
+
+
+def match(left_keys, right_keys):
+    """Index of the first record of right_keys with the same key as every record of left_keys (-1 if none). Empty
+    keys never match."""
+    right_keys = np.asarray(right_keys).tolist()
+    #Walk the keys backwards so that the first record with a key is the one that is kept
+    table = dict(zip(right_keys[::-1], range(len(right_keys) - 1, -1, -1)))
+    table.pop('', None)
+    left_keys = np.asarray(left_keys).tolist()
+    return np.fromiter((table.get(k, -1) for k in left_keys), dtype=np.int64, count=len(left_keys))
+
+
+def _missing(values, n):
+    values = np.asarray(values)
+    if values.dtype.kind in 'OSU':
+        return np.full(n, '', dtype=values.dtype if values.dtype.kind != 'O' else 'U1')
+    if values.dtype.kind == 'b':
+        return np.zeros(n, dtype=bool)
+    return np.full(n, np.nan)
+
+
+def _take(values, pos):
+    """values[pos], with missing values (NaN or '') where pos is -1 (integer columns are returned as float)."""
+    values = np.asarray(values)
+    found = pos >= 0
+    if found.all():
+        return values[pos]
+    out = _missing(values, len(pos))
+    out[found] = values[pos[found]]
+    return out
+
+
+def join(left, right, left_on, right_on, how='inner', key_width=None, fields=None, suffix='_1'):
+    """Join the columns of right (dict of arrays) to the records of left (dict of arrays) with the same key.
+
+    how is 'inner' (left records with a match), 'left' (all left records, with NaN or '' in the right columns of those
+    without a match) or 'anti' (left records without a match, left columns only).
+    fields are the columns of right to join (default all); those whose name is already in left get suffix appended.
+    Returns the joined columns and the index of the left record of every output record.
+    """
+    pos = match(normalize_keys(left[left_on], key_width), normalize_keys(right[right_on], key_width))
+    if how == 'inner':
+        rows = np.flatnonzero(pos >= 0)
+    elif how == 'left':
+        rows = np.arange(len(pos))
+    elif how == 'anti':
+        rows = np.flatnonzero(pos < 0)
+    else:
+        raise ValueError("how must be 'inner', 'left' or 'anti', not {0!r}".format(how))
+    out = dict((k, np.asarray(v)[rows]) for k, v in left.items())
+    if how == 'anti':
+        return out, rows
+    for k in (fields if fields is not None else right.keys()):
+        out[k + suffix if k in left else k] = _take(right[k], pos[rows])
+    return out, rows
+
+
+########################################################################################################################
+# INPUTS AND OUTPUTS
+def _join_fields(join_field, how, fields):
+    #Only the key is needed for anti joins
+    if how == 'anti':
+        return [join_field]
+    return None if fields is None else [join_field] + [f for f in fields if f != join_field]
+
+
+def read_table(table, fields=None, null_value=None):
+    """Columns of a table: a dict of arrays is returned as is, a .dbf/.shp or a columnar store (.parquet, .arrow, see
+    colstore.py) is read directly, otherwise arcpy is used (all attribute fields if fields is None)."""
+    import colstore
+    if isinstance(table, dict):
+        return table if fields is None else dict((f, table[f]) for f in fields)
+    if colstore.is_store(table):
+        return colstore.read_table(table, fields=fields)
+    if fields is None and os.path.splitext(table)[1].lower() in ('.dbf', '.shp'):
+        return flatgeom.read_dbf(os.path.splitext(table)[0] + '.dbf')
+    if fields is None:
+        import arcpy
+        fields = [f.name for f in arcpy.ListFields(table) if f.type not in ('OID', 'Geometry', 'Blob', 'Raster')
+                  and f.name.lower() not in ('shape_length', 'shape_area')]
+    return fieldcalc.read_columns(table, fields, null_value=null_value)
+
+
+def _struct_array(columns):
+    dtype = [(k, flatgeom.numpy_dtype(v)) for k, v in columns.items()]
+    n = len(next(iter(columns.values()))) if columns else 0
+    arr = np.empty(n, dtype=dtype)
+    for k, v in columns.items():
+        arr[k] = v
+    return arr
+
+
+def write_table(out_table, columns):
+    """Write columns to a new table: a .dbf or a columnar store (.parquet, .arrow) directly, otherwise with
+    arcpy.da.NumPyArrayToTable (in one call)."""
+    import colstore
+    if os.path.splitext(out_table)[1].lower() == '.dbf':
+        flatgeom.write_dbf(out_table, columns)
+        return
+    if colstore.is_store(out_table):
+        colstore.write(out_table, columns)
+        return
+    import arcpy
+    if arcpy.Exists(out_table):
+        arcpy.Delete_management(out_table)
+    arcpy.da.NumPyArrayToTable(_struct_array(columns), out_table)
+
+
+def join_table(in_table, in_field, join_table, join_field, out_table, how='inner', key_width=None, fields=None,
+               null_value=None):
+    """Join join_table to in_table (tables, paths or dicts of arrays) and write the result to out_table (CopyRows of an
+    AddJoin)."""
+    right = read_table(join_table, fields=_join_fields(join_field, how, fields), null_value=null_value)
+    out, rows = join(read_table(in_table, null_value=null_value), right, in_field, join_field, how=how, key_width=key_width, fields=fields)
+    write_table(out_table, out)
+    return out
+
+
+def join_features(in_features, in_field, join_table, join_field, out_features, how='inner', key_width=None,
+                  fields=None, null_value=None):
+    """Copy in_features to out_features with the attributes of the matching record of join_table (CopyFeatures of an
+    AddJoin).
+
+    Keys are joined before anything is copied, and only the geometries of the features that are kept are copied (a
+    selection on their OIDs, without a joined layer); features without a match are left out (inner) or kept with null
+    attributes (left). Only the joined columns are then written, with arcpy.da.ExtendTable. With how='anti', only the
+    features without a match are copied and no attribute is joined.
+    """
+    import arcpy
+    oid = arcpy.da.TableToNumPyArray(in_features, ['OID@'])['OID@']
+    keys = fieldcalc.read_columns(in_features, [in_field], null_value=null_value)
+    right = read_table(join_table, fields=_join_fields(join_field, how, fields), null_value=null_value)
+    out, rows = join({'_OID_JOIN': oid, in_field: keys[in_field]}, right, in_field, join_field, how=how,
+                     key_width=key_width, fields=fields)
+    if arcpy.Exists(out_features):
+        arcpy.Delete_management(out_features)
+    kept = np.sort(out['_OID_JOIN'])
+    if len(kept) == len(oid):
+        arcpy.CopyFeatures_management(in_features, out_features)
+    else:
+        #Select the kept features by OID (or the dropped ones, whichever list is shorter)
+        drop = np.setdiff1d(oid, kept)
+        ids, op = (kept, 'IN') if len(kept) <= len(drop) else (drop, 'NOT IN')
+        where = '{0} {1} ({2})'.format(arcpy.AddFieldDelimiters(in_features, arcpy.Describe(in_features).OIDFieldName),
+                                       op, ','.join(str(i) for i in ids.tolist()) or '-1')
+        layer = arcpy.MakeFeatureLayer_management(in_features, 'join_features_lyr', where)
+        arcpy.CopyFeatures_management(layer, out_features)
+        arcpy.Delete_management(layer)
+    #Features are copied in OID order, so the n-th kept feature is the n-th feature of out_features
+    new_oid = np.sort(arcpy.da.TableToNumPyArray(out_features, ['OID@'])['OID@'])
+    out['_OID_JOIN'] = new_oid[np.searchsorted(kept, out['_OID_JOIN'])]
+    if how != 'anti':
+        existing = set(f.name for f in arcpy.ListFields(out_features))
+        cols = dict((k if k not in existing else k + '_1', v) for k, v in out.items()
+                    if k not in ('_OID_JOIN', in_field))
+        cols['_OID_JOIN'] = out['_OID_JOIN']
+        arcpy.da.ExtendTable(out_features, arcpy.Describe(out_features).OIDFieldName, _struct_array(cols),
+                             '_OID_JOIN')
+    return out
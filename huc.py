@@ -0,0 +1,147 @@
+#Creation date: October 2026
+
+#Objective: Roll attribute tables up the hydrologic unit (HUC) hierarchy without dissolving polygons
+#           - HUC codes are nested: the first 2, 4, 6, 8 and 10 digits of a HUC12 are the codes of its HUC2, HUC4,
+#             HUC6, HUC8 and HUC10. Codes are handled as int64 so that the parent of any code is an integer division
+#           - A HucIndex stores the parent codes of every HUC12 (e.g. those of the gages joined to the WBD) at every
+#             level, so that records keyed by HUC12 can be grouped by any level directly, and gives the HUC2 to HUC12
+#             columns of allgages_merge_HUCjoin (see 3Gages_analysis2.py)
+#           - rollup aggregates any table keyed by HUC codes to any coarser level with sums, means and area-weighted
+#             means in one grouped (np.bincount) pass, so switching between HUC4, HUC6 and HUC8 does not require a
+#             new Dissolve. Polygons only need to be dissolved to map the result (see dissolve)
+
+import os
+
+import numpy as np
+
+import fieldcalc
+import hashjoin
+
+#Number of digits of the code of each level
+HUC_LEVELS = {'HUC2': 2, 'HUC4': 4, 'HUC6': 6, 'HUC8': 8, 'HUC10': 10, 'HUC12': 12}
+
+
+def _digits(level):
+    if isinstance(level, str):
+        try:
+            return HUC_LEVELS[level.upper()]
+        except KeyError:
+            raise ValueError('Unknown HUC level {0!r}, must be one of {1}'.format(level, sorted(HUC_LEVELS)))
+    return int(level)
+
+
+def to_int(codes, level):
+    """HUC codes (text, with or without leading zeros, or numbers) of level as int64 (-1 for blank codes)."""
+    codes = hashjoin.normalize_keys(codes)
+    out = np.full(len(codes), -1, dtype=np.int64)
+    valid = np.char.isdigit(codes)
+    out[valid] = codes[valid].astype(np.int64)
+    return out
+
+
+def to_text(codes, level):
+    """int64 HUC codes of level as text, zero-padded to the number of digits of the level ('' for -1)."""
+    codes = np.asarray(codes, dtype=np.int64)
+    return np.where(codes >= 0, np.char.zfill(codes.astype(str), _digits(level)), '')
+
+
+def parent(codes, level, parent_level):
+    """Codes of the units of parent_level that contain units of level (both int64)."""
+    shift = _digits(level) - _digits(parent_level)
+    if shift < 0:
+        raise ValueError('{0} is not a parent of {1}'.format(parent_level, level))
+    codes = np.asarray(codes, dtype=np.int64)
+    return np.where(codes >= 0, codes // 10 ** shift, -1)
+
+
+class HucIndex(object):
+    """Parent codes (int64) at every level of a set of HUC codes of one level (HUC12 by default)."""
+
+    def __init__(self, codes, level='HUC12'):
+        self.level = level.upper()
+        self.codes = np.unique(np.asarray(codes, dtype=np.int64))
+        self.parents = dict((name, parent(self.codes, self.level, name)) for name, digits in HUC_LEVELS.items()
+                            if digits <= _digits(self.level))
+
+    @classmethod
+    def from_codes(cls, codes, level='HUC12'):
+        """Index of HUC codes as stored in a table (text or numbers)."""
+        codes = to_int(codes, level)
+        return cls(codes[codes >= 0], level)
+
+    def save(self, path):
+        np.savez(path, codes=self.codes, level=np.array(self.level))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as dat:
+            return cls(dat['codes'], str(dat['level']))
+
+    def lookup(self, codes, parent_level):
+        """Code of parent_level of every code (int64 of the level of the index, -1 if not in the index)."""
+        codes = np.asarray(codes, dtype=np.int64)
+        if not len(self.codes):
+            return np.full(len(codes), -1, dtype=np.int64)
+        pos = np.clip(np.searchsorted(self.codes, codes), 0, len(self.codes) - 1)
+        return np.where(self.codes[pos] == codes, self.parents[parent_level.upper()][pos], -1)
+
+    def columns(self, codes):
+        """Zero-padded text codes of every level (HUC2 to the level of the index) of codes (int64 of the level of the
+        index), as a dict of columns named by level ('' for codes that are not in the index)."""
+        codes = np.asarray(codes, dtype=np.int64)
+        return dict((name, to_text(self.lookup(codes, name), name)) for name in sorted(self.parents, key=_digits))
+
+
+def rollup(table, huc_field, level, stats, huc_level=None):
+    """Aggregate the records of table (dict of arrays) to the units of level that contain their HUC (huc_field).
+
+    huc_level is the level of the codes in huc_field (guessed from the length of the longest code if None).
+    stats is a list of (output field, input field, statistic) with statistic one of 'sum', 'mean', 'count' or
+    ('weighted_mean', weight field), e.g. ('EWU', 'EWU', 'mean') or ('NDC', 'NDC', ('weighted_mean', 'AREA')).
+    NaN values are ignored, as nulls in Dissolve statistics.
+    Returns a dict of columns: level (zero-padded codes) and the output fields, one record per unit of level.
+    """
+    keys = hashjoin.normalize_keys(table[huc_field])
+    if huc_level is None:
+        huc_level = int(np.char.str_len(keys).max(initial=_digits(level)))
+    codes = parent(to_int(keys, huc_level), huc_level, level)
+    valid = codes >= 0
+    units, group = np.unique(codes[valid], return_inverse=True)
+    n = len(units)
+    out = {'HUC{0}'.format(_digits(level)): to_text(units, level)}
+    for name, field, stat in stats:
+        values = np.asarray(table[field], dtype=np.float64)[valid]
+        ok = ~np.isnan(values)
+        if stat == 'count':
+            out[name] = np.bincount(group[ok], minlength=n)
+        elif stat == 'sum':
+            out[name] = np.bincount(group[ok], weights=values[ok], minlength=n)
+        elif stat == 'mean' or (isinstance(stat, tuple) and stat[0] == 'weighted_mean'):
+            w = np.ones(len(values)) if stat == 'mean' else np.asarray(table[stat[1]], dtype=np.float64)[valid]
+            ok &= ~np.isnan(w)
+            total = np.bincount(group[ok], weights=(values * w)[ok], minlength=n)
+            weight = np.bincount(group[ok], weights=w[ok], minlength=n)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                out[name] = np.where(weight > 0, total / weight, np.nan)
+        else:
+            raise ValueError('Unknown statistic {0!r}'.format(stat))
+    return out
+
+
+def dissolve(in_features, huc_field, level, out_features, table=None, huc_level=None):
+    """Polygons of the units of level (only needed for maps): in_features dissolved on the parent code of huc_field,
+    with the columns of table (e.g. the output of rollup) joined by code."""
+    import arcpy
+    field = 'HUC{0}_id'.format(_digits(level))
+    if field not in [f.name for f in arcpy.ListFields(in_features)]:
+        arcpy.AddField_management(in_features, field, 'TEXT')
+    fieldcalc.calculate(in_features, [huc_field], lambda c: {field: fieldcalc.substr(
+        hashjoin.normalize_keys(c[huc_field], huc_level and _digits(huc_level)), 0, _digits(level))})
+    if table is None:
+        arcpy.Dissolve_management(in_features, out_features, dissolve_field=[field])
+        return
+    tmp = os.path.join('in_memory', os.path.basename(out_features) + '_dissolve')
+    arcpy.Dissolve_management(in_features, tmp, dissolve_field=[field])
+    key = [k for k in table if k.upper() == 'HUC{0}'.format(_digits(level))][0]
+    hashjoin.join_features(tmp, field, table, key, out_features, how='left', key_width=_digits(level))
+    arcpy.Delete_management(tmp)
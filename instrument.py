@@ -0,0 +1,345 @@
+#Creation date: October 2026
+
+#Objective: Record the wall time, CPU time, peak memory, rows in and out and bytes read of every named stage of a run
+#           (e.g. 'snap_network', 'rainfall_year_1987', 'zonal_HUC6') to find which step is the bottleneck
+#           - with instrument.stage('zonal_HUC6', rows_in=n) as s: ... s.rows_out = m   (or the @instrument.timed
+#             decorator for functions). Stages can be nested
+#           - instrument.progress(iterable, 'name', total=n) reports progress at most every 10 seconds, instead of
+#             printing every row of a cursor
+#           - Memory is sampled by a background thread while a stage is open; spikes between two samples are caught
+#             with the peak resident memory of the process (peak_rss), which never decreases
+#           - Bytes read are the bytes read by the process during the stage (from the I/O counters of the operating
+#             system, including reads served from the file cache), plus bytes declared with add_bytes
+#           - report(prefix) writes prefix.json (every record), prefix.csv (one row per stage) and prefix.folded
+#             (self time of every stack of stages in milliseconds, the folded format of flamegraph.pl and speedscope).
+#             trace='chrome' writes prefix.trace.json instead (Chrome trace events, for chrome://tracing or Perfetto)
+#           - If the environment variable INSTRUMENT_REPORT is set (e.g. by stages.Pipeline, for every stage), the
+#             report of the default recorder is written to that prefix when the process exits
+
+import atexit
+import contextlib
+import csv
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+#Bytes per page of /proc/self/statm
+try:
+    _PAGE = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError, ValueError, OSError):
+    _PAGE = 4096
+
+
+def peak_rss():
+    """Peak resident set size of this process in bytes (None if it cannot be measured on this platform)."""
+    try:
+        import resource
+    except ImportError:
+        try:
+            import psutil
+        except ImportError:
+            return None
+        mem = psutil.Process().memory_info()
+        return getattr(mem, 'peak_wset', mem.rss)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    #ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def current_rss():
+    """Resident set size of this process in bytes (None if it cannot be measured on this platform)."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE
+    except (IOError, OSError):
+        pass
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process().memory_info().rss
+
+
+def bytes_read():
+    """Bytes read by this process so far (None if it cannot be measured on this platform)."""
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                if line.startswith('rchar:'):
+                    return int(line.split()[1])
+    except (IOError, OSError):
+        pass
+    try:
+        import psutil
+        io = psutil.Process().io_counters()
+    except (ImportError, AttributeError):
+        return None
+    return getattr(io, 'read_chars', io.read_bytes)
+
+
+def _mb(nbytes):
+    return None if nbytes is None else round(nbytes / 2.0 ** 20, 1)
+
+
+def _delta(end, start):
+    return None if end is None or start is None else end - start
+
+
+class StageRecord(object):
+    """Measures of one run of a stage. rows_in and rows_out can be set or incremented inside the stage."""
+
+    def __init__(self, name, path, rows_in=None, rows_out=None):
+        self.name = name
+        self.path = list(path)
+        self.rows_in = rows_in
+        self.rows_out = rows_out
+        self.extra_bytes = 0
+        self.start = time.time()
+        self.wall = self.cpu = self.bytes_read = None
+        self.rss_start = self.peak = current_rss()
+        self.error = None
+        self._cpu0 = time.process_time()
+        self._io0 = bytes_read()
+        self._peak0 = peak_rss()
+
+    def add_rows(self, rows_in=0, rows_out=0):
+        self.rows_in = (self.rows_in or 0) + rows_in
+        self.rows_out = (self.rows_out or 0) + rows_out
+
+    def add_bytes(self, nbytes):
+        """Count bytes read by another process (e.g. a file read by a worker or by an arcpy tool out of process), or
+        the size of a file (path)."""
+        if not isinstance(nbytes, (int, float)):
+            nbytes = os.path.getsize(nbytes)
+        self.extra_bytes += nbytes
+
+    def sample(self, rss):
+        if rss is not None and (self.peak is None or rss > self.peak):
+            self.peak = rss
+
+    def close(self, error=None):
+        self.wall = time.time() - self.start
+        self.cpu = time.process_time() - self._cpu0
+        self.sample(current_rss())
+        #If the peak of the process increased during the stage, the stage reached it (possibly between two samples)
+        peak = peak_rss()
+        if peak is not None and self._peak0 is not None and peak > self._peak0:
+            self.sample(peak)
+        io = _delta(bytes_read(), self._io0)
+        self.bytes_read = self.extra_bytes + (io or 0) if io is not None or self.extra_bytes else None
+        self.error = error
+
+    def as_dict(self):
+        rows = self.rows_out if self.rows_out is not None else self.rows_in
+        return {'stage': self.name, 'path': self.path, 'start': self.start, 'wall_s': self.wall, 'cpu_s': self.cpu,
+                'rss_start_mb': _mb(self.rss_start), 'peak_rss_mb': _mb(self.peak), 'rows_in': self.rows_in,
+                'rows_out': self.rows_out, 'bytes_read': self.bytes_read,
+                'rows_per_s': rows / self.wall if rows is not None and self.wall else None,
+                'pid': os.getpid(), 'error': self.error}
+
+
+class Recorder(object):
+    """Records of the stages of a run. verbose prints a line at the end of every stage; memory is sampled every
+    interval seconds while a stage is open."""
+
+    def __init__(self, verbose=True, interval=0.1):
+        self.verbose = verbose
+        self.interval = interval
+        self.records = []
+        self._open = []
+        self._lock = threading.Lock()
+        self._sampler = None
+
+    def reset(self):
+        with self._lock:
+            self.records = []
+
+    def _sample(self):
+        while True:
+            with self._lock:
+                if not self._open:
+                    self._sampler = None
+                    return
+                rss = current_rss()
+                for rec in self._open:
+                    rec.sample(rss)
+            time.sleep(self.interval)
+
+    @contextlib.contextmanager
+    def stage(self, name, rows_in=None, rows_out=None):
+        """Context manager that records a stage; yields its StageRecord."""
+        with self._lock:
+            rec = StageRecord(name, [r.name for r in self._open], rows_in=rows_in, rows_out=rows_out)
+            self._open.append(rec)
+            if self._sampler is None:
+                self._sampler = threading.Thread(target=self._sample)
+                self._sampler.daemon = True
+                self._sampler.start()
+        error = None
+        try:
+            yield rec
+        except BaseException as e:
+            error = '{0}: {1}'.format(type(e).__name__, e)
+            raise
+        finally:
+            with self._lock:
+                self._open.remove(rec)
+                rec.close(error)
+                self.records.append(rec)
+            if self.verbose:
+                print(self.describe(rec))
+
+    def add(self, record):
+        """Add the record of a stage measured in another process (dict of StageRecord.as_dict, e.g. returned by a
+        pool worker), nested in the stages that are open in this process."""
+        with self._lock:
+            record = dict(record, path=[r.name for r in self._open] + list(record['path']))
+            self.records.append(record)
+        if self.verbose:
+            print(self.describe(record))
+
+    def timed(self, name=None):
+        """Decorator that records every call of a function as a stage (named after the function by default)."""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.stage(name or func.__name__):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def current(self):
+        """Innermost open stage (None if no stage is open)."""
+        with self._lock:
+            return self._open[-1] if self._open else None
+
+    @staticmethod
+    def describe(rec):
+        r = rec if isinstance(rec, dict) else rec.as_dict()
+        text = '[{0}] {1:.1f} s (CPU {2:.1f} s)'.format('/'.join(r['path'] + [r['stage']]), r['wall_s'], r['cpu_s'])
+        if r['rows_in'] is not None or r['rows_out'] is not None:
+            text += ', rows {0} -> {1}'.format(r['rows_in'], r['rows_out'])
+        if r['peak_rss_mb'] is not None:
+            text += ', peak {0} MB'.format(r['peak_rss_mb'])
+        if r['bytes_read'] and r['bytes_read'] >= 2 ** 20 / 10.0:
+            text += ', read {0} MB'.format(_mb(r['bytes_read']))
+        if r['error']:
+            text += ', failed ({0})'.format(r['error'])
+        return text
+
+    def report(self, prefix, trace='folded'):
+        """Write prefix.json, prefix.csv and the trace of the stages (trace 'folded', 'chrome' or None)."""
+        write_report([r if isinstance(r, dict) else r.as_dict() for r in self.records], prefix, trace=trace)
+
+
+def _self_times(records):
+    #Wall time of every record minus that of the stages nested in it, in milliseconds
+    out = []
+    for r in records:
+        stack = r['path'] + [r['stage']]
+        children = sum(c['wall_s'] for c in records if c['path'] == stack and
+                       r['start'] <= c['start'] <= r['start'] + r['wall_s'])
+        out.append((';'.join(stack), max(r['wall_s'] - children, 0) * 1000))
+    return out
+
+
+def write_report(records, prefix, trace='folded'):
+    """Write records (dicts, see StageRecord.as_dict) to prefix.json, prefix.csv and prefix.folded or
+    prefix.trace.json (trace 'folded' or 'chrome', no trace if None)."""
+    folder = os.path.dirname(prefix)
+    if folder and not os.path.isdir(folder):
+        os.makedirs(folder)
+    records = sorted(records, key=lambda r: r['start'])
+    with open(prefix + '.json', 'w') as f:
+        json.dump({'stages': records}, f, indent=1)
+    columns = ['stage', 'parent', 'start', 'wall_s', 'cpu_s', 'rss_start_mb', 'peak_rss_mb', 'rows_in', 'rows_out',
+               'bytes_read', 'rows_per_s', 'pid', 'error']
+    with open(prefix + '.csv', 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for r in records:
+            writer.writerow([r['stage'], '/'.join(r['path'])] + [r[c] for c in columns[2:]])
+    if trace == 'folded':
+        totals = {}
+        for stack, ms in _self_times(records):
+            totals[stack] = totals.get(stack, 0) + ms
+        with open(prefix + '.folded', 'w') as f:
+            for stack in sorted(totals):
+                f.write('{0} {1}\n'.format(stack, int(round(totals[stack]))))
+    elif trace == 'chrome':
+        t0 = records[0]['start'] if records else 0
+        events = [{'name': r['stage'], 'cat': '/'.join(r['path']), 'ph': 'X', 'pid': r['pid'], 'tid': r['pid'],
+                   'ts': int((r['start'] - t0) * 1e6), 'dur': int(r['wall_s'] * 1e6),
+                   'args': dict((k, r[k]) for k in ('cpu_s', 'peak_rss_mb', 'rows_in', 'rows_out', 'bytes_read'))}
+                  for r in records]
+        with open(prefix + '.trace.json', 'w') as f:
+            json.dump({'traceEvents': events}, f)
+    elif trace is not None:
+        raise ValueError("trace must be 'folded', 'chrome' or None")
+
+
+def merge_reports(reports, prefix, records=(), trace='folded'):
+    """Combine the JSON reports of several runs (dict of name: path prefix of a report, e.g. one per stage of a
+    stages.Pipeline) into one report, nesting the stages of every report under its name (records are added as they
+    are, e.g. one per run with its total time). Missing reports are skipped."""
+    records = list(records)
+    for name, path in sorted(reports.items()):
+        if not os.path.exists(path + '.json'):
+            continue
+        with open(path + '.json') as f:
+            for r in json.load(f)['stages']:
+                r['path'] = [name] + r['path']
+                records.append(r)
+    write_report(records, prefix, trace=trace)
+    return records
+
+
+#Default recorder of the process
+RUN = Recorder()
+
+
+def stage(name, rows_in=None, rows_out=None):
+    """Record a stage with the default recorder (see Recorder.stage)."""
+    return RUN.stage(name, rows_in=rows_in, rows_out=rows_out)
+
+
+def timed(name=None):
+    """Decorator that records every call of a function with the default recorder."""
+    return RUN.timed(name)
+
+
+def report(prefix, trace='folded'):
+    """Write the report of the default recorder (see Recorder.report)."""
+    RUN.report(prefix, trace=trace)
+
+
+def progress(iterable, name, total=None, every=10.0, record=None):
+    """Iterate over iterable, printing the number of items done (and the percentage and remaining time if total is
+    given) at most every every seconds, and once at the end if the loop took longer than every. Items are added to
+    record.rows_in if record (a StageRecord) is given."""
+    if total is None and hasattr(iterable, '__len__'):
+        total = len(iterable)
+    start = last = time.time()
+    i = 0
+    for i, item in enumerate(iterable, 1):
+        yield item
+        now = time.time()
+        if now - last >= every:
+            last = now
+            rate = i / (now - start)
+            if total:
+                print('{0}: {1}/{2} ({3:.0%}), {4:.0f}/s, {5:.0f} s left'.format(name, i, total, i / float(total),
+                                                                                 rate, (total - i) / rate))
+            else:
+                print('{0}: {1}, {2:.0f}/s'.format(name, i, rate))
+    if record is not None:
+        record.add_rows(rows_in=i)
+    if last > start:
+        print('{0}: {1} done in {2:.1f} s'.format(name, i, time.time() - start))
+
+
+if os.environ.get('INSTRUMENT_REPORT'):
+    atexit.register(RUN.report, os.environ['INSTRUMENT_REPORT'])
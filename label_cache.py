@@ -0,0 +1,153 @@
+#Creation date: October 2026
+
+#Objective: Rasterize each zone layer (counties, HUC6, census blocks, census block x flood zone intersections...) only
+#           once for a given grid and reuse the label raster for every value raster it is combined with
+#           - Label rasters are keyed by zone layer (path and version of the source), zone field, grid origin,
+#             cell size, dimensions and coordinate system
+#           - They are stored on disk as tiles of rows in .npy format that are read back memory-mapped. Tiles use the
+#             smallest integer type that holds every label and tiles with no zone are not written at all, which keeps
+#             them small without losing the ability to memory-map them
+#           - Label i + 1 in the raster is zone_keys[i] (0 is outside every zone)
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+import colstore
+import flatgeom
+import projection
+import zonal_stats
+
+
+def read_zones(layer, zone_field, crs=None):
+    """Geometries (FlatGeometry) and zone_field of the features of layer, projected to crs (the coordinate system of
+    the grid they are rasterized on) if given: on the fly by arcpy for feature classes and shapefiles, with pyproj for
+    columnar stores."""
+    if crs is None:
+        geoms, table = flatgeom.read_features(layer, fields=[zone_field])
+    elif colstore.is_store(layer):
+        geoms, table = colstore.read_features(layer, fields=[zone_field])
+        src = colstore.crs(layer)
+        if src is None:
+            raise ValueError('The coordinate system of {0} is unknown, it cannot be rasterized on a grid in {1}'.format(
+                layer, crs))
+        if not projection.same_crs(src, crs):
+            x, y = projection.transform(geoms.xy[:, 0], geoms.xy[:, 1], src, crs)
+            geoms = flatgeom.FlatGeometry(np.column_stack([x, y]), geoms.part_offsets, geoms.geom_offsets, geoms.kind)
+    else:
+        import arcpy
+        if isinstance(crs, int):
+            sr = arcpy.SpatialReference(crs)
+        else:
+            sr = arcpy.SpatialReference()
+            sr.loadFromString(crs)
+        geoms, table = flatgeom.read_features(layer, fields=[zone_field], spatial_reference=sr)
+    return geoms, table[zone_field]
+
+
+def label_dtype(nzones):
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if nzones <= np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+class LabelRaster(object):
+    """Tiled label raster in a cache directory; slicing rows (labels[row0:row1]) reads the tiles memory-mapped."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        g = meta['grid']
+        self.grid = zonal_stats.Grid(g['xmin'], g['ymax'], g['cellsize'], g['nrows'], g['ncols'], g['crs'])
+        self.tile_rows = meta['tile_rows']
+        self.tiles = set(meta['tiles'])
+        self.dtype = np.dtype(meta['dtype'])
+        self.zone_field = meta['zone_field']
+        self.zone_keys = np.load(os.path.join(path, 'zone_keys.npy'))
+
+    @property
+    def shape(self):
+        return self.grid.shape
+
+    def tile(self, t):
+        """Rows of tile t, memory-mapped (or zeros if no zone falls in the tile)."""
+        row0 = t * self.tile_rows
+        row1 = min(row0 + self.tile_rows, self.grid.nrows)
+        if t not in self.tiles:
+            return np.zeros((row1 - row0, self.grid.ncols), dtype=self.dtype)
+        return np.load(os.path.join(self.path, 'tile_{0:05d}.npy'.format(t)), mmap_mode='r')
+
+    def __getitem__(self, key):
+        rows = key[0] if isinstance(key, tuple) else key
+        cols = key[1] if isinstance(key, tuple) and len(key) > 1 else slice(None)
+        row0, row1, step = rows.indices(self.grid.nrows)
+        if step != 1:
+            raise ValueError('Only contiguous row slices of label rasters can be read')
+        t0, t1 = row0 // self.tile_rows, max(row1 - 1, row0) // self.tile_rows
+        if t0 == t1:
+            return self.tile(t0)[row0 - t0 * self.tile_rows:row1 - t0 * self.tile_rows, cols]
+        return np.concatenate([self.tile(t) for t in range(t0, t1 + 1)])[
+            row0 - t0 * self.tile_rows:row1 - t0 * self.tile_rows, cols]
+
+    def zonal_stats(self, values, nodata=None):
+        """Statistics of a value raster on the same grid within every zone (see zonal_stats.zonal_stats)."""
+        return zonal_stats.zonal_stats_labels(self, self.zone_keys, values, zone_field=self.zone_field, nodata=nodata,
+                                              cellsize=self.grid.cellsize, tile_rows=self.tile_rows)
+
+
+class LabelCache(object):
+    """Directory of label rasters, one subdirectory per zone layer, zone field and grid."""
+
+    def __init__(self, cache_dir, tile_rows=1024):
+        self.cache_dir = cache_dir
+        self.tile_rows = tile_rows
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def key(self, layer, zone_field, grid):
+        desc = json.dumps([os.path.abspath(layer), flatgeom.layer_version(layer), zone_field, grid.xmin, grid.ymax,
+                           grid.cellsize, grid.nrows, grid.ncols, str(grid.crs), self.tile_rows])
+        return hashlib.sha1(desc.encode('utf-8')).hexdigest()
+
+    def get(self, layer, zone_field, grid):
+        """Cached LabelRaster, or None if this layer was never rasterized on this grid."""
+        path = os.path.join(self.cache_dir, self.key(layer, zone_field, grid))
+        if not os.path.exists(os.path.join(path, 'meta.json')):
+            return None
+        return LabelRaster(path)
+
+    def put(self, layer, zone_field, grid, geoms, zone_keys):
+        """Rasterize geoms (features of layer with zone_keys in zone_field) on grid and store the label raster."""
+        path = os.path.join(self.cache_dir, self.key(layer, zone_field, grid))
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        keys, labels = zonal_stats.zone_labels(zone_keys)
+        dtype = label_dtype(len(keys))
+        np.save(os.path.join(path, 'zone_keys.npy'), keys)
+        tiles = []
+        for t, (row0, row1, block) in enumerate(zonal_stats.label_tiles(geoms, labels, grid,
+                                                                        tile_rows=self.tile_rows)):
+            if block.any():
+                np.save(os.path.join(path, 'tile_{0:05d}.npy'.format(t)), block.astype(dtype))
+                tiles.append(t)
+        meta = {'layer': layer, 'zone_field': zone_field, 'tile_rows': self.tile_rows, 'tiles': tiles,
+                'dtype': np.dtype(dtype).name,
+                'grid': {'xmin': grid.xmin, 'ymax': grid.ymax, 'cellsize': grid.cellsize, 'nrows': grid.nrows,
+                         'ncols': grid.ncols, 'crs': grid.crs}}
+        #meta.json is written last, so an interrupted rasterization is not mistaken for a complete one
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+        return LabelRaster(path)
+
+    def get_or_rasterize(self, layer, zone_field, grid):
+        """Label raster of layer by zone_field on grid, rasterizing the layer (projected to the coordinate system of
+        the grid) only if it is not cached yet."""
+        labels = self.get(layer, zone_field, grid)
+        if labels is None:
+            geoms, zone_keys = read_zones(layer, zone_field, grid.crs)
+            labels = self.put(layer, zone_field, grid, geoms, zone_keys)
+        return labels
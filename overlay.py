@@ -0,0 +1,158 @@
+#Creation date: October 2026
+
+#Objective: Area-weighted overlay of a source polygon layer (counties, census blocks...) with a target polygon layer
+#           (HUC6 watersheds...) without intersecting, dissolving and joining the layers
+#           - Both layers are rasterized on the same grid (label rasters, see label_cache.py, so rasterizations are
+#             reused) and the area of every (source, target) pair of zones is tallied block by block into a sparse
+#             weight matrix (only the pairs that overlap are stored)
+#           - Any number of source attributes can then be summed, averaged or apportioned to the target zones with one
+#             sparse matrix-vector product each (a grouped np.bincount)
+#           - Weight matrices are saved to disk so that the overlay is only computed once for a pair of layers
+#           A cell is assigned to the zones that contain its center, so accuracy depends on the cell size: areas of
+#           intersection are within about half a cell along the boundaries of the pair of zones. Zones smaller than a
+#           cell may not get any cell. On an equal-area grid (e.g. NAD 1983 Contiguous USA Albers), cells all have the
+#           area cellsize^2; on a geographic grid, the exact ellipsoidal area of the cells of every row is used
+#           (see geodesic.cell_areas).
+
+import os
+
+import numpy as np
+
+import geodesic
+import hashjoin
+from zonal_stats import row_blocks
+
+
+def _pair_areas(source, target, row_area, tile_rows):
+    """Codes (source label * (ntarget + 1) + target label) of the overlapping pairs of labels and their area."""
+    nt = len(target.zone_keys) + 1
+    codes, areas = [], []
+    for row0, row1 in row_blocks(source.grid.nrows, tile_rows):
+        s = np.asarray(source[row0:row1], dtype=np.int64)
+        t = np.asarray(target[row0:row1], dtype=np.int64)
+        both = (s > 0) & (t > 0)
+        if not both.any():
+            continue
+        code = (s * nt + t)[both]
+        w = np.broadcast_to(row_area[row0:row1, None], s.shape)[both]
+        u, inverse = np.unique(code, return_inverse=True)
+        codes.append(u)
+        areas.append(np.bincount(inverse.ravel(), weights=w))
+    if not codes:
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+    u, inverse = np.unique(np.concatenate(codes), return_inverse=True)
+    return u, np.bincount(inverse.ravel(), weights=np.concatenate(areas))
+
+
+def _zone_areas(labels, row_area, tile_rows):
+    area = np.zeros(len(labels.zone_keys) + 1)
+    for row0, row1 in row_blocks(labels.grid.nrows, tile_rows):
+        block = np.asarray(labels[row0:row1], dtype=np.int64)
+        area += np.bincount(block.ravel(), weights=np.broadcast_to(row_area[row0:row1, None], block.shape).ravel(),
+                            minlength=len(area))
+    return area[1:]
+
+
+class AreaWeights(object):
+    """Sparse matrix of the area (square meters) of the intersection of source zones with target zones.
+
+    source and target are the indices in source_keys and target_keys of every non-zero element.
+    source_area and target_area are the total area of every zone, covered_area() the area of every target zone that
+    is covered by source zones.
+    """
+
+    def __init__(self, source_keys, target_keys, source, target, area, source_area, target_area):
+        self.source_keys = np.asarray(source_keys)
+        self.target_keys = np.asarray(target_keys)
+        self.source = np.asarray(source, dtype=np.int64)
+        self.target = np.asarray(target, dtype=np.int64)
+        self.area = np.asarray(area, dtype=np.float64)
+        self.source_area = np.asarray(source_area, dtype=np.float64)
+        self.target_area = np.asarray(target_area, dtype=np.float64)
+
+    @classmethod
+    def from_labels(cls, source, target, ellipsoid=None):
+        """Weights of two label rasters (see label_cache.LabelRaster) on the same grid; ellipsoid (e.g.
+        geodesic.GRS80) if the grid is in decimal degrees."""
+        grid = source.grid
+        if (grid.xmin, grid.ymax, grid.cellsize, grid.shape) != (target.grid.xmin, target.grid.ymax,
+                                                                 target.grid.cellsize, target.grid.shape):
+            raise ValueError('Source and target label rasters must be on the same grid')
+        if ellipsoid is None:
+            row_area = np.full(grid.nrows, grid.cellsize ** 2)
+        else:
+            row_area = geodesic.cell_areas(grid, ellipsoid=ellipsoid)
+        codes, area = _pair_areas(source, target, row_area, source.tile_rows)
+        nt = len(target.zone_keys) + 1
+        return cls(source.zone_keys, target.zone_keys, codes // nt - 1, codes % nt - 1, area,
+                   _zone_areas(source, row_area, source.tile_rows), _zone_areas(target, row_area, source.tile_rows))
+
+    @classmethod
+    def cached(cls, source, target, cache_dir, ellipsoid=None):
+        """Weights of two label rasters, loaded from cache_dir if they were already computed (label rasters are keyed
+        by the version of their layer, so the weights are recomputed when either layer changes)."""
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        path = os.path.join(cache_dir, 'weights_{0}_{1}_{2}.npz'.format(
+            os.path.basename(os.path.normpath(source.path)), os.path.basename(os.path.normpath(target.path)),
+            'planar' if ellipsoid is None else '{0:.3f}_{1:.12f}'.format(*ellipsoid)))
+        if os.path.exists(path):
+            return cls.load(path)
+        weights = cls.from_labels(source, target, ellipsoid=ellipsoid)
+        weights.save(path)
+        return weights
+
+    def save(self, path):
+        tmp = path + '.tmp.npz'
+        np.savez(tmp, source_keys=self.source_keys, target_keys=self.target_keys, source=self.source,
+                 target=self.target, area=self.area, source_area=self.source_area, target_area=self.target_area)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as dat:
+            return cls(dat['source_keys'], dat['target_keys'], dat['source'], dat['target'], dat['area'],
+                       dat['source_area'], dat['target_area'])
+
+    def align(self, keys, values, key_width=None):
+        """values (one per record of a table with keys) in the order of source_keys, NaN for missing sources."""
+        pos = hashjoin.match(hashjoin.normalize_keys(self.source_keys, key_width),
+                             hashjoin.normalize_keys(keys, key_width))
+        out = np.full(len(self.source_keys), np.nan)
+        out[pos >= 0] = np.asarray(values, dtype=np.float64)[pos[pos >= 0]]
+        return out
+
+    def _matvec(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        v = values[self.source]
+        valid = ~np.isnan(v)
+        return np.bincount(self.target[valid], weights=(self.area * v)[valid], minlength=len(self.target_keys)), \
+            np.bincount(self.target[valid], weights=self.area[valid], minlength=len(self.target_keys))
+
+    def sum(self, values, unit='SQUARE_METERS'):
+        """Sum of values times the area of intersection (in unit) over every target zone, e.g. a density times an
+        area. values are in the order of source_keys (see align); NaN values are ignored."""
+        return geodesic.convert_area(self._matvec(values)[0], unit)
+
+    def mean(self, values):
+        """Area-weighted mean of values over every target zone (NaN where no source zone with a value overlaps)."""
+        total, area = self._matvec(values)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(area > 0, total / area, np.nan)
+
+    def apportion(self, values):
+        """Sum over every target zone of values (e.g. population) split in proportion to the area of each source
+        zone that falls in the target zone."""
+        values = np.asarray(values, dtype=np.float64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.sum(values / self.source_area)
+
+    def covered_area(self, unit='SQUARE_METERS'):
+        """Area of every target zone covered by source zones."""
+        return geodesic.convert_area(np.bincount(self.target, weights=self.area, minlength=len(self.target_keys)),
+                                     unit)
+
+    def pairs(self, source_field='SOURCE', target_field='TARGET', unit='SQUARE_METERS'):
+        """Table of the overlapping pairs of zones and the area of their intersection (AREA)."""
+        return {source_field: self.source_keys[self.source], target_field: self.target_keys[self.target],
+                'AREA': geodesic.convert_area(self.area, unit)}
@@ -0,0 +1,201 @@
+#Creation date: October 2026
+
+#Objective: Assign points (gages, NWIS sites...) to the polygon that contains them (e.g. WBD HUC12 watersheds), for
+#           millions of points at once (replaces SpatialJoin_analysis(match_option="WITHIN") and the manual correction of
+#           the gages that fall outside of every polygon)
+#           - The polygons are prepared once: a regular grid is laid over them, the edges of their rings are bucketed by
+#             the cells that their box overlaps, and the polygon that contains the center of every cell is found by
+#             casting a horizontal ray through every row of cell centers. The prepared grid is saved to disk with the ID
+#             of every polygon so that later runs only have to load it
+#           - A point is then in the polygon of the center of its cell, unless the segment from the center to the point
+#             crosses edges of the cell: the point is in a polygon if that segment crosses an odd number of its edges
+#             (ray casting from the center rather than from infinity, so only the few edges of the cell are tested)
+#           - Points in no polygon (e.g. on the coast, or in gaps between polygons) fall back to the polygon with the
+#             closest edge within a tolerance (STR tree over the edges, see gagesnap.FlowlineIndex), and the distance to
+#             that polygon is reported
+#           Coordinates of the points and the polygons must be in the same projected coordinate system (e.g. NAD 1983
+#           Contiguous USA Albers) so that the tolerance and distances are in meters. Points exactly on an edge are
+#           assigned to either polygon.
+
+import json
+import os
+
+import numpy as np
+
+import flatgeom
+from flatgeom import _local_index, _ranges
+from gagesnap import FlowlineIndex
+from strtree import STRtree
+
+
+def _cells(x, origin, cellsize, n):
+    return np.clip(np.floor((x - origin) / cellsize), 0, n - 1).astype(np.int64)
+
+
+def _left(ax, ay, bx, by, cx, cy):
+    #True if c is to the left of the line from a to b (points on the line are on the right)
+    return (bx - ax) * (cy - ay) - (by - ay) * (cx - ax) > 0
+
+
+class PolygonIndex(FlowlineIndex):
+    """Edges of the rings of a polygon layer (ids of the edges are the index of their polygon), an STR tree over them
+    and a grid of edge buckets and cell center polygons (see prepare), with the ID of every polygon."""
+
+    def __init__(self, x0, y0, x1, y1, ids, feature_ids, name, tree=None, grid=None, edges_per_cell=2.0):
+        FlowlineIndex.__init__(self, x0, y0, x1, y1, ids, name, tree=tree)
+        self.feature_ids = np.asarray(feature_ids)
+        self.grid = grid if grid is not None else self.prepare(edges_per_cell)
+
+    @classmethod
+    def from_geometry(cls, geoms, feature_ids, name, edges_per_cell=2.0):
+        """Index of a FlatGeometry of polygons, with feature_ids[i] the ID of polygon i."""
+        x0, y0, x1, y1, geom = geoms.edges()
+        return cls(x0, y0, x1, y1, geom, feature_ids, name, edges_per_cell=edges_per_cell)
+
+    def prepare(self, edges_per_cell=2.0):
+        """Grid with about edges_per_cell edges per cell: origin (xmin, ymin), cellsize, shape (nrows, ncols), the
+        edges of every cell (cell_edges[cell_start[c]:cell_start[c + 1]], rows from the bottom) and the polygon that
+        contains the center of every cell (center, -1 if none)."""
+        x0, y0, x1, y1 = self.x0, self.y0, self.x1, self.y1
+        if not len(x0):
+            return {'origin': np.zeros(2), 'cellsize': np.array(1.0), 'shape': np.array([1, 1]),
+                    'cell_start': np.zeros(2, dtype=np.int64), 'cell_edges': np.zeros(0, dtype=np.int64),
+                    'center': np.full(1, -1, dtype=np.int32)}
+        xmin, ymin = min(x0.min(), x1.min()), min(y0.min(), y1.min())
+        width, height = max(x0.max(), x1.max()) - xmin, max(y0.max(), y1.max()) - ymin
+        cellsize = max(np.sqrt(width * height * edges_per_cell / len(x0)), width / 2 ** 15, height / 2 ** 15, 1e-9)
+        ncols, nrows = int(width // cellsize) + 1, int(height // cellsize) + 1
+        #Cells overlapped by the box of every edge
+        c0 = _cells(np.minimum(x0, x1), xmin, cellsize, ncols)
+        c1 = _cells(np.maximum(x0, x1), xmin, cellsize, ncols)
+        r0 = _cells(np.minimum(y0, y1), ymin, cellsize, nrows)
+        r1 = _cells(np.maximum(y0, y1), ymin, cellsize, nrows)
+        nc, nr = c1 - c0 + 1, r1 - r0 + 1
+        edge = np.repeat(np.arange(len(x0)), nc * nr)
+        k = _local_index(nc * nr)
+        cell = (r0[edge] + k // nc[edge]) * ncols + c0[edge] + k % nc[edge]
+        order = np.argsort(cell, kind='stable')
+        cell_start = np.concatenate([[0], np.cumsum(np.bincount(cell, minlength=nrows * ncols))])
+        cell_edges = edge[order]
+        #Polygon of the center of every cell: crossings of every row of centers by the edges, sorted by polygon and x
+        ycenter = ymin + (np.arange(nrows) + 0.5) * cellsize
+        lo = np.clip(np.ceil((np.minimum(y0, y1) - ymin) / cellsize - 0.5), 0, nrows).astype(np.int64)
+        hi = np.clip(np.ceil((np.maximum(y0, y1) - ymin) / cellsize - 0.5), 0, nrows).astype(np.int64)
+        e = np.repeat(np.arange(len(x0)), hi - lo)
+        row = _ranges(lo, hi)
+        yc = ycenter[row]
+        straddle = (y0[e] > yc) != (y1[e] > yc)
+        e, row, yc = e[straddle], row[straddle], yc[straddle]
+        xc = x0[e] + (yc - y0[e]) * (x1[e] - x0[e]) / (y1[e] - y0[e])
+        poly = self.ids[e]
+        order = np.lexsort((xc, row, poly))
+        xc, row, poly = xc[order], row[order], poly[order]
+        #Crossings alternate between entering and leaving the polygon along a row (rings are closed, so every polygon
+        #is crossed an even number of times by a row)
+        first = np.concatenate([[True], (row[1:] != row[:-1]) | (poly[1:] != poly[:-1])]) if len(row) else row > 0
+        rank = np.arange(len(row)) - np.maximum.accumulate(np.where(first, np.arange(len(row)), 0))
+        enter = np.flatnonzero(rank % 2 == 0)
+        enter = enter[enter + 1 < len(row)]
+        col0 = np.clip(np.ceil((xc[enter] - xmin) / cellsize - 0.5), 0, ncols).astype(np.int64)
+        col1 = np.clip(np.ceil((xc[enter + 1] - xmin) / cellsize - 0.5), 0, ncols).astype(np.int64)
+        col1 = np.maximum(col0, col1)
+        center = np.full(nrows * ncols, -1, dtype=np.int32)
+        center[np.repeat(row[enter], col1 - col0) * ncols + _ranges(col0, col1)] = np.repeat(poly[enter], col1 - col0)
+        return {'origin': np.array([xmin, ymin]), 'cellsize': np.array(cellsize), 'shape': np.array([nrows, ncols]),
+                'cell_start': cell_start, 'cell_edges': cell_edges, 'center': center}
+
+    def save(self, path, version=None):
+        grid = dict(('grid_' + k, v) for k, v in self.grid.items())
+        self.tree.save(path, x0=self.x0, y0=self.y0, x1=self.x1, y1=self.y1, ids=self.ids,
+                       feature_ids=self.feature_ids, name=np.array(self.name), version=np.array(json.dumps(version)),
+                       **grid)
+
+    @classmethod
+    def load(cls, path):
+        tree, extra = STRtree.load(path)
+        grid = dict((k[5:], v) for k, v in extra.items() if k.startswith('grid_'))
+        index = cls(extra['x0'], extra['y0'], extra['x1'], extra['y1'], extra['ids'], extra['feature_ids'],
+                    str(extra['name']), tree=tree, grid=grid)
+        index.version = json.loads(str(extra['version']))
+        return index
+
+    def contains(self, x, y, chunk_size=10 ** 6):
+        """Index of the polygon that contains every point (-1 if none; the first polygon if polygons overlap)."""
+        x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+        grid = self.grid
+        (xmin, ymin), cellsize, (nrows, ncols) = grid['origin'], float(grid['cellsize']), grid['shape']
+        npoly = len(self.feature_ids)
+        out = np.full(len(x), -1, dtype=np.int64)
+        for i in range(0, len(x), chunk_size):
+            col = np.floor((x[i:i + chunk_size] - xmin) / cellsize)
+            row = np.floor((y[i:i + chunk_size] - ymin) / cellsize)
+            ingrid = np.flatnonzero((col >= 0) & (col < ncols) & (row >= 0) & (row < nrows))
+            col, row = col[ingrid], row[ingrid]
+            px, py = x[i + ingrid], y[i + ingrid]
+            cell = (row * ncols + col).astype(np.int64)
+            label = grid['center'][cell].astype(np.int64)
+            #Edges of the cell of every point that cross the segment from the center of the cell to the point
+            start, count = grid['cell_start'][cell], grid['cell_start'][cell + 1] - grid['cell_start'][cell]
+            pi = np.repeat(np.arange(len(cell)), count)
+            edge = grid['cell_edges'][np.repeat(start, count) + _local_index(count)]
+            ax, ay, bx, by = self.x0[edge], self.y0[edge], self.x1[edge], self.y1[edge]
+            sx, sy = xmin + (col[pi] + 0.5) * cellsize, ymin + (row[pi] + 0.5) * cellsize
+            tx, ty = px[pi], py[pi]
+            cross = ((_left(ax, ay, bx, by, sx, sy) != _left(ax, ay, bx, by, tx, ty)) &
+                     (_left(sx, sy, tx, ty, ax, ay) != _left(sx, sy, tx, ty, bx, by)))
+            #Polygons whose edges are crossed an odd number of times: the point leaves the polygon of the center, or
+            #enters another polygon
+            code, n = np.unique(pi[cross] * npoly + self.ids[edge[cross]], return_counts=True)
+            odd = code[n % 2 == 1]
+            point, polygon = odd // npoly, odd % npoly
+            leave = polygon == label[point]
+            label[point[leave]] = -1
+            enter = np.flatnonzero(~leave)
+            if len(enter):
+                enter = enter[np.concatenate([[True], point[enter][1:] != point[enter][:-1]])]
+                label[point[enter]] = polygon[enter]
+            out[i + ingrid] = label
+        return out
+
+    def nearest(self, x, y, tolerance):
+        """Index of the polygon with the closest edge within tolerance of every point (-1 if none) and the distance to
+        that edge (NaN if none)."""
+        snapped = self.snap(x, y, tolerance=tolerance)
+        return np.where(snapped['matched'], self.ids[np.maximum(snapped['segment'], 0)], -1), snapped['distance']
+
+    def assign(self, x, y, tolerance=1000.0):
+        """Polygon of every point: the polygon that contains it, otherwise the polygon with the closest edge within
+        tolerance. Points without a location (NaN x or y, e.g. null shapes, see flatgeom.FlatGeometry) get none.
+
+        Returns a dict of arrays: polygon (index, -1 if none), feature_id ('' or -1 if none), distance (0 for points
+        within a polygon, NaN if none) and match ('within', 'nearest' or 'none').
+        """
+        x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+        located = np.isfinite(x) & np.isfinite(y)
+        polygon = np.full(len(x), -1, dtype=np.int64)
+        polygon[located] = self.contains(x[located], y[located])
+        distance = np.where(polygon >= 0, 0.0, np.nan)
+        match = np.where(polygon >= 0, 'within', 'none').astype('U7')
+        out = np.flatnonzero((polygon < 0) & located)
+        if len(out):
+            near, dist = self.nearest(x[out], y[out], tolerance)
+            polygon[out], distance[out] = near, dist
+            match[out[near >= 0]] = 'nearest'
+        fill = -1 if self.feature_ids.dtype.kind in 'iu' else ''
+        feature_id = np.full(len(x), fill, dtype=self.feature_ids.dtype)
+        feature_id[polygon >= 0] = self.feature_ids[polygon[polygon >= 0]]
+        return {'polygon': polygon, 'feature_id': feature_id, 'distance': distance, 'match': match}
+
+
+def load_or_build(layer, id_field, path, spatial_reference=None):
+    """PolygonIndex of layer (projected to spatial_reference if given), loaded from path if it was built from the
+    current version of layer, otherwise built from the layer and saved to path."""
+    version = flatgeom.layer_version(layer)
+    if os.path.exists(path):
+        index = PolygonIndex.load(path)
+        if index.version == json.loads(json.dumps(version)):
+            return index
+    geoms, table = flatgeom.read_features(layer, fields=[id_field], spatial_reference=spatial_reference)
+    index = PolygonIndex.from_geometry(geoms, table[id_field], os.path.basename(layer))
+    index.save(path, version=version)
+    return index
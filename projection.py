@@ -0,0 +1,201 @@
+#Creation date: October 2026
+
+#Objective: Project coordinates with pyproj rather than whole layers with arcpy.Project_management, and only project
+#           the flowlines that are near the gages to snap (see gagesnap.py) instead of projecting all of NHDPlus
+#           - Transformers are built once per (source, target) coordinate system and kept for the whole process, and
+#             coordinates are transformed as arrays, in batches
+#           - The segments of a flowline layer are indexed once in its own geographic coordinates (STR tree, see
+#             strtree.py) and the index is saved to disk with the version of the layer (see flatgeom.layer_version), so
+#             the layer is only read again when it changes. Segments are grouped in tiles of tile_size degrees
+#           - To snap gages (in projected coordinates), the squares of tolerance around the gages are transformed back
+#             to geographic coordinates and the segments whose box intersects them are retrieved from the index. Only
+#             the tiles of those segments are projected (all the missing tiles in one batch), and projected tiles are
+#             saved to disk under a key of the version of the layer and the target coordinate system, so that later
+#             runs load them instead of projecting them again. A gagesnap.FlowlineIndex of the candidate segments then
+#             snaps the gages
+#           Segments are projected by their end points, as Project_management does for lines without densification.
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+import gagesnap
+
+#Transformers already built in this process, by (source, target) coordinate system, and geographic coordinate systems
+#of the datums of coordinate systems
+_transformers = {}
+_geodetic = {}
+
+
+def crs_input(crs):
+    """crs as pyproj reads it: arcpy factory codes are EPSG codes, or ESRI codes for Esri coordinate systems (e.g.
+    102039), and the precision that arcpy appends to WKT (SpatialReference.exportToString) is dropped."""
+    if isinstance(crs, int):
+        return '{0}:{1}'.format('EPSG' if crs < 100000 else 'ESRI', crs)
+    if isinstance(crs, str) and crs.lstrip().startswith(('PROJCS', 'GEOGCS')):
+        return crs.split(';')[0]
+    return crs
+
+
+def same_crs(a, b):
+    """Whether a and b (anything that crs_input accepts) are the same coordinate system."""
+    if a == b:
+        return True
+    import pyproj
+    return pyproj.CRS.from_user_input(crs_input(a)).equals(pyproj.CRS.from_user_input(crs_input(b)),
+                                                           ignore_axis_order=True)
+
+
+def transformer(src, dst):
+    """pyproj Transformer from src to dst (anything that pyproj accepts, e.g. 'EPSG:4269' or WKT), with x, y in
+    longitude, latitude order for geographic coordinate systems. Transformers are built once per process."""
+    key = (src, dst)
+    if key not in _transformers:
+        import pyproj
+        _transformers[key] = pyproj.Transformer.from_crs(pyproj.CRS.from_user_input(crs_input(src)),
+                                                         pyproj.CRS.from_user_input(crs_input(dst)), always_xy=True)
+    return _transformers[key]
+
+
+def geodetic_crs(crs):
+    """Geographic coordinate system (WKT) of the datum of crs (e.g. NAD83 for NAD 1983 Contiguous USA Albers)."""
+    if crs not in _geodetic:
+        import pyproj
+        _geodetic[crs] = pyproj.CRS.from_user_input(crs_input(crs)).geodetic_crs.to_wkt()
+    return _geodetic[crs]
+
+
+def transform(x, y, src, dst, batch_size=2 ** 20):
+    """Arrays of x and y transformed from src to dst, batch_size coordinates at a time."""
+    x, y = np.asarray(x, dtype=np.float64).ravel(), np.asarray(y, dtype=np.float64).ravel()
+    t = transformer(src, dst)
+    out_x, out_y = np.empty(len(x)), np.empty(len(y))
+    for start in range(0, len(x), batch_size):
+        out_x[start:start + batch_size], out_y[start:start + batch_size] = t.transform(x[start:start + batch_size],
+                                                                                         y[start:start + batch_size])
+    return out_x, out_y
+
+
+class GeographicFlowlines(object):
+    """Segments of a flowline layer in geographic coordinates (a gagesnap.FlowlineIndex in decimal degrees, crs its
+    coordinate system) grouped in tiles of tile_size degrees; projected tiles are cached in cache_dir."""
+
+    def __init__(self, index, crs, cache_dir, version=None, tile_size=1.0):
+        self.index = index
+        self.name = index.name
+        self.crs = crs
+        self.cache_dir = cache_dir
+        self.version = version
+        self.tile_size = tile_size
+        #Tile of every segment (of its first vertex), and the segments of every tile
+        col = np.floor((index.x0 + 180.0) / tile_size).astype(np.int64)
+        row = np.floor((index.y0 + 90.0) / tile_size).astype(np.int64)
+        self.tile = row * int(np.ceil(360.0 / tile_size)) + col
+        self.order = np.argsort(self.tile, kind='stable')
+        self.tile_keys, self.tile_starts = np.unique(self.tile[self.order], return_index=True)
+        self.tile_ends = np.append(self.tile_starts[1:], len(self.order))
+        #Position of every segment in its tile
+        self.position = np.empty(len(self.order), dtype=np.int64)
+        self.position[self.order] = np.arange(len(self.order)) - np.repeat(self.tile_starts,
+                                                                           self.tile_ends - self.tile_starts)
+
+    @classmethod
+    def load_or_build(cls, layer, id_field, name, cache_dir, crs, tile_size=1.0):
+        """Segments of layer (in the geographic coordinate system crs), loaded from cache_dir if they were indexed
+        from the current version of layer, otherwise read from layer (through arcpy for geodatabases) and saved."""
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        index = gagesnap.load_or_build(layer, id_field, name, os.path.join(cache_dir, 'segments.npz'))
+        return cls(index, crs, cache_dir, version=index.version, tile_size=tile_size)
+
+    def projected(self, crs):
+        """ProjectedFlowlines of these segments in crs."""
+        return ProjectedFlowlines(self, crs)
+
+
+class ProjectedFlowlines(object):
+    """Segments of GeographicFlowlines projected to crs, tile by tile, when gages are snapped to them. Has the name and
+    snap method of a gagesnap.FlowlineIndex, so it can be used in a gagesnap.SnapTier."""
+
+    def __init__(self, layer, crs, margin=1.5):
+        self.layer = layer
+        self.name = layer.name
+        self.crs = crs
+        #Half-size of the squares around the gages, in multiples of the tolerance (distances are not preserved by the
+        #projection and the sides of the squares are curved in geographic coordinates)
+        self.margin = margin
+        key = hashlib.sha1(json.dumps([layer.version, str(layer.crs), str(crs), layer.tile_size],
+                                      sort_keys=True).encode('utf-8')).hexdigest()[:16]
+        self.tile_dir = os.path.join(layer.cache_dir, 'projected_' + key)
+        self._tiles = {}
+
+    def _tile_path(self, tile):
+        return os.path.join(self.tile_dir, 'tile_{0}.npz'.format(tile))
+
+    def _load_tiles(self, tiles):
+        #Projected x0, y0, x1, y1 of the segments of every tile, from disk or projected (in one batch) and saved
+        missing = []
+        for tile in tiles:
+            if tile in self._tiles:
+                continue
+            if os.path.exists(self._tile_path(tile)):
+                with np.load(self._tile_path(tile)) as dat:
+                    self._tiles[tile] = dat['xy']
+            else:
+                missing.append(tile)
+        if not missing:
+            return
+        if not os.path.isdir(self.tile_dir):
+            os.makedirs(self.tile_dir)
+            with open(os.path.join(self.tile_dir, 'source.json'), 'w') as f:
+                json.dump({'layer': self.name, 'version': self.layer.version, 'source_crs': str(self.layer.crs),
+                           'crs': str(self.crs), 'tile_size': self.layer.tile_size}, f, indent=1)
+        lay, index = self.layer, self.layer.index
+        pos = np.searchsorted(lay.tile_keys, missing)
+        counts = lay.tile_ends[pos] - lay.tile_starts[pos]
+        seg = lay.order[np.concatenate([np.arange(lay.tile_starts[p], lay.tile_ends[p]) for p in pos])]
+        x, y = transform(np.concatenate([index.x0[seg], index.x1[seg]]), np.concatenate([index.y0[seg], index.y1[seg]]),
+                         lay.crs, self.crs)
+        n = len(seg)
+        xy = np.column_stack([x[:n], y[:n], x[n:], y[n:]])
+        for tile, part in zip(missing, np.split(xy, np.cumsum(counts)[:-1])):
+            tmp = self._tile_path(tile) + '.tmp.npz'
+            np.savez(tmp, xy=part)
+            os.replace(tmp, self._tile_path(tile))
+            self._tiles[tile] = part
+
+    def candidates(self, x, y, tolerance):
+        """Indices (in the layer) of the segments near the gages (x, y in crs) and a gagesnap.FlowlineIndex of them
+        in crs."""
+        x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+        lay, index = self.layer, self.layer.index
+        #Squares around the gages (with a location), transformed to geographic coordinates by their corners
+        located = np.isfinite(x) & np.isfinite(y)
+        x, y = x[located], y[located]
+        d = tolerance * self.margin
+        cx = np.concatenate([x - d, x + d, x - d, x + d])
+        cy = np.concatenate([y - d, y - d, y + d, y + d])
+        lon, lat = transform(cx, cy, self.crs, lay.crs)
+        lon, lat = lon.reshape(4, -1), lat.reshape(4, -1)
+        boxes = np.column_stack([lon.min(axis=0), lat.min(axis=0), lon.max(axis=0), lat.max(axis=0)])
+        seg = np.unique(index.tree.query(boxes)[1])
+        tiles = np.unique(lay.tile[seg])
+        self._load_tiles(tiles.tolist())
+        #Segments of every tile (seg sorted by tile), gathered from the projected tiles
+        by_tile = np.argsort(lay.tile[seg], kind='stable')
+        bounds = np.searchsorted(lay.tile[seg][by_tile], tiles, side='right')[:-1]
+        xy = np.zeros((len(seg), 4))
+        for tile, sel in zip(tiles.tolist(), np.split(by_tile, bounds)):
+            xy[sel] = self._tiles[tile][lay.position[seg[sel]]]
+        return seg, gagesnap.FlowlineIndex(xy[:, 0], xy[:, 1], xy[:, 2], xy[:, 3], index.ids[seg], self.name)
+
+    def snap(self, x, y, tolerance=500.0):
+        """Snap every gage (x, y arrays in crs) to the closest segment within tolerance (see
+        gagesnap.FlowlineIndex.snap; segment is the index of the segment in the layer)."""
+        seg, candidates = self.candidates(x, y, tolerance)
+        out = candidates.snap(x, y, tolerance=tolerance)
+        matched = out['segment'] >= 0
+        out['segment'][matched] = seg[out['segment'][matched]]
+        return out
@@ -0,0 +1,147 @@
+#Creation date: October 2026
+
+#Objective: Find every river segment (e.g. Wild and Scenic River segments) within a radius of gages, for all gages at
+#           once (replaces the CopyFeatures + Near_analysis of 10wsrgages.py, which only gave the nearest segment)
+#           - An STR tree is built once over the line segments of the layer (see gagesnap.FlowlineIndex) and saved to
+#             disk with the ID, name and length of every feature, so that later runs only have to load it
+#           - For every gage, the closest point of every feature within the radius is found, with its distance, its
+#             position along the feature and the relation of the gage to the feature: 'upstream' if the closest point
+#             is the first vertex of the feature, 'downstream' if it is the last vertex, 'along' otherwise. Upstream
+#             and downstream assume that lines are digitized in the direction of flow (as NHD flowlines).
+#           - Visual checks of gage-segment pairs (e.g. ConfirmWSR, Y or N) are carried over from previous runs by
+#             (site number, feature ID), so that only pairs that were never checked have to be reviewed
+#           Coordinates must be in a projected coordinate system (e.g. NAD 1983 Contiguous USA Albers) so that the
+#           radius and distances are in meters. Distances are planar: within 500 m, they differ from the GEODESIC
+#           distances of Near_analysis by the scale error of the projection (less than about 1% over the conterminous
+#           US in Albers).
+
+import json
+import os
+
+import numpy as np
+
+import flatgeom
+import hashjoin
+from flatgeom import _local_index
+from gagesnap import FlowlineIndex
+from strtree import STRtree
+
+
+class ReachIndex(FlowlineIndex):
+    """Segments of a polyline layer with, for every feature, its ID, name and length (ids of the segments are the
+    index of their feature)."""
+
+    def __init__(self, x0, y0, x1, y1, ids, feature_ids, names, name, tree=None):
+        FlowlineIndex.__init__(self, x0, y0, x1, y1, ids, name, tree=tree)
+        self.feature_ids = np.asarray(feature_ids)
+        self.names = np.asarray(names)
+        #Position of the start of every segment along its feature, and length of every feature
+        seglen = np.hypot(self.x1 - self.x0, self.y1 - self.y0)
+        self.lengths = np.bincount(self.ids, weights=seglen, minlength=len(self.feature_ids))
+        self.measure = np.cumsum(seglen) - seglen - np.concatenate([[0], np.cumsum(self.lengths)[:-1]])[self.ids]
+
+    @classmethod
+    def from_geometry(cls, geoms, feature_ids, names, name):
+        """Index of the segments of a FlatGeometry of polylines, with feature_ids[i] and names[i] the ID and name of
+        feature i."""
+        x0, y0, x1, y1, geom = geoms.edges()
+        return cls(x0, y0, x1, y1, geom, feature_ids, names, name)
+
+    def save(self, path, version=None):
+        self.tree.save(path, x0=self.x0, y0=self.y0, x1=self.x1, y1=self.y1, ids=self.ids,
+                       feature_ids=self.feature_ids, names=self.names, name=np.array(self.name),
+                       version=np.array(json.dumps(version)))
+
+    @classmethod
+    def load(cls, path):
+        tree, extra = STRtree.load(path)
+        index = cls(extra['x0'], extra['y0'], extra['x1'], extra['y1'], extra['ids'], extra['feature_ids'],
+                    extra['names'], str(extra['name']), tree=tree)
+        index.version = json.loads(str(extra['version']))
+        return index
+
+    def near(self, x, y, radius=500.0):
+        """Every feature within radius of every point (x, y arrays). Points without a location (NaN x or y, e.g.
+        null shapes, see flatgeom.FlatGeometry) have no feature.
+
+        Returns a dict of arrays, one record per (point, feature) pair sorted by point then distance: point (index),
+        feature (index in the layer, i.e. the FID of a shapefile), feature_id, name, distance, near_x, near_y
+        (closest point of the feature), measure (position of the closest point along the feature), relation and rank
+        (1 for the closest feature of the point).
+        """
+        x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+        gi, seg, dist, px, py, t = self.candidates(x, y, radius)
+        feat = self.ids[seg]
+        #Closest segment of every (point, feature) pair
+        order = np.lexsort((seg, dist, feat, gi))
+        if len(order):
+            order = order[np.concatenate([[True], (gi[order][1:] != gi[order][:-1]) |
+                                          (feat[order][1:] != feat[order][:-1])])]
+        gi, seg, dist, px, py, t, feat = gi[order], seg[order], dist[order], px[order], py[order], t[order], feat[order]
+        #Features of every point by distance
+        order = np.lexsort((feat, dist, gi))
+        gi, seg, dist, px, py, t, feat = gi[order], seg[order], dist[order], px[order], py[order], t[order], feat[order]
+        measure = self.measure[seg] + t * np.hypot(self.x1[seg] - self.x0[seg], self.y1[seg] - self.y0[seg])
+        length = self.lengths[feat]
+        relation = np.where(measure <= 0, 'upstream', np.where(measure >= length * (1 - 1e-12), 'downstream', 'along'))
+        rank = _local_index(np.bincount(gi, minlength=len(x))) + 1
+        return {'point': gi, 'feature': feat, 'feature_id': self.feature_ids[feat], 'name': self.names[feat],
+                'distance': dist, 'near_x': px, 'near_y': py, 'measure': measure, 'relation': relation,
+                'rank': rank.astype(np.int32)}
+
+
+def load_or_build(layer, id_field, name_field, path, spatial_reference=None):
+    """ReachIndex of layer (projected to spatial_reference if given), loaded from path if it was built from the
+    current version of layer, otherwise built from the layer and saved to path."""
+    version = flatgeom.layer_version(layer)
+    if os.path.exists(path):
+        index = ReachIndex.load(path)
+        if index.version == json.loads(json.dumps(version)):
+            return index
+    geoms, table = flatgeom.read_features(layer, fields=[id_field, name_field], spatial_reference=spatial_reference)
+    index = ReachIndex.from_geometry(geoms, table[id_field], table[name_field], os.path.basename(layer))
+    index.save(path, version=version)
+    return index
+
+
+########################################################################################################################
+# REVIEW DECISIONS
+def _pair_keys(table, keys, widths):
+    #Keys of several fields joined into one string per record
+    out = hashjoin.normalize_keys(table[keys[0]], widths[0])
+    for k, w in zip(keys[1:], widths[1:]):
+        out = np.char.add(np.char.add(out, '|'), hashjoin.normalize_keys(table[k], w))
+    return out
+
+
+def reuse_decisions(table, keys, previous, previous_keys=None, field='ConfirmWSR'):
+    """Decision (field) of the first record of previous tables with the same keys as every record of table.
+
+    previous is a list of tables (paths or dicts of arrays; paths that do not exist are skipped), checked in order: the
+    first table with a (non-blank) decision for a pair is used. previous_keys are the key fields of
+    the previous tables if they differ from keys (e.g. ('site_no', 'NEAR_FID') for the output of Near_analysis).
+    Keys named as in hashjoin.KEY_WIDTHS (e.g. site_no) are zero-padded before matching.
+    Returns the decisions ('' if a pair was never checked).
+    """
+    widths = [k if k in hashjoin.KEY_WIDTHS else None for k in keys]
+    left = _pair_keys(table, keys, widths)
+    out = np.full(len(left), '', dtype='U16')
+    for prev in previous:
+        if not isinstance(prev, dict) and not os.path.exists(prev):
+            continue
+        prev = hashjoin.read_table(prev)
+        decision = np.char.upper(hashjoin.normalize_keys(prev[field]))
+        checked = decision != ''
+        pos = hashjoin.match(left, _pair_keys(prev, previous_keys or keys, widths)[checked])
+        new = (pos >= 0) & (out == '')
+        out[new] = decision[checked][pos[new]]
+    return out
+
+
+def first_confirmed(table, key='site_no', field='ConfirmWSR', value='Y'):
+    """Records of table (sorted by key, then by distance as the output of ReachIndex.near) whose decision (field) is
+    value, only the first (closest) one of every key."""
+    confirmed = dict((k, np.asarray(v)[np.asarray(table[field]) == value]) for k, v in table.items())
+    keys = confirmed[key]
+    first = np.concatenate([[True], keys[1:] != keys[:-1]]) if len(keys) else np.zeros(0, dtype=bool)
+    return dict((k, v[first]) for k, v in confirmed.items())
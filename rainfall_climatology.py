@@ -0,0 +1,234 @@
+#Creation date: October 2026
+
+#Objective: Compute average annual rainfall in each pixel from the yearly daily precipitation NetCDF files
+#           (nldas_met_update.obs.daily.pr.YYYY.nc, 1949-2010) used in 6Gages_flood_scarcity_fishdiv.py
+#           - Each yearly file is read a chunk of days at a time and summed into a float64 annual total
+#           - Annual totals are added to a running sum and count per pixel, so that memory stays at the size of a
+#             single grid no matter how many years are processed (previously, stacking every year with numpy.dstack
+#             ran out of memory and the years had to be split in two batches)
+#           - The running sum can be checkpointed to disk after every year and resumed after a crash
+#           - In parallel mode, each yearly file is summed by a worker process (see workerpool.py) and the annual totals
+#             are combined with a pairwise tree sum in file order, so that results are identical from one run to the next
+#           - Annual totals can be kept in a GridCache (see grid_cache.py) so that adding a new year to the climatology
+#             only requires reading the new file
+
+import glob
+import os
+
+import netCDF4 as nc
+import numpy as np
+
+import instrument
+import workerpool
+
+NLDAS_PATTERN = 'nldas_met_update.obs.daily.pr.*.nc'
+
+
+def list_years(nc_dir, pattern=NLDAS_PATTERN):
+    """Return the yearly NetCDF files in nc_dir sorted by name (i.e. by year). Raises ValueError if there are none."""
+    paths = sorted(glob.glob(os.path.join(nc_dir, pattern)))
+    if not paths:
+        raise ValueError('No {0} files in {1}'.format(pattern, os.path.abspath(nc_dir)))
+    return paths
+
+
+def annual_total(path, variable='pr', chunk_days=31):
+    """Sum a (day, lat, lon) NetCDF variable over days, reading chunk_days days at a time.
+
+    Returns a float64 grid with NaN in pixels that have no valid data on any day of the year.
+    """
+    with nc.Dataset(path) as f:
+        var = f.variables[variable]
+        var.set_auto_mask(True)
+        total = np.zeros(var.shape[1:], dtype=np.float64)
+        valid = np.zeros(var.shape[1:], dtype=bool)
+        for start in range(0, var.shape[0], chunk_days):
+            block = var[start:start + chunk_days]
+            mask = np.ma.getmaskarray(block)
+            total += np.ma.filled(block, 0).sum(axis=0, dtype=np.float64)
+            valid |= ~mask.all(axis=0)
+    total[~valid] = np.nan
+    return total
+
+
+class RunningMean(object):
+    """Per-pixel running sum and count of yearly grids, with the list of files already added."""
+
+    def __init__(self, shape):
+        self.sum = np.zeros(shape, dtype=np.float64)
+        self.count = np.zeros(shape, dtype=np.int32)
+        self.done = []
+
+    def add(self, grid, key=None):
+        valid = ~np.isnan(grid)
+        self.sum[valid] += grid[valid]
+        self.count += valid
+        if key is not None:
+            self.done.append(key)
+
+    def merge(self, total, count, keys=()):
+        """Add a partial sum and count of several grids (e.g. from tree_sum)."""
+        self.sum += total
+        self.count += count
+        self.done.extend(keys)
+
+    def mean(self):
+        """Mean over the grids added so far, NaN where no grid had data."""
+        out = np.full(self.sum.shape, np.nan)
+        np.divide(self.sum, self.count, out=out, where=self.count > 0)
+        return out
+
+    def save(self, path):
+        #Write to a temporary file first so that a crash during the write does not corrupt the previous checkpoint
+        tmp = path + '.tmp.npz'
+        np.savez(tmp, sum=self.sum, count=self.count, done=np.array(self.done, dtype=str))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as dat:
+            acc = cls(dat['sum'].shape)
+            acc.sum[...] = dat['sum']
+            acc.count[...] = dat['count']
+            acc.done = [str(k) for k in dat['done']]
+        return acc
+
+
+def _sum_count(grid):
+    valid = ~np.isnan(grid)
+    return np.where(valid, grid, 0.0), valid.astype(np.int32)
+
+
+def _year_stage(path):
+    #Name of the stage of a year (e.g. rainfall_year_1987 for nldas_met_update.obs.daily.pr.1987.nc)
+    key = os.path.basename(path)
+    return 'rainfall_year_' + (key.split('.')[-2] if key.count('.') > 1 else key)
+
+
+def _annual_total_task(args):
+    #Annual total of a year and the record of its stage, which is added to the report of the parent process
+    path, variable, chunk_days = args
+    recorder = instrument.Recorder(verbose=False)
+    with recorder.stage(_year_stage(path)) as step:
+        total = annual_total(path, variable=variable, chunk_days=chunk_days)
+    return total, step.as_dict()
+
+
+def cached_annual_total(path, cache, variable='pr', chunk_days=31):
+    """annual_total of path, read from cache (a GridCache) if it was already computed."""
+    return cache.get_or_compute(path, variable, lambda p: annual_total(p, variable=variable, chunk_days=chunk_days))
+
+
+def tree_sum(items):
+    """Pairwise (tree) sum of an ordered iterable of (sum, count) grids.
+
+    Items are combined as they arrive, so only about log2(n) grids are held in memory at once. For a given number of
+    items the shape of the tree is fixed, so the result does not depend on how the items were computed.
+    """
+    stack = []
+    for item in items:
+        level = 0
+        while stack and stack[-1][0] == level:
+            prev = stack.pop()[1]
+            item = (prev[0] + item[0], prev[1] + item[1])
+            level += 1
+        stack.append((level, item))
+    if not stack:
+        return None
+    total = stack.pop()[1]
+    while stack:
+        prev = stack.pop()[1]
+        total = (prev[0] + total[0], prev[1] + total[1])
+    return total
+
+
+def annual_totals_parallel(paths, variable='pr', chunk_days=31, workers=None, cache=None):
+    """Sum of annual totals and count of valid years in each pixel, computing each year in a worker process.
+
+    workers defaults to the number of cores. Totals are returned by the pool in file order and combined with tree_sum.
+    If cache (a GridCache) is given, only the years that are not in the cache are sent to the pool (no pool is started
+    if they all are).
+    Every year is recorded as a stage (see instrument.py): workers return the record of the years they computed.
+    """
+    hits = {}
+    if cache is not None:
+        for path in paths:
+            key = cache.key(path, variable)
+            if key in cache.entries:
+                with instrument.stage(_year_stage(path)):
+                    grid = cache.get(key)
+                if grid is not None:
+                    hits[path] = grid
+    tasks = [(path, variable, chunk_days) for path in paths if path not in hits]
+    pool = workerpool.pool(workers) if tasks else None
+    try:
+        computed = pool.imap(_annual_total_task, tasks) if pool is not None else iter(())
+
+        def ordered():
+            for path in paths:
+                if path in hits:
+                    grid = hits[path]
+                else:
+                    grid, record = next(computed)
+                    instrument.RUN.add(record)
+                    if cache is not None:
+                        cache.put(cache.key(path, variable), grid)
+                yield _sum_count(grid)
+
+        total = tree_sum(ordered())
+    except Exception:
+        if pool is not None:
+            pool.terminate()
+        raise
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    if cache is not None:
+        cache.save()
+    return total
+
+
+def rainfall_climatology(paths, variable='pr', chunk_days=31, checkpoint=None, workers=1, cache=None):
+    """Average annual total of variable over every file in paths, in a single pass.
+
+    If checkpoint is given (path to a .npz file), the running sum is saved after every year and files that were
+    already added in a previous run are skipped.
+    If workers is greater than 1 (or None, for one worker per core), years are summed in parallel (see
+    annual_totals_parallel) and the checkpoint is only written once all remaining years are done.
+    If cache (a GridCache) is given, annual totals are read from and added to the cache.
+    Returns a RunningMean (use .mean() for the average annual grid). Raises ValueError if paths is empty.
+    """
+    if not len(paths):
+        raise ValueError('No NetCDF files to average (see list_years)')
+    acc = None
+    if checkpoint is not None and os.path.exists(checkpoint):
+        acc = RunningMean.load(checkpoint)
+    if workers != 1:
+        todo = [path for path in paths if acc is None or os.path.basename(path) not in acc.done]
+        if not todo:
+            return acc
+        total, count = annual_totals_parallel(todo, variable=variable, chunk_days=chunk_days, workers=workers,
+                                              cache=cache)
+        if acc is None:
+            acc = RunningMean(total.shape)
+        acc.merge(total, count, [os.path.basename(path) for path in todo])
+        if checkpoint is not None:
+            acc.save(checkpoint)
+        return acc
+    for path in paths:
+        key = os.path.basename(path)
+        if acc is not None and key in acc.done:
+            continue
+        #One stage per year
+        with instrument.stage(_year_stage(path)):
+            if cache is not None:
+                total = cached_annual_total(path, cache, variable=variable, chunk_days=chunk_days)
+            else:
+                total = annual_total(path, variable=variable, chunk_days=chunk_days)
+        if acc is None:
+            acc = RunningMean(total.shape)
+        acc.add(total, key)
+        if checkpoint is not None:
+            acc.save(checkpoint)
+    return acc
@@ -0,0 +1,178 @@
+#Creation date: October 2026
+
+#Objective: Tiled raster algebra on aligned national rasters (30 m land cover, census block labels, flood zones...)
+#           that tallies the result directly by zone instead of writing intermediate rasters, e.g. the number of urban
+#           pixels in every census block for Con("lcd2011_reclass" == 1, "censusblock_ras", 0)
+#           - Rasters are read one window of rows at a time: memory-mapped for label rasters (see label_cache.py),
+#             .npy files and flat binary files, or with arcpy.RasterToNumPyArray for any raster arcpy can read
+#           - An expression (any function of the windows of the rasters, e.g. reclassification + comparison) gives a
+#             boolean mask of the cells to count, and the cells of the mask are counted by label with np.bincount
+#           - Windows are processed in parallel by a pool of worker processes (see workerpool.py), and the number of rows
+#             of a window is set so that all workers together stay within a memory budget. Expressions are sent to the
+#             workers, so they are defined in this module (see EXPRESSIONS) rather than in the scripts
+
+import multiprocessing
+
+import numpy as np
+
+import workerpool
+from zonal_stats import row_blocks
+
+
+########################################################################################################################
+# RASTER SOURCES
+#Sources are picklable objects whose slice source[row0:row1] returns rows row0:row1 of a raster on the grid of the analysis, so that they can be
+#sent to worker processes (label_cache.LabelRaster can also be used directly)
+class MemmapRaster(object):
+    """Raster stored as a .npy file or a flat binary file (band sequential, row-major, e.g. ENVI or BIL with one band)
+    read through a memory map."""
+
+    def __init__(self, path, dtype=None, shape=None, offset=0):
+        self.path = path
+        self.dtype = dtype
+        self.shape = shape
+        self.offset = offset
+        self._data = None
+
+    def _open(self):
+        if self._data is None:
+            if self.path.lower().endswith('.npy'):
+                self._data = np.load(self.path, mmap_mode='r')
+            else:
+                self._data = np.memmap(self.path, dtype=self.dtype, mode='r', offset=self.offset, shape=self.shape)
+        return self._data
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_data'] = None
+        return state
+
+    def __getitem__(self, key):
+        return self._open()[key]
+
+
+class ArcpyRaster(object):
+    """Raster read one window at a time with arcpy.RasterToNumPyArray; grid is the grid of the raster (see
+    zonal_stats.Grid.from_arcpy)."""
+
+    def __init__(self, raster, grid, nodata=None):
+        self.raster = raster
+        self.grid = grid
+        self.nodata = nodata
+
+    def __getitem__(self, key):
+        import arcpy
+        row0, row1, step = key.indices(self.grid.nrows)
+        corner = arcpy.Point(self.grid.xmin, self.grid.ymax - row1 * self.grid.cellsize)
+        if self.nodata is None:
+            return arcpy.RasterToNumPyArray(self.raster, corner, self.grid.ncols, row1 - row0)
+        return arcpy.RasterToNumPyArray(self.raster, corner, self.grid.ncols, row1 - row0, self.nodata)
+
+
+def remap_range(ranges, values, missing=None):
+    """Equivalent of arcpy.sa.Reclassify with a RemapRange: values in [start, end] (inclusive) of every
+    [start, end, new] of ranges get new, other values keep their value (missing_values='DATA') or get missing."""
+    values = np.asarray(values)
+    if values.dtype.kind in 'iu' and values.dtype.itemsize <= 2:
+        #Small integer rasters (e.g. NLCD, 8 bit) are reclassified with a lookup table
+        info = np.iinfo(values.dtype)
+        if missing is None:
+            lut = np.arange(info.min, info.max + 1, dtype=np.int64)
+        else:
+            lut = np.full(info.max - info.min + 1, missing, dtype=np.int64)
+        for start, end, new in ranges:
+            lut[max(int(start), info.min) - info.min:min(int(end), info.max) - info.min + 1] = new
+        return lut[values.astype(np.int64) - info.min]
+    out = values.copy() if missing is None else np.full(values.shape, missing)
+    for start, end, new in ranges:
+        out[(values >= start) & (values <= end)] = new
+    return out
+
+
+########################################################################################################################
+# EXPRESSIONS
+#Expressions of the flood analysis of 6Gages_flood_scarcity_fishdiv.py, on windows of NLCD 2011 land cover (lcd) and of
+#the FEMA 100-yr flood zones (flood)
+def lcd2011_reclass(lcd):
+    """Urbanized land cover (NLCD 21-24) as 1, all other classes as 0."""
+    return remap_range([[21, 24, 1], [0, 20, 0], [25, 100, 0]], lcd)
+
+
+def urban(lcd):
+    """Urbanized cells: Con("lcd2011_reclass" == 1, ...)."""
+    return lcd2011_reclass(lcd) == 1
+
+
+def flooded_urban(lcd, flood):
+    """Urbanized cells in a flood zone: Con(("censusflood_inters_ras" > 1) & ("lcd2011_reclass" == 1), ...)."""
+    return (flood > 0) & (lcd2011_reclass(lcd) == 1)
+
+
+########################################################################################################################
+# TILED EVALUATION
+def tile_rows_for(grid, itemsizes, memory_budget, workers=1, copies=3):
+    """Number of rows of a window such that workers windows of every source (itemsizes, in bytes) and copies
+    temporary arrays of 8 bytes per cell fit in memory_budget bytes."""
+    per_row = grid.ncols * (sum(itemsizes) + 8 * copies)
+    return int(max(1, min(grid.nrows, memory_budget // max(1, per_row * workers))))
+
+
+_worker = {}
+
+
+def _init_worker(labels, sources, expr):
+    _worker['labels'] = labels
+    _worker['sources'] = sources
+    _worker['expr'] = expr
+
+
+def _count_window(window):
+    row0, row1 = window
+    labels = np.asarray(_worker['labels'][row0:row1])
+    blocks = dict((name, np.asarray(src[row0:row1])) for name, src in _worker['sources'].items())
+    mask = np.asarray(_worker['expr'](**blocks), dtype=bool) & (labels > 0)
+    lab = labels[mask].astype(np.int64)
+    if not len(lab):
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    lab, count = np.unique(lab, return_counts=True)
+    return lab, count
+
+
+def count_by_label(labels, sources, expr, tile_rows=None, memory_budget=2 * 1024 ** 3, workers=None):
+    """Number of cells of every zone of labels (a label_cache.LabelRaster) where expr(**windows of sources) is True.
+
+    sources is a dict of name: source (see above) on the grid of labels; expr must be a module-level function of an
+    importable module (e.g. urban, so that it can be sent to worker processes) taking the windows of the sources as
+    keyword arguments. This is the
+    attribute table (Value, Count) of Con(expr, labels, 0), without the raster.
+    workers defaults to the number of cores (workers=1 runs in this process). tile_rows defaults to the largest
+    window that fits in memory_budget (bytes) for all workers.
+    Returns a dict with Value (zone key) and Count for every zone with at least one cell.
+    """
+    grid = labels.grid
+    workers = workers or multiprocessing.cpu_count()
+    if tile_rows is None:
+        itemsizes = [np.dtype(labels.dtype).itemsize] + [8 for s in sources]
+        tile_rows = tile_rows_for(grid, itemsizes, memory_budget, workers)
+    windows = row_blocks(grid.nrows, tile_rows)
+    total = np.zeros(len(labels.zone_keys) + 1, dtype=np.int64)
+    if workers == 1:
+        _init_worker(labels, sources, expr)
+        results = map(_count_window, windows)
+        pool = None
+    else:
+        pool = workerpool.pool(workers, initializer=_init_worker, initargs=(labels, sources, expr))
+        results = pool.imap_unordered(_count_window, windows)
+    try:
+        for lab, count in results:
+            total[lab] += count
+    except Exception:
+        if pool is not None:
+            pool.terminate()
+        raise
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    has = np.flatnonzero(total[1:] > 0)
+    return {'Value': np.asarray(labels.zone_keys)[has], 'Count': total[has + 1]}
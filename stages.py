@@ -0,0 +1,393 @@
+#Creation date: October 2026
+
+#Objective: Run the analysis as a graph of stages that are only rerun when their inputs change, instead of running
+#           every script from top to bottom with overwriteOutput = True
+#           - Every stage declares its inputs and outputs (paths of files, shapefiles, folders, datasets in a file
+#             geodatabase, or patterns of files for inputs, e.g. one file per year); a stage depends on the stages that
+#             write its inputs
+#           - Every stage has a key: a hash of its code (the function, or the text of the script sections that it runs),
+#             its parameters and the content of its inputs. Stages whose key did not change since their last
+#             successful run and whose outputs are still there are skipped; the keys and the hashes of the outputs are
+#             kept in a state file
+#           - Stages whose dependencies are all done run in parallel (one process per stage), so independent branches
+#             (e.g. scarcity, fish diversity and flood) run at the same time
+#           - Scripts are run by section (see ScriptSection): the lines before the first section (imports, paths...) and
+#             the lines of the selected sections are run in a new Python process, so the scripts can still be run on
+#             their own
+#           Content hashes of files are cached by size and modification time, so files are only read again when they
+#           were modified. Datasets in a file geodatabase can not be hashed from their files (all datasets of a
+#           geodatabase share its files): outputs of a stage are identified by the key of the stage that wrote them,
+#           and other datasets by the content of their rows (with arcpy) if a stage writes to their geodatabase,
+#           otherwise by the files of their geodatabase (e.g. NHDPlus, which is only read).
+#           The steps recorded with instrument.py in every stage that runs are saved to reports/<stage> (next to the
+#           state file) and combined at the end of the run into reports/run_<date>.json, .csv and .folded.
+
+import glob
+import hashlib
+import inspect
+import json
+import multiprocessing
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import flatgeom
+import instrument
+
+#Section banner: a line of #, then '#A. TITLE' or '# B. TITLE' (letters or digits followed by a dot)
+_SECTION = re.compile(r'^#{10,}\s*\n#\s*([A-Z0-9]+)\.\s.*$', re.MULTILINE)
+
+
+def split_sections(text):
+    """Preamble (lines before the first section) and dict of section name: text of a script."""
+    matches = list(_SECTION.finditer(text))
+    if not matches:
+        return text, {}
+    sections = {}
+    for m, nxt in zip(matches, matches[1:] + [None]):
+        sections[m.group(1)] = text[m.start():nxt.start() if nxt else len(text)]
+    return text[:matches[0].start()], sections
+
+
+class ScriptSection(object):
+    """Stage that runs sections of a script (e.g. ['A', 'B'], all of it if None) with the preamble of the script, in a
+    new process of python (default: this interpreter, e.g. set it to the Python of ArcGIS Pro). Parameters of the
+    stage are passed as environment variables STAGE_<NAME> (values as JSON)."""
+
+    def __init__(self, script, sections=None, python=None):
+        self.script = os.path.abspath(script)
+        self.sections = sections
+        self.python = python or sys.executable
+
+    def source(self):
+        with open(self.script) as f:
+            text = f.read()
+        if self.sections is None:
+            return text
+        preamble, sections = split_sections(text)
+        missing = [s for s in self.sections if s not in sections]
+        if missing:
+            raise ValueError('Sections {0} not found in {1}'.format(missing, self.script))
+        return preamble + ''.join(sections[s] for s in self.sections)
+
+    def __call__(self, **params):
+        #The script is written next to the original so that modules and relative paths resolve in the same way
+        fd, path = tempfile.mkstemp(suffix='.py', prefix='_stage_', dir=os.path.dirname(self.script))
+        env = dict(os.environ)
+        env.update(('STAGE_' + k.upper(), json.dumps(v)) for k, v in params.items())
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(self.source())
+            subprocess.check_call([self.python, path], cwd=os.path.dirname(self.script), env=env)
+        finally:
+            os.remove(path)
+
+    def __repr__(self):
+        return 'ScriptSection({0!r}, {1!r})'.format(os.path.basename(self.script), self.sections)
+
+
+class Stage(object):
+    """A step of the analysis: run(**params) reads inputs and writes outputs; after lists stages that must run first
+    even though they do not write any input of this stage."""
+
+    def __init__(self, name, run, inputs=(), outputs=(), params=None, after=()):
+        self.name = name
+        self.run = run
+        self.inputs = [os.path.normpath(p) for p in inputs]
+        self.outputs = [os.path.normpath(p) for p in outputs]
+        self.params = params or {}
+        self.after = list(after)
+
+    def code(self):
+        """Text of the code of the stage."""
+        if hasattr(self.run, 'source'):
+            return self.run.source()
+        try:
+            return inspect.getsource(self.run)
+        except (TypeError, IOError, OSError):
+            return repr(self.run)
+
+
+def _gdb(path):
+    #File geodatabase that contains path ('' if none)
+    parts = path.replace('\\', '/').split('/')
+    for i, part in enumerate(parts):
+        if part.lower().endswith('.gdb'):
+            return '/'.join(parts[:i + 1])
+    return ''
+
+
+def _in_gdb(path):
+    gdb = _gdb(path)
+    return bool(gdb) and os.path.normpath(gdb) != os.path.normpath(path)
+
+
+def _exists(path):
+    if os.path.exists(path):
+        return True
+    if _in_gdb(path):
+        try:
+            import arcpy
+        except ImportError:
+            return os.path.isdir(_gdb(path))
+        return arcpy.Exists(path)
+    return False
+
+
+def _digest_rows(dataset):
+    #Hash of the rows (attributes and geometry) of a dataset in a geodatabase
+    import arcpy
+    desc = arcpy.Describe(dataset)
+    fields = [f.name for f in arcpy.ListFields(dataset) if f.type not in ('OID', 'Geometry', 'Blob', 'Raster')]
+    if getattr(desc, 'shapeFieldName', None):
+        fields.append('SHAPE@WKB')
+    h = hashlib.sha1()
+    with arcpy.da.SearchCursor(dataset, fields) as cursor:
+        for row in cursor:
+            h.update(repr(row).encode('utf-8'))
+    return h.hexdigest()
+
+
+def _run_stage(name, run, params, report=None):
+    #Runs in a worker process. Steps recorded with instrument in the worker are saved to report; script sections
+    #inherit INSTRUMENT_REPORT and save their own when their process exits
+    if report is not None:
+        os.environ['INSTRUMENT_REPORT'] = report
+        instrument.RUN.reset()
+        if os.path.exists(report + '.json'):
+            os.remove(report + '.json')
+    start = time.time()
+    try:
+        run(**params)
+    except Exception as e:
+        return name, False, '{0}: {1}'.format(type(e).__name__, e), start, time.time() - start
+    finally:
+        if report is not None and instrument.RUN.records:
+            instrument.RUN.report(report)
+    return name, True, '', start, time.time() - start
+
+
+class Pipeline(object):
+    """Graph of stages with a state file of the keys of the last successful run of every stage, and a folder of
+    reports of the time and memory of the stages (report_dir, default: reports next to the state file)."""
+
+    def __init__(self, state_path, report_dir=None):
+        self.state_path = state_path
+        self.report_dir = report_dir or os.path.join(os.path.dirname(os.path.abspath(state_path)), 'reports')
+        self.stages = {}
+        self._rows = {}
+        self.state = {'files': {}, 'stages': {}}
+        if os.path.exists(state_path):
+            with open(state_path) as f:
+                self.state = json.load(f)
+
+    def add(self, name, run, inputs=(), outputs=(), params=None, after=()):
+        """Add a stage (see Stage) and return it."""
+        if name in self.stages:
+            raise ValueError('Stage {0!r} already exists'.format(name))
+        stage = Stage(name, run, inputs=inputs, outputs=outputs, params=params, after=after)
+        for other in self.stages.values():
+            shared = set(stage.outputs) & set(other.outputs)
+            if shared:
+                raise ValueError('{0} written by both {1!r} and {2!r}'.format(sorted(shared), other.name, name))
+        self.stages[name] = stage
+        return stage
+
+    def producers(self):
+        """Stage that writes every output."""
+        return dict((out, s.name) for s in self.stages.values() for out in s.outputs)
+
+    def dependencies(self, name):
+        stage = self.stages[name]
+        producers = self.producers()
+        deps = set(producers[p] for p in stage.inputs if p in producers) | set(stage.after)
+        deps.discard(name)
+        return sorted(deps)
+
+    def order(self, targets=None):
+        """Stages needed for targets (default all) and their dependencies, dependencies first."""
+        out, visiting = [], set()
+
+        def visit(name):
+            if name in out:
+                return
+            if name in visiting:
+                raise ValueError('Cycle in the stage graph at {0!r}'.format(name))
+            if name not in self.stages:
+                raise KeyError('Unknown stage {0!r}'.format(name))
+            visiting.add(name)
+            for dep in self.dependencies(name):
+                visit(dep)
+            visiting.discard(name)
+            out.append(name)
+        for name in (targets or sorted(self.stages)):
+            visit(name)
+        return out
+
+    ####################################################################################################################
+    # FINGERPRINTS
+    def _file_hash(self, path):
+        #Content hash of a file, cached by size and modification time
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        cached = self.state['files'].get(path)
+        if cached and cached[0] == st.st_size and cached[1] == st.st_mtime:
+            return cached[2]
+        h = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(2 ** 22), b''):
+                h.update(chunk)
+        self.state['files'][path] = [st.st_size, st.st_mtime, h.hexdigest()]
+        return h.hexdigest()
+
+    def _files_hash(self, files, root):
+        h = hashlib.sha1()
+        for f in sorted(files):
+            h.update('{0}:{1}\n'.format(os.path.relpath(f, root), self._file_hash(f)).encode('utf-8'))
+        return h.hexdigest()
+
+    def fingerprint(self, path):
+        """Hash of the content of path (None if it does not exist)."""
+        producers = self.producers()
+        if _in_gdb(path):
+            if path in producers:
+                return self.state['stages'].get(producers[path], {}).get('key')
+            if not _exists(path):
+                return None
+            written = set(_gdb(p) for p in producers if _in_gdb(p))
+            if _gdb(path) in written:
+                if path not in self._rows:
+                    self._rows[path] = _digest_rows(path)
+                return self._rows[path]
+            files = flatgeom.layer_files(path)
+            return self._files_hash(files, _gdb(path))
+        if glob.has_magic(path):
+            files = glob.glob(path)
+            return self._files_hash(files, os.path.dirname(path)) if files else None
+        if os.path.isdir(path):
+            files = [os.path.join(d, f) for d, dirs, names in os.walk(path) for f in names]
+            return self._files_hash(files, path)
+        if os.path.exists(path):
+            base = os.path.splitext(path)[0]
+            if path.lower().endswith('.shp'):
+                files = [base + ext for ext in ('.shp', '.shx', '.dbf', '.prj') if os.path.exists(base + ext)]
+                return self._files_hash(files, os.path.dirname(path))
+            return self._file_hash(path)
+        return None
+
+    def key(self, name):
+        """Key of a stage for the current content of its inputs (None if an input is missing)."""
+        stage = self.stages[name]
+        inputs = [(p, self.fingerprint(p)) for p in sorted(stage.inputs)]
+        if any(h is None for p, h in inputs):
+            return None
+        text = json.dumps([name, stage.code(), sorted(stage.params.items()), inputs], sort_keys=True, default=repr)
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def up_to_date(self, name, key):
+        """True if the stage last ran with key and its outputs were not deleted or modified since then."""
+        last = self.state['stages'].get(name)
+        if not last or last.get('key') != key:
+            return False
+        for path in self.stages[name].outputs:
+            if not _exists(path):
+                return False
+            if not _in_gdb(path) and self.fingerprint(path) != last['outputs'].get(path):
+                return False
+        return True
+
+    def _save(self):
+        tmp = self.state_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.state, f, indent=1, sort_keys=True)
+        if os.path.exists(self.state_path):
+            os.remove(self.state_path)
+        os.rename(tmp, self.state_path)
+
+    ####################################################################################################################
+    # EXECUTION
+    def run(self, targets=None, force=(), workers=None, dry_run=False):
+        """Run the stages needed for targets (default all) whose inputs changed, in parallel where possible.
+
+        force lists stages to rerun even if they are up to date (their dependents then rerun if their outputs change).
+        workers is the maximum number of stages run at the same time (default: number of cores).
+        With dry_run, stages are not run, and the stages that would run are returned (stages downstream of a stage
+        that would run are listed as they may need to run).
+        Returns the names of the stages that were run.
+        """
+        todo = self.order(targets)
+        self._rows = {}
+        deps = dict((name, [d for d in self.dependencies(name) if d in todo]) for name in todo)
+        done, failed, ran, running = set(), {}, [], {}
+        timings = []
+        results = queue.Queue()
+        pool = None if dry_run else multiprocessing.Pool(processes=workers or multiprocessing.cpu_count())
+        try:
+            while todo or running:
+                blocked = [n for n in todo if any(d in failed for d in deps[n])]
+                for name in blocked:
+                    todo.remove(name)
+                    failed[name] = 'not run, a dependency failed'
+                ready = [n for n in todo if all(d in done for d in deps[n])]
+                for name in ready:
+                    todo.remove(name)
+                    stage = self.stages[name]
+                    key = None if (dry_run and any(d in ran for d in deps[name])) else self.key(name)
+                    if key is not None and name not in force and self.up_to_date(name, key):
+                        print('[{0}] up to date'.format(name))
+                        done.add(name)
+                        continue
+                    if dry_run:
+                        print('[{0}] would run'.format(name))
+                        ran.append(name)
+                        done.add(name)
+                        continue
+                    if key is None:
+                        missing = [p for p in stage.inputs if self.fingerprint(p) is None]
+                        failed[name] = 'missing inputs {0}'.format(missing)
+                        print('[{0}] {1}'.format(name, failed[name]))
+                        continue
+                    print('[{0}] running'.format(name))
+                    running[name] = key
+                    pool.apply_async(_run_stage, (name, stage.run, stage.params, os.path.join(self.report_dir, name)),
+                                     callback=results.put)
+                if not running:
+                    continue
+                name, ok, error, start, elapsed = results.get()
+                key = running.pop(name)
+                timings.append({'stage': name, 'path': [], 'start': start, 'wall_s': elapsed, 'cpu_s': None,
+                                'rss_start_mb': None, 'peak_rss_mb': None, 'rows_in': None, 'rows_out': None,
+                                'bytes_read': None, 'rows_per_s': None, 'pid': os.getpid(), 'error': error or None})
+                if not ok:
+                    failed[name] = error
+                    print('[{0}] failed after {1:.1f} s: {2}'.format(name, elapsed, error))
+                    continue
+                outputs = dict((p, self.fingerprint(p) if not _in_gdb(p) else key) for p in self.stages[name].outputs)
+                self.state['stages'][name] = {'key': key, 'outputs': outputs, 'time': time.time(), 'elapsed': elapsed}
+                self._save()
+                print('[{0}] done in {1:.1f} s'.format(name, elapsed))
+                ran.append(name)
+                done.add(name)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+            if not dry_run:
+                self._save()
+            if timings:
+                #Run report: total time of every stage, with the steps recorded in the stage nested under it
+                instrument.merge_reports(dict((t['stage'], os.path.join(self.report_dir, t['stage'])) for t in timings),
+                                         os.path.join(self.report_dir, time.strftime('run_%Y%m%d_%H%M%S')),
+                                         records=timings)
+        if failed:
+            raise RuntimeError('Stages failed: ' +
+                               '; '.join('{0} ({1})'.format(k, v) for k, v in sorted(failed.items())))
+        return ran
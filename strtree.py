@@ -0,0 +1,121 @@
+#Creation date: October 2026
+
+#Objective: Packed R-tree spatial index built with the Sort-Tile-Recursive (STR) algorithm, in numpy only
+#           - The tree is built once from the bounding boxes of the items (flowline segments, polygons...) and can be
+#             saved to and loaded from a .npz file
+#           - Queries are run for a whole batch of boxes at once: the tree is walked one level at a time for every
+#             (query, node) pair that is still a candidate, so there is no Python loop over queries or items
+
+import numpy as np
+
+from flatgeom import _local_index
+
+
+def _str_order(bounds, capacity):
+    """Order of boxes such that consecutive groups of capacity boxes are spatially compact (STR packing)."""
+    n = len(bounds)
+    cx = (bounds[:, 0] + bounds[:, 2]) / 2
+    cy = (bounds[:, 1] + bounds[:, 3]) / 2
+    nnodes = -(-n // capacity)
+    nslices = int(np.ceil(np.sqrt(nnodes)))
+    per_slice = nslices * capacity
+    by_x = np.argsort(cx, kind='stable')
+    slice_id = np.empty(n, dtype=np.int64)
+    slice_id[by_x] = np.arange(n) // per_slice
+    return np.lexsort((cy, slice_id))
+
+
+def _intersects(b, q):
+    return (b[:, 0] <= q[:, 2]) & (b[:, 2] >= q[:, 0]) & (b[:, 1] <= q[:, 3]) & (b[:, 3] >= q[:, 1])
+
+
+class STRtree(object):
+    """Packed R-tree over the boxes (xmin, ymin, xmax, ymax) of n items; items are identified by their index."""
+
+    def __init__(self, bounds=None, capacity=16):
+        self.capacity = capacity
+        #levels[0] is the root level; each level has the bounds of its nodes and the range of their children in the
+        #level below (or in items for the last level)
+        self.levels = []
+        if bounds is None:
+            return
+        bounds = np.asarray(bounds, dtype=np.float64).reshape(-1, 4)
+        valid = ~np.isnan(bounds).any(axis=1)
+        ids = np.flatnonzero(valid)
+        order = _str_order(bounds[ids], capacity) if len(ids) else ids
+        self.item_ids = ids[order]
+        self.item_bounds = bounds[self.item_ids]
+        child_bounds = self.item_bounds
+        levels = []
+        while True:
+            n = len(child_bounds)
+            start = np.arange(0, n, capacity)
+            end = np.minimum(start + capacity, n)
+            if n:
+                node_bounds = np.column_stack([np.minimum.reduceat(child_bounds[:, 0], start),
+                                               np.minimum.reduceat(child_bounds[:, 1], start),
+                                               np.maximum.reduceat(child_bounds[:, 2], start),
+                                               np.maximum.reduceat(child_bounds[:, 3], start)])
+            else:
+                node_bounds = np.zeros((0, 4))
+            if len(start) <= 1:
+                levels.append((node_bounds, start, end))
+                break
+            #Pack the nodes of this level into the next level up
+            order = _str_order(node_bounds, capacity)
+            levels.append((node_bounds[order], start[order], end[order]))
+            child_bounds = node_bounds[order]
+        self.levels = levels[::-1]
+
+    def __len__(self):
+        return len(self.item_ids)
+
+    def query(self, boxes):
+        """Pairs (query index, item index) of every item whose box intersects one of the query boxes.
+
+        Pairs are sorted by query index.
+        """
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        if not len(self.item_ids) or not len(boxes):
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        qi = np.arange(len(boxes))
+        node = np.zeros(len(boxes), dtype=np.int64)
+        for level, (node_bounds, start, end) in enumerate(self.levels):
+            keep = _intersects(node_bounds[node], boxes[qi])
+            qi, node = qi[keep], node[keep]
+            nchild = end[node] - start[node]
+            qi = np.repeat(qi, nchild)
+            node = np.repeat(start[node], nchild) + _local_index(nchild)
+        keep = _intersects(self.item_bounds[node], boxes[qi])
+        qi, item = qi[keep], self.item_ids[node[keep]]
+        order = np.lexsort((item, qi))
+        return qi[order], item[order]
+
+    def query_points(self, x, y, distance=0.0):
+        """Pairs (point index, item index) of items whose box is within distance of the points (box test only)."""
+        x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+        return self.query(np.column_stack([x - distance, y - distance, x + distance, y + distance]))
+
+    def save(self, path, **extra):
+        """Save the tree (and any extra arrays, e.g. the data of the indexed items) to a .npz file."""
+        arrays = {'capacity': np.array(self.capacity), 'item_ids': self.item_ids, 'item_bounds': self.item_bounds,
+                  'nlevels': np.array(len(self.levels))}
+        for i, (b, s, e) in enumerate(self.levels):
+            arrays['level{0}_bounds'.format(i)] = b
+            arrays['level{0}_start'.format(i)] = s
+            arrays['level{0}_end'.format(i)] = e
+        arrays.update(extra)
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        """Tree saved with save(), and a dict of the extra arrays saved with it."""
+        with np.load(path) as dat:
+            tree = cls(capacity=int(dat['capacity']))
+            tree.item_ids = dat['item_ids']
+            tree.item_bounds = dat['item_bounds']
+            tree.levels = [(dat['level{0}_bounds'.format(i)], dat['level{0}_start'.format(i)],
+                            dat['level{0}_end'.format(i)]) for i in range(int(dat['nlevels']))]
+            extra = dict((k, dat[k]) for k in dat.files if k not in ('capacity', 'item_ids', 'item_bounds', 'nlevels')
+                         and not k.startswith('level'))
+        return tree, extra
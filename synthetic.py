@@ -0,0 +1,150 @@
+#Creation date: October 2026
+
+#Objective: Generate synthetic inputs of configurable size for the benchmarks (see benchmarks.py), so that the heavy
+#           stages can be timed without the real data (NHDPlus seamless geodatabase, census blocks, FEMA NFHL, NLDAS)
+#           - flowlines: random-walk polylines (network or non-network flowlines, Wild and Scenic River segments)
+#           - gages: points scattered around flowlines, some of them too far to be snapped, with NWIS-like site numbers
+#           - tiling: jittered grid of quadrilaterals that covers an extent without gaps or overlaps (counties, HUC6,
+#             census blocks)
+#           - huc8_table: HUC8 attribute table nested in HUC6s, as FishDiversityMetrics.csv
+#           - precip_years: yearly daily precipitation NetCDF files, as the NLDAS files (pr variable, day x lat x lon)
+#           - flood_mask: blocky binary raster covering a given fraction of a grid, as the FEMA zone A raster
+#           Every generator takes a seed, so that the same fixtures are generated from one run to the next.
+
+import os
+
+import numpy as np
+
+from flatgeom import FlatGeometry, POLYGON, POLYLINE
+
+#Extent of the conterminous US in NAD 1983 Contiguous USA Albers (meters) and in NAD83 (decimal degrees)
+CONUS_ALBERS = (-2400000.0, 250000.0, 2300000.0, 3200000.0)
+CONUS_NAD83 = (-125.0, 24.0, -66.5, 49.5)
+
+
+def flowlines(n, extent=CONUS_ALBERS, vertices=10, step=500.0, seed=0):
+    """n polylines of vertices vertices each, starting at random locations in extent and meandering with steps of
+    about step (units of extent). Returns a FlatGeometry of polylines."""
+    rng = np.random.RandomState(seed)
+    xmin, ymin, xmax, ymax = extent
+    start = np.column_stack([rng.uniform(xmin, xmax, n), rng.uniform(ymin, ymax, n)])
+    heading = rng.uniform(0, 2 * np.pi, (n, 1)) + np.cumsum(rng.normal(0, 0.4, (n, vertices - 1)), axis=1)
+    length = step * rng.uniform(0.5, 1.5, (n, vertices - 1))
+    xy = np.zeros((n, vertices, 2))
+    xy[:, 0] = start
+    xy[:, 1:, 0] = start[:, :1] + np.cumsum(length * np.cos(heading), axis=1)
+    xy[:, 1:, 1] = start[:, 1:] + np.cumsum(length * np.sin(heading), axis=1)
+    return FlatGeometry(xy.reshape(-1, 2), np.arange(0, n * vertices + 1, vertices), np.arange(n + 1), POLYLINE)
+
+
+def gages(lines, n, offset=100.0, unmatched=0.05, far=5000.0, seed=0):
+    """n gages on random segments of lines (a FlatGeometry of polylines), moved off the line by a normal offset of
+    standard deviation offset. A fraction unmatched of the gages is moved far away from their line instead.
+
+    Returns a dict of arrays: site_no (unique, 8 digits), x, y and feature (index of the line of the gage).
+    """
+    rng = np.random.RandomState(seed)
+    x0, y0, x1, y1, geom = lines.edges()
+    seg = rng.randint(0, len(x0), n)
+    t = rng.uniform(0, 1, n)
+    dist = np.where(rng.uniform(0, 1, n) < unmatched, far, np.abs(rng.normal(0, offset, n)))
+    angle = rng.uniform(0, 2 * np.pi, n)
+    return {'site_no': rng.permutation(codes(n, 8, seed=seed)),
+            'x': x0[seg] + t * (x1[seg] - x0[seg]) + dist * np.cos(angle),
+            'y': y0[seg] + t * (y1[seg] - y0[seg]) + dist * np.sin(angle),
+            'feature': geom[seg]}
+
+
+def tiling(nx, ny, extent=CONUS_NAD83, jitter=0.3, seed=0):
+    """nx * ny quadrilaterals on a grid over extent whose interior corners are moved at random by up to jitter times
+    the size of a cell, so that polygons do not line up with raster cells but still tile the extent exactly.
+    Returns a FlatGeometry of polygons (closed rings, row by row from the south-west corner)."""
+    rng = np.random.RandomState(seed)
+    xmin, ymin, xmax, ymax = extent
+    dx, dy = (xmax - xmin) / float(nx), (ymax - ymin) / float(ny)
+    cx, cy = np.meshgrid(xmin + dx * np.arange(nx + 1), ymin + dy * np.arange(ny + 1))
+    cx[1:-1, 1:-1] += rng.uniform(-jitter, jitter, (ny - 1, nx - 1)) * dx
+    cy[1:-1, 1:-1] += rng.uniform(-jitter, jitter, (ny - 1, nx - 1)) * dy
+    #Corners of every cell, counter-clockwise and closed
+    r, c = np.meshgrid(np.arange(ny), np.arange(nx), indexing='ij')
+    rows = np.stack([r, r, r + 1, r + 1, r], axis=-1).reshape(-1, 5)
+    cols = np.stack([c, c + 1, c + 1, c, c], axis=-1).reshape(-1, 5)
+    xy = np.column_stack([cx[rows, cols].ravel(), cy[rows, cols].ravel()])
+    n = nx * ny
+    return FlatGeometry(xy, np.arange(0, 5 * n + 1, 5), np.arange(n + 1), POLYGON)
+
+
+def codes(n, digits, seed=0):
+    """n unique zero-padded codes of digits digits (e.g. 5 for county FIPS, 6 for HUC6, 8 for site numbers), sorted."""
+    rng = np.random.RandomState(seed)
+    #One code drawn at random in each of n equal intervals of the range of codes
+    stride = (10 ** digits - 10 ** (digits - 1)) // n
+    if stride < 1:
+        raise ValueError('Cannot draw {0} unique codes of {1} digits'.format(n, digits))
+    values = 10 ** (digits - 1) + np.arange(n) * stride + rng.randint(0, stride, n)
+    return np.char.zfill(values.astype(str), digits)
+
+
+def huc8_table(n_huc6, per_huc6=6, missing=0.05, seed=0):
+    """Fish diversity table of n_huc6 * per_huc6 HUC8s (per_huc6 HUC8s in every HUC6).
+
+    Returns a dict of arrays: HUC8 (as in FishDiversityMetrics.csv, without leading zeros), TotArea_x, EWU, TE_EWU and
+    TE_Count. A fraction missing of the TE_EWU values are blank.
+    """
+    rng = np.random.RandomState(seed)
+    huc6 = codes(n_huc6, 6, seed=seed).astype(np.int64)
+    huc8 = (huc6[:, None] * 100 + np.arange(1, per_huc6 + 1)).ravel()
+    n = len(huc8)
+    te_ewu = rng.gamma(1.0, 0.2, n).round(6).astype(str)
+    te_ewu[rng.uniform(0, 1, n) < missing] = ''
+    return {'HUC8': huc8.astype(str), 'TotArea_x': rng.uniform(1000, 5000, n), 'EWU': rng.gamma(2.0, 1.5, n),
+            'TE_EWU': te_ewu, 'TE_Count': rng.poisson(2, n).astype(np.float64)}
+
+
+def precip_year(path, nlat, nlon, days=365, land=0.8, seed=0, chunk_days=31):
+    """Write a yearly daily precipitation NetCDF file (pr, kg m-2, day x lat x lon) on an nlat x nlon grid. Pixels
+    outside an ellipse covering about a fraction land of the grid have no data (e.g. ocean), as in the NLDAS files."""
+    import netCDF4 as nc
+    rng = np.random.RandomState(seed)
+    lat, lon = np.meshgrid(np.linspace(-1, 1, nlat), np.linspace(-1, 1, nlon), indexing='ij')
+    ocean = (lat ** 2 + lon ** 2) * np.pi / 4 > land
+    with nc.Dataset(path, 'w') as f:
+        f.createDimension('day', days)
+        f.createDimension('lat', nlat)
+        f.createDimension('lon', nlon)
+        pr = f.createVariable('pr', 'f4', ('day', 'lat', 'lon'), fill_value=np.float32(-9999.0))
+        pr.units = 'kg m-2'
+        for start in range(0, days, chunk_days):
+            nd = min(chunk_days, days - start)
+            block = rng.gamma(0.5, 4.0, (nd, nlat, nlon)).astype(np.float32)
+            pr[start:start + nd] = np.ma.masked_array(block, mask=np.broadcast_to(ocean, block.shape))
+    return path
+
+
+def precip_years(nc_dir, years, nlat=224, nlon=464, days=365, seed=0):
+    """Yearly NetCDF files for every year in years, named as the NLDAS files (see rainfall_climatology.NLDAS_PATTERN).
+    Files that already exist are kept. Returns the paths, sorted by year."""
+    if not os.path.isdir(nc_dir):
+        os.makedirs(nc_dir)
+    paths = []
+    for year in years:
+        path = os.path.join(nc_dir, 'nldas_met_update.obs.daily.pr.{0}.nc'.format(year))
+        if not os.path.exists(path):
+            precip_year(path, nlat, nlon, days=days, seed=seed + year)
+        paths.append(path)
+    return paths
+
+
+def flood_mask(grid, fraction=0.1, block=32, seed=0, path=None):
+    """uint8 raster on grid (see zonal_stats.Grid) with 1 in blocks of block x block cells covering about a fraction
+    fraction of the grid, 0 elsewhere. Written to path (.npy, returned memory-mapped) if given."""
+    rng = np.random.RandomState(seed)
+    nrows, ncols = grid.shape
+    coarse = rng.uniform(0, 1, (-(-nrows // block), -(-ncols // block))) < fraction
+    if path is None:
+        out = np.zeros((nrows, ncols), dtype=np.uint8)
+    else:
+        out = np.lib.format.open_memmap(path, mode='w+', dtype=np.uint8, shape=(nrows, ncols))
+    for r in range(coarse.shape[0]):
+        out[r * block:(r + 1) * block] = np.repeat(coarse[r], block)[:ncols]
+    return out
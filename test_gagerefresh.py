@@ -0,0 +1,64 @@
+#Creation date: October 2026
+
+#Objective: Tests of the comparison of NWIS exports of gagerefresh.py (python -m pytest test_gagerefresh.py)
+
+import numpy as np
+import pytest
+
+import gagerefresh
+
+
+def _sites(site_no, lon, lat, records):
+    return {'site_no': np.array(site_no), 'lon': np.array(lon, dtype=np.float64),
+            'lat': np.array(lat, dtype=np.float64), 'records': np.array(records, dtype='U16')}
+
+
+#Previous refresh: 01 to 04. New export: 01 has new days of record, 02 moved, 03 did not change, 04 was removed and
+#06 was added
+PREVIOUS = _sites(['00000001', '00000002', '00000003', '00000004'], [-70.0, -71.0, -72.0, -73.0],
+                  [40.0, 41.0, 42.0, 43.0], ['a', 'b', 'c', 'd'])
+SITES = _sites(['00000001', '00000002', '00000003', '00000006'], [-70.0, -71.5, -72.0, -74.0],
+               [40.0, 41.0, 42.0, 44.0], ['a2', 'b', 'c', 'e'])
+
+
+def _changes(out):
+    return dict(zip(out['site_no'].tolist(), out['change'].tolist()))
+
+
+def test_diff():
+    out = gagerefresh.diff(SITES, PREVIOUS)
+    assert _changes(out) == {'00000001': 'records', '00000002': 'moved', '00000004': 'removed',
+                             '00000006': 'added'}
+    assert out['lon_old'][out['site_no'] == '00000002'][0] == -71.0
+    assert np.isnan(out['lon'][out['site_no'] == '00000004'][0])
+
+
+def test_diff_first_refresh():
+    assert set(gagerefresh.diff(SITES)['change']) == {'added'}
+
+
+def test_diff_reprocess_sites_with_new_records():
+    #Sites whose days of record changed must be processed again when all sites are (a layer changed) or when their
+    #manual correction changed
+    out = gagerefresh.diff(SITES, PREVIOUS, reprocess=True)
+    assert _changes(out) == {'00000001': 'reprocess', '00000002': 'moved', '00000003': 'reprocess',
+                             '00000004': 'removed', '00000006': 'added'}
+    out = gagerefresh.diff(SITES, PREVIOUS, reprocess=['00000001', '00000002'])
+    assert _changes(out) == {'00000001': 'reprocess', '00000002': 'moved', '00000004': 'removed',
+                             '00000006': 'added'}
+    assert set(out['change'][np.isin(out['change'], gagerefresh.REPROCESS)]) == {'reprocess', 'moved', 'added'}
+
+
+def test_load_events_skips_null_points(tmp_path):
+    #Null points are (NaN, NaN) in FlatGeometry and must not shift the coordinates of the next events
+    pytest.importorskip('pyarrow')
+    import colstore
+    import flatgeom
+    layer = str(tmp_path / 'events.parquet')
+    colstore.write(layer, {'SOURCE_FEA': np.array(['00000001', '00000002', '00000003'])},
+                   flatgeom.FlatGeometry.from_points(np.array([-70.0, np.nan, -72.0]), np.array([40.0, np.nan, 42.0])),
+                   crs=4269)
+    for _ in range(2):
+        events = gagerefresh.load_events(layer, ['SOURCE_FEA'], str(tmp_path / 'events.npz'))
+        assert events['SOURCE_FEA'].tolist() == ['00000001', '00000003']
+        assert events['x'].tolist() == [-70.0, -72.0] and events['y'].tolist() == [40.0, 42.0]
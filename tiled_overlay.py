@@ -0,0 +1,290 @@
+#Creation date: October 2026
+
+#Objective: Intersect two large polygon layers (census blocks x FEMA flood zones, census blocks x HUC6) tile by tile
+#           in a pool of worker processes, rather than in one Intersect_analysis over the whole country
+#           - Candidate pairs of features (whose boxes overlap) are found with an STR tree (see strtree.py), and every
+#             pair is assigned to exactly one tile: the tile (cell of a grid, or HUC4) that contains the lower-left
+#             corner of the intersection of the boxes of the pair. Features that straddle tiles are thus intersected
+#             whole, once per pair, so pieces are not cut at tile boundaries nor duplicated in neighboring tiles
+#           - Tiles with many pairs are split into chunks of at most max_pairs pairs, so that the memory used by every
+#             worker is bounded whatever the density of features
+#           - In every chunk, only the features of its pairs are converted to shapely geometries, invalid geometries
+#             (self-intersections, as in the census blocks and FEMA zones) are repaired (make_valid) and every pair is
+#             intersected. Only polygonal pieces are kept (boundaries that only touch are dropped)
+#           - Pieces are written with the IDs of their source features and their geodesic area (see geodesic.py) as
+#             they are computed, one columnar file per chunk (see colstore.py), and chunks already written by an
+#             interrupted run with the same inputs are not recomputed
+#           The input layers are given to the worker processes when they start: as they are when workers are forked (as
+#           on Linux), otherwise (spawn, as on Windows) as .npy files in a temporary folder that every worker reads
+#           memory-mapped, so that the layers are not copied to every worker. Requires shapely >= 2.1.
+
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+import colstore
+import flatgeom
+import geodesic
+import instrument
+import projection
+import workerpool
+from strtree import STRtree
+
+
+class GridTiles(object):
+    """Square tiles of size size (units of the layers, e.g. 1 degree) aligned on (x0, y0)."""
+
+    def __init__(self, size, x0=0.0, y0=0.0):
+        self.size, self.x0, self.y0 = float(size), float(x0), float(y0)
+
+    def owner(self, x, y):
+        col = np.floor((np.asarray(x) - self.x0) / self.size).astype(np.int64)
+        row = np.floor((np.asarray(y) - self.y0) / self.size).astype(np.int64)
+        return row * 2 ** 32 + col
+
+
+class PolygonTiles(object):
+    """Tiles defined by the polygons of a pointinpoly.PolygonIndex (e.g. HUC6 watersheds), grouped by keys (one per
+    polygon, e.g. the HUC4 of every HUC6; the feature IDs of the index by default). Points outside of every polygon
+    go to the tile of the closest polygon within tolerance, or to one last tile."""
+
+    def __init__(self, index, keys=None, tolerance=50000.0):
+        self.index = index
+        keys = np.asarray(index.feature_ids if keys is None else keys)
+        self.keys, self.polygon_tile = np.unique(keys, return_inverse=True)
+        self.tolerance = tolerance
+
+    def owner(self, x, y):
+        polygon = self.index.assign(x, y, tolerance=self.tolerance)['polygon']
+        return np.where(polygon >= 0, self.polygon_tile[np.maximum(polygon, 0)], len(self.keys))
+
+
+def candidate_pairs(a, b, batch_size=10 ** 6):
+    """Pairs (index in a, index in b) of features of FlatGeometries a and b whose boxes overlap, sorted by a."""
+    tree = STRtree(b.bounds())
+    abox = a.bounds()
+    ia, ib = [], []
+    #Query boxes in batches, so that the (box, node) candidates of the tree walk do not all have to fit in memory
+    for start in range(0, len(a), batch_size):
+        qi, item = tree.query(abox[start:start + batch_size])
+        ia.append(qi + start)
+        ib.append(item)
+    return np.concatenate(ia or [np.zeros(0, np.int64)]), np.concatenate(ib or [np.zeros(0, np.int64)])
+
+
+def _chunks(tile, max_pairs):
+    #(start, end) of runs of at most max_pairs pairs of the same tile (pairs sorted by tile)
+    breaks = np.flatnonzero(np.diff(tile)) + 1
+    starts, ends = np.concatenate([[0], breaks]), np.concatenate([breaks, [len(tile)]])
+    chunks = []
+    for s, e in zip(starts, ends):
+        chunks.extend((i, min(i + max_pairs, e)) for i in range(s, e, max_pairs))
+    return chunks
+
+
+#Layers and pairs being intersected, set in every worker process when it starts (see _init_worker)
+_shared = {}
+_GEOM_ARRAYS = ('xy', 'part_offsets', 'geom_offsets')
+
+
+def _save_shared(folder, layers, pairs):
+    #Arrays of the layers and pairs as .npy files in folder, for workers that are not forked
+    for name, geoms in zip('ab', layers):
+        for field in _GEOM_ARRAYS:
+            np.save(os.path.join(folder, '{0}_{1}.npy'.format(name, field)), getattr(geoms, field))
+    for name, pair in zip('ab', pairs):
+        np.save(os.path.join(folder, 'pairs_{0}.npy'.format(name)), pair)
+    with open(os.path.join(folder, 'kinds.json'), 'w') as f:
+        json.dump([geoms.kind for geoms in layers], f)
+
+
+def _load_shared(folder):
+    with open(os.path.join(folder, 'kinds.json')) as f:
+        kinds = json.load(f)
+    layers = tuple(flatgeom.FlatGeometry(*[np.load(os.path.join(folder, '{0}_{1}.npy'.format(name, field)),
+                                                   mmap_mode='r') for field in _GEOM_ARRAYS] + [kind])
+                   for name, kind in zip('ab', kinds))
+    pairs = tuple(np.load(os.path.join(folder, 'pairs_{0}.npy'.format(name)), mmap_mode='r') for name in 'ab')
+    return layers, pairs
+
+
+def _init_worker(layers, pairs, crs, unit):
+    #layers is the folder written by _save_shared for workers that are not forked
+    if isinstance(layers, str):
+        layers, pairs = _load_shared(layers)
+    _shared.update(layers=layers, pairs=pairs, crs=crs, unit=unit)
+
+
+def _shapely(geoms, idx):
+    #Valid shapely geometries of features idx of a FlatGeometry (repaired if needed)
+    import shapely
+    offsets, data = colstore.to_wkb(geoms.take(idx))
+    out = shapely.from_wkb([data[offsets[i]:offsets[i + 1]].tobytes() or None for i in range(len(idx))])
+    invalid = ~shapely.is_valid(out) & ~shapely.is_missing(out)
+    if invalid.any():
+        out[invalid] = _polygonal(shapely.make_valid(out[invalid]))
+    return out
+
+
+def _polygonal(geoms):
+    #Polygonal part of every geometry (points and lines of geometry collections dropped), None if there is none
+    import shapely
+    parts, index = np.asarray(geoms), np.arange(len(geoms))
+    while True:
+        #Explode multi-polygons and collections until only single geometries are left
+        multi = np.isin(shapely.get_type_id(parts), [6, 7])
+        if not multi.any():
+            break
+        sub, sub_index = shapely.get_parts(parts[multi], return_index=True)
+        parts = np.concatenate([parts[~multi], sub])
+        index = np.concatenate([index[~multi], index[multi][sub_index]])
+    keep = (shapely.get_type_id(parts) == 3) & ~shapely.is_empty(parts)
+    out = np.full(len(geoms), None, dtype=object)
+    if keep.any():
+        owners = np.unique(index[keep])
+        order = np.argsort(index[keep], kind='stable')
+        out[owners] = shapely.multipolygons(parts[keep][order], indices=np.searchsorted(owners, index[keep][order]))
+    return out
+
+
+def _lonlat(geoms, crs):
+    #geoms with vertices transformed from crs to the geographic coordinate system of its datum
+    if crs is None:
+        return geoms
+    lon, lat = projection.transform(geoms.xy[:, 0], geoms.xy[:, 1], crs, projection.geodetic_crs(crs))
+    return flatgeom.FlatGeometry(np.column_stack([lon, lat]), geoms.part_offsets, geoms.geom_offsets, geoms.kind)
+
+
+def _intersect_chunk(bounds):
+    import shapely
+    i, j = bounds
+    a, b = _shared['layers']
+    pa, pb = _shared['pairs'][0][i:j], _shared['pairs'][1][i:j]
+    ua, ia = np.unique(pa, return_inverse=True)
+    ub, ib = np.unique(pb, return_inverse=True)
+    ga, gb = _shapely(a, ua), _shapely(b, ub)
+    pieces = _polygonal(shapely.intersection(ga[ia], gb[ib]))
+    keep = np.flatnonzero(~shapely.is_missing(pieces))
+    #Holes wound the opposite way of outer rings (clockwise outer rings, as in shapefiles), see geodesic.polygon_areas
+    pieces = shapely.orient_polygons(pieces[keep], exterior_cw=True)
+    wkb = shapely.to_wkb(pieces, byte_order=1)
+    offsets = np.concatenate([[0], np.cumsum([len(w) for w in wkb])]).astype(np.int64)
+    geoms = colstore.from_wkb(offsets, np.frombuffer(b''.join(wkb), dtype=np.uint8))
+    area = geodesic.polygon_areas(_lonlat(geoms, _shared['crs']), unit=_shared['unit'])
+    return i + keep, pa[keep], pb[keep], geoms, area
+
+
+def _fingerprint(a, b, pairs, params):
+    h = hashlib.sha1(json.dumps(params, sort_keys=True).encode('utf-8'))
+    for arr in (a.xy, a.part_offsets, a.geom_offsets, b.xy, b.part_offsets, b.geom_offsets, pairs[0], pairs[1]):
+        h.update(np.ascontiguousarray(arr).tobytes())
+    return h.hexdigest()
+
+
+def intersect(a, b, out_path, a_ids, b_ids, id_fields=('FID_1', 'FID_2'), tiles=None, crs=None,
+              area_field='AREA_GEO', unit='SQUARE_KILOMETERS', workers=None, max_pairs=50000):
+    """Intersect the polygons of FlatGeometries a and b (in the same coordinate system) and write the pieces to the
+    columnar dataset out_path (a folder, e.g. 'censusflood_intersect.parquet', see colstore.py).
+
+    Every piece has an OBJECTID (unique, but not consecutive: 1 + the rank of its pair), the IDs of its source
+    features (a_ids and b_ids, arrays with one value per feature, in id_fields) and its geodesic area (area_field, in
+    unit). tiles is a GridTiles or PolygonTiles (1-degree grid by default, for layers in decimal degrees); crs is the
+    coordinate system of the layers (anything that pyproj accepts, e.g. WKT), None if they are in decimal degrees.
+    With workers > 1 (or None, one worker per core), chunks of at most max_pairs pairs are intersected by a pool of
+    worker processes. The candidate search and the intersection of the chunks are recorded as stages (candidate_pairs
+    and intersect_chunks, see instrument.py).
+
+    Returns the number of pieces.
+    """
+    tiles = tiles if tiles is not None else GridTiles(1.0)
+    with instrument.stage('candidate_pairs', rows_in=len(a) + len(b)) as step:
+        ia, ib = candidate_pairs(a, b)
+        #Tile of every pair: the tile of the lower-left corner of the intersection of their boxes
+        ba, bb = a.bounds()[ia], b.bounds()[ib]
+        tile = tiles.owner(np.maximum(ba[:, 0], bb[:, 0]), np.maximum(ba[:, 1], bb[:, 1]))
+        order = np.lexsort((ib, ia, tile))
+        ia, ib, tile = ia[order], ib[order], tile[order]
+        chunks = _chunks(tile, max_pairs)
+        step.rows_out = len(ia)
+
+    #Chunks written by a previous run of the same overlay are kept, the others are (re)computed
+    key = _fingerprint(a, b, (ia, ib), [max_pairs, area_field, unit, str(crs), list(id_fields)])
+    manifest_path = os.path.join(out_path, '_manifest.json')
+    manifest = {'key': key, 'chunks': {}}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            previous = json.load(f)
+        if previous['key'] == key:
+            manifest = previous
+    if not os.path.isdir(out_path):
+        os.makedirs(out_path)
+    names = ['part-{0:06d}.parquet'.format(c) for c in range(len(chunks))]
+    for f in os.listdir(out_path):
+        if f != '_manifest.json' and f not in manifest['chunks']:
+            os.remove(os.path.join(out_path, f))
+    todo = [c for c in range(len(chunks)) if names[c] not in manifest['chunks']]
+
+    #Pairs of the chunks to compute in, pieces out
+    npairs = sum(chunks[c][1] - chunks[c][0] for c in todo)
+    with instrument.stage('intersect_chunks', rows_in=npairs, rows_out=0) as step:
+        pool = folder = None
+        try:
+            if workers == 1 or len(todo) <= 1:
+                _init_worker((a, b), (ia, ib), crs, unit)
+                results = map(_intersect_chunk, [chunks[c] for c in todo])
+            else:
+                shared = ((a, b), (ia, ib))
+                if multiprocessing.get_start_method() != 'fork':
+                    folder = tempfile.mkdtemp(prefix='tiled_overlay_')
+                    _save_shared(folder, (a, b), (ia, ib))
+                    shared = (folder, None)
+                pool = workerpool.pool(workers, initializer=_init_worker, initargs=shared + (crs, unit))
+                results = pool.imap(_intersect_chunk, [chunks[c] for c in todo])
+            for c, (pair, pa, pb, geoms, area) in zip(todo, results):
+                colstore.write(os.path.join(out_path, names[c]),
+                               {'OBJECTID': pair + 1, id_fields[0]: np.asarray(a_ids)[pa],
+                                id_fields[1]: np.asarray(b_ids)[pb], area_field: area}, geoms, crs=crs)
+                manifest['chunks'][names[c]] = len(area)
+                step.add_rows(rows_out=len(area))
+                with open(manifest_path, 'w') as f:
+                    json.dump(manifest, f)
+        except Exception:
+            if pool is not None:
+                pool.terminate()
+            raise
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+            if folder is not None:
+                shutil.rmtree(folder, ignore_errors=True)
+            _shared.clear()
+    return sum(manifest['chunks'].values())
+
+
+def intersect_features(in_features, id_fields, out_path, tile_size=None, tiles=None, area_field='AREA_GEO',
+                       unit='SQUARE_KILOMETERS', workers=None, max_pairs=50000):
+    """Intersect_analysis of two polygon layers (paths of feature classes, shapefiles or columnar stores), written to
+    the columnar dataset out_path with the IDs of the source features (id_fields of each layer) and the geodesic
+    area of the pieces (see intersect).
+
+    The second layer is read in the coordinate system of the first one. Tiles are a grid of tile_size (units of the
+    first layer: 1 degree or 100 km by default) unless tiles is given. Output ID fields are named FID_<layer name>,
+    as in Intersect_analysis.
+    """
+    import arcpy
+    sr = arcpy.Describe(in_features[0]).spatialReference
+    geoms_a, table_a = flatgeom.read_features(in_features[0], fields=[id_fields[0]])
+    geoms_b, table_b = flatgeom.read_features(in_features[1], fields=[id_fields[1]], spatial_reference=sr)
+    if tile_size is None:
+        tile_size = 1.0 if sr.type == 'Geographic' else 100000.0
+    names = ['FID_' + os.path.splitext(os.path.basename(os.path.normpath(f)))[0] for f in in_features]
+    return intersect(geoms_a, geoms_b, out_path, table_a[id_fields[0]], table_b[id_fields[1]], id_fields=names,
+                     tiles=tiles if tiles is not None else GridTiles(tile_size),
+                     crs=None if sr.type == 'Geographic' else sr.exportToString(), area_field=area_field, unit=unit,
+                     workers=workers, max_pairs=max_pairs)
@@ -0,0 +1,31 @@
+#Creation date: October 2026
+
+#Objective: Start pools of worker processes from the analysis scripts (6Gages_flood_scarcity_fishdiv.py...), whose
+#           code is not guarded by if __name__ == '__main__'
+#           - With the spawn start method (the only one on Windows, e.g. with the Python of ArcGIS Pro), every worker
+#             runs the __main__ module again before it takes tasks: a worker of a script would run the script again
+#             (arcpy geoprocessing included) and fail when it reaches the pool. Pools are started with __main__
+#             hidden, so that workers only import the modules of their tasks
+#           - Data shared by all tasks is passed once to every worker through initializer and initargs, not through
+#             module globals set by the parent (which only forked workers inherit)
+#           Tasks, initializers and their arguments must therefore be picklable and defined at module level in
+#           importable modules, not in the script.
+
+import multiprocessing
+import sys
+
+
+def pool(processes=None, initializer=None, initargs=()):
+    """multiprocessing.Pool of processes workers (one per core if None) whose workers do not run __main__ again
+    when they are spawned. initializer(*initargs) is called in every worker when it starts."""
+    main = sys.modules.get('__main__')
+    saved = dict((name, getattr(main, name)) for name in ('__file__', '__spec__') if hasattr(main, name))
+    try:
+        if '__file__' in saved:
+            del main.__file__
+        if '__spec__' in saved:
+            main.__spec__ = None
+        return multiprocessing.Pool(processes=processes, initializer=initializer, initargs=initargs)
+    finally:
+        for name, value in saved.items():
+            setattr(main, name, value)
@@ -0,0 +1,95 @@
+#Creation date: October 2026
+
+#Objective: Stage graph of the gage snapping, water scarcity, fish diversity, flood and Wild and Scenic River analyses
+#           (see stages.py). Run this script to update every output whose inputs changed, e.g. after a new NWIS
+#           download (discharge_castdtinfo) or a new version of Devineni et al.'s NDC_NDImax.csv: only the stages
+#           downstream of the change are rerun, and the scarcity, fish and flood stages run in parallel.
+#           python workflow.py [stage ...] runs the given stages (and those they depend on), --dry-run lists the stages
+#           that would run, --force stage reruns a stage.
+#           R scripts (4gages_history12.R, 7Flood_analysis.R, 11wsrgages.R...) are still run by hand on the outputs.
+#           Section D of 3Gages_analysis2.py updates the outputs of the gages_* and wsr stages incrementally from a new
+#           NWIS export (only the new, moved and corrected gages are processed, see gagerefresh.py); it is run by hand
+#           as it writes the same outputs as those stages.
+
+import os
+import sys
+
+import stages
+
+#Python 3 interpreter with arcpy (e.g. the Python of ArcGIS Pro), used to run the sections of the scripts
+arcpy_python = sys.executable
+scripts = os.path.dirname(os.path.abspath(__file__))
+
+projdir = "F:/gages_project/"
+results = projdir + "results/"
+gages_gdb = results + "gages/gages_analysis.gdb/"
+NHDpath = projdir + "data/general/NHDplusv2/NHDPlusV21_NationalData_National_Seamless_Geodatabase_02/NHDPlusNationalData/NHDPlusV21_National_Seamless.gdb/"
+scarcity_gdb = results + "water_Scarcity/Gage_analysis_scarcity.gdb/"
+flood_db = results + "flood/Flood_analysis.gdb/"
+gage_rec = results + "gages/discharge_castdtinfo20180111.dbf"
+HUC6_dat = gages_gdb + "HUC6"
+LCD2011 = "F:/Data/nlcd_2011_landcover_2011_edition_2014_10_10/nlcd_2011_landcover_2011_edition_2014_10_10/nlcd_2011_landcover_2011_edition_2014_10_10.img"
+wsr = projdir + "data/general/National_Wild_and_Scenic_River_Segments_Feature_Layer_20180314/National_Wild_and_Scenic_River_Segments_Feature_Layer.shp"
+
+
+def build(state_path=results + "workflow_state.json"):
+    pipeline = stages.Pipeline(state_path)
+
+    def script(name, sections=None):
+        return stages.ScriptSection(os.path.join(scripts, name), sections, python=arcpy_python)
+
+    #Gages (3Gages_analysis2.py): flowlines are only indexed again when NHDv2 changes
+    pipeline.add('flowlines', script("3Gages_analysis2.py", ['0']),
+                 inputs=[NHDpath + "NHDSnapshot/NHDFlowline_Network_nocoast", NHDpath + "NHDSnapshot/NHDFlowline_NonNetwork"],
+                 outputs=[results + "gages/NHDFlowline_Network_nocoast_tiles/segments.npz",
+                          results + "gages/NHDFlowline_NonNetwork_tiles/segments.npz"])
+    #discharge_castformat (in gages_analysis.gdb) is the gage_rec table of NWIS records imported to the gdb
+    pipeline.add('gages_nhd_join', script("3Gages_analysis2.py", ['A']),
+                 inputs=[NHDpath + "NHDEvents/Gage", gage_rec],
+                 outputs=[gages_gdb + "NHD2gage_discharge_castformat_join", gages_gdb + "discharge_castformat_NHD2gage_nojoin"])
+    pipeline.add('gages_position', script("3Gages_analysis2.py", ['B']),
+                 inputs=[NHDpath + "NHDEvents/Gage", gage_rec, results + "gages/NHDFlowline_Network_nocoast_tiles/segments.npz",
+                         results + "gages/NHDFlowline_NonNetwork_tiles/segments.npz"],
+                 outputs=[gages_gdb + "gages_discharge", gages_gdb + "allgages_merge", results + "gages/store/allgages_merge.parquet"])
+    pipeline.add('gages_huc', script("3Gages_analysis2.py", ['C']),
+                 inputs=[results + "gages/store/allgages_merge.parquet", NHDpath + "WBDSnapshot/HUC12"],
+                 outputs=[gages_gdb + "allgages_merge_HUCjoin", results + "gages/store/allgages_merge_HUCjoin.parquet"])
+
+    #Water scarcity, fish diversity and flood risk by HUC6 (6Gages_flood_scarcity_fishdiv.py)
+    pipeline.add('scarcity', script("6Gages_flood_scarcity_fishdiv.py", ['A']),
+                 inputs=[projdir + "data/flood/Population/gz_2010_us_050_00_5m/gz_2010_us_050_00_5m.shp",
+                         projdir + "data/scarcity/Devineni_et_al_2015/NDC_NDImax.csv",
+                         results + "water_Scarcity/Precipitation/unzipped_data/nldas_met_update.obs.daily.pr.*.nc",
+                         HUC6_dat],
+                 outputs=[results + "water_Scarcity/NDC_NDImax_ingest.json", scarcity_gdb + "county_NDImax_join", scarcity_gdb + "HUC6_SIC_pr",
+                          results + "water_Scarcity/Precipitation/county_AP.dbf",
+                          results + "water_Scarcity/Precipitation/HUC6_AP.dbf",
+                          results + "water_Scarcity/Precipitation/HUC6_daily_pr.npz",
+                          results + "water_Scarcity/Precipitation/county_daily_pr.npz"])
+    pipeline.add('fish', script("6Gages_flood_scarcity_fishdiv.py", ['B']),
+                 inputs=[projdir + "data/fish/FishDiversityMetrics.csv", results + "fish/HUC8.shp"],
+                 outputs=[results + "fish/FishDiversityMetrics_ingest.json", results + "fish/HUC6div.csv"])
+    pipeline.add('flood', script("6Gages_flood_scarcity_fishdiv.py", ['C']),
+                 inputs=[flood_db + "Censusblock_US_merge", flood_db + "S_Fld_Haz_Ar_ZoneA",
+                         flood_db + "censusflood_intersect_2_proj", LCD2011, HUC6_dat],
+                 outputs=[results + "flood/censusflood_intersect.parquet", flood_db + "S_Fld_Haz_Ar_proj",
+                          results + "flood/censusblock_HUC6_intersect.parquet",
+                          results + "flood/censusblock_lcd_inters_tab.dbf", results + "flood/censusflood_urbansum.dbf",
+                          results + "flood/censusFEMAdat_lcd_inters_tab.dbf",
+                          results + "flood/Censusblock_HUC6_inters.parquet"])
+
+    #Gages on Wild and Scenic Rivers (10wsrgages.py). Checks entered in gages_wsr_near.dbf modify an output of the
+    #stage, so the stage is rerun to carry them over and update the selection
+    pipeline.add('wsr', script("10wsrgages.py"),
+                 inputs=[results + "gages/store/allgages_merge.parquet", wsr],
+                 outputs=[results + "gages/gages_wsr_near.dbf", results + "gages/gages_wsr_review.dbf",
+                          results + "gages/gages_wildandscenic_select.dbf"])
+    return pipeline
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    dry_run = '--dry-run' in args
+    force = [args[i + 1] for i, a in enumerate(args) if a == '--force' and i + 1 < len(args)]
+    targets = [a for i, a in enumerate(args) if not a.startswith('--') and not (i > 0 and args[i - 1] == '--force')]
+    build().run(targets=targets or None, force=force, dry_run=dry_run)
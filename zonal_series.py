@@ -0,0 +1,204 @@
+#Creation date: October 2026
+
+#Objective: Daily precipitation time series of every zone (HUC6, county) straight from the yearly NLDAS NetCDF files,
+#           so that any temporal statistic (average annual rainfall, dry years, trends, seasonal totals...) can be
+#           computed by zone without building a raster of that statistic and running zonal statistics on it
+#           - The fraction of every pixel of the precipitation grid (1/8 degree) that falls in every zone is computed
+#             once from the zones rasterized on a grid factor times finer aligned on the pixels (see label_cache.py),
+#             with the ellipsoidal area of the fine cells (see geodesic.py), and stored on disk as a sparse matrix of
+#             (pixel, zone, area) (see overlay.AreaWeights)
+#           - Every chunk of days (days x pixels) is reduced to (days x zones) area-weighted means with one sparse
+#             matrix product (pixel values gathered for every non-zero weight and summed by zone), ignoring pixels
+#             without data on that day
+#           - Yearly files are read once each (for all the zone layers at once), in parallel, and the series of all years are kept in one (days x zones)
+#             array saved to disk (a few tens of MB for 62 years of 300 HUC6)
+
+import datetime
+import os
+import re
+import warnings
+
+import numpy as np
+
+import geodesic
+import overlay
+import workerpool
+from zonal_stats import Grid
+
+
+class PixelLabels(object):
+    """Label raster (see label_cache.LabelRaster) of the pixels of coarse on a grid factor times finer: label
+    i + 1 is pixel i of coarse (row by row, row 0 at the top)."""
+
+    def __init__(self, coarse, factor, tile_rows=1024):
+        self.coarse = coarse
+        self.factor = int(factor)
+        self.grid = Grid(coarse.xmin, coarse.ymax, coarse.cellsize / self.factor, coarse.nrows * self.factor,
+                         coarse.ncols * self.factor, coarse.crs)
+        self.tile_rows = tile_rows
+        self.zone_keys = np.arange(coarse.nrows * coarse.ncols)
+        self.path = 'pixels_{0}x{1}_{2:.6f}_{3:.6f}_{4:g}_x{5}'.format(coarse.nrows, coarse.ncols, coarse.xmin,
+                                                                        coarse.ymax, coarse.cellsize, self.factor)
+
+    def __getitem__(self, rows):
+        row0, row1, step = rows.indices(self.grid.nrows)
+        r = np.arange(row0, row1) // self.factor
+        c = np.arange(self.grid.ncols) // self.factor
+        return (r[:, None] * self.coarse.ncols + c[None, :] + 1).astype(np.int64)
+
+
+def fine_grid(coarse, factor):
+    """Grid factor times finer than coarse, with the same extent (to rasterize the zones on)."""
+    return PixelLabels(coarse, factor).grid
+
+
+def pixel_weights(coarse, zone_labels, cache_dir, ellipsoid=geodesic.GRS80):
+    """Area (square meters) of every pixel of the grid coarse in every zone, as an overlay.AreaWeights from pixels
+    (source_keys: index of the pixel, row by row) to zones. zone_labels is the label raster of the zones on a grid
+    factor times finer than coarse (see fine_grid). Weights are saved to and loaded from cache_dir."""
+    factor = int(round(coarse.cellsize / zone_labels.grid.cellsize))
+    pixels = PixelLabels(coarse, factor, tile_rows=zone_labels.tile_rows)
+    return overlay.AreaWeights.cached(pixels, zone_labels, cache_dir, ellipsoid=ellipsoid)
+
+
+class SparseReducer(object):
+    """Area-weighted mean over every zone of rows of pixel values (e.g. days x pixels), from pixel weights."""
+
+    def __init__(self, weights):
+        order = np.argsort(weights.target, kind='stable')
+        self.pixel = weights.source[order]
+        self.area = weights.area[order]
+        target = weights.target[order]
+        #Zones with at least one pixel, and the start of their weights
+        self.zones, self.starts = np.unique(target, return_index=True)
+        self.nzones = len(weights.target_keys)
+
+    def mean(self, values):
+        """(n, nzones) means of (n, npixels) values; NaN values are ignored, zones without any value are NaN."""
+        values = np.asarray(values, dtype=np.float64)
+        total = np.zeros((self.nzones, len(values)))
+        area = np.zeros((self.nzones, len(values)))
+        if len(self.pixel):
+            #Pixels x days, so that the values of every weight and the sums by zone are contiguous rows
+            v = np.ascontiguousarray(values.T)[self.pixel]
+            valid = ~np.isnan(v)
+            v[~valid] = 0.0
+            w = valid * self.area[:, None]
+            total[self.zones] = np.add.reduceat(v * w, self.starts, axis=0)
+            area[self.zones] = np.add.reduceat(w, self.starts, axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(area > 0, total / area, np.nan).T
+
+
+def file_year(path):
+    """Year of a yearly NetCDF file (last 4-digit number of its name, e.g. 1987 for ...daily.pr.1987.nc)."""
+    return int(re.findall(r'\d{4}', os.path.basename(path))[-1])
+
+
+def year_series(path, reducers, variable='pr', chunk_days=31, flip=True):
+    """(days x zones) area-weighted means of a (day, lat, lon) NetCDF variable for every SparseReducer of reducers,
+    reading the file once, chunk_days days at a time. flip if the rows of the file go from south to north (as in the
+    NLDAS files) while the pixel grid starts at the top."""
+    import netCDF4 as nc
+    with nc.Dataset(path) as f:
+        var = f.variables[variable]
+        var.set_auto_mask(True)
+        out = [np.empty((var.shape[0], reducer.nzones)) for reducer in reducers]
+        for start in range(0, var.shape[0], chunk_days):
+            block = var[start:start + chunk_days]
+            block = np.ma.filled(block.astype(np.float64), np.nan)
+            if flip:
+                block = block[:, ::-1, :]
+            block = block.reshape(len(block), -1)
+            for reducer, series in zip(reducers, out):
+                series[start:start + len(block)] = reducer.mean(block)
+    return out
+
+
+#Reducers of the series being computed, set in every worker process when it starts (see _init_worker)
+_shared = {}
+
+
+def _init_worker(reducers):
+    _shared['reducers'] = reducers
+
+
+def _year_series_task(args):
+    path, variable, chunk_days, flip = args
+    return year_series(path, _shared['reducers'], variable=variable, chunk_days=chunk_days, flip=flip)
+
+
+class ZoneSeries(object):
+    """Daily values (days x zones) with their dates and the keys of the zones."""
+
+    def __init__(self, dates, values, zone_keys):
+        self.dates = np.asarray(dates, dtype='datetime64[D]')
+        self.values = np.asarray(values, dtype=np.float64)
+        self.zone_keys = np.asarray(zone_keys)
+
+    @property
+    def years(self):
+        return self.dates.astype('datetime64[Y]').astype(int) + 1970
+
+    def annual_totals(self):
+        """(years, totals): sum of the daily values of every year, years x zones (NaN if a zone has no value)."""
+        years, inverse = np.unique(self.years, return_inverse=True)
+        totals = np.zeros((len(years), self.values.shape[1]))
+        np.add.at(totals, inverse, np.nan_to_num(self.values))
+        valid = np.zeros(totals.shape, dtype=bool)
+        np.logical_or.at(valid, inverse, ~np.isnan(self.values))
+        totals[~valid] = np.nan
+        return years, totals
+
+    def mean_annual_total(self):
+        """Average annual total of every zone over the years of the series (NaN for zones without any value)."""
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            return np.nanmean(self.annual_totals()[1], axis=0)
+
+    def table(self, zone_field='ZONE'):
+        """Average annual total by zone as a table (dict of arrays), as zonal_stats output (MEAN)."""
+        return {zone_field: self.zone_keys, 'MEAN': self.mean_annual_total()}
+
+    def save(self, path):
+        tmp = path + '.tmp.npz'
+        np.savez(tmp, dates=self.dates, values=self.values, zone_keys=self.zone_keys)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as dat:
+            return cls(dat['dates'], dat['values'], dat['zone_keys'])
+
+
+def zone_series(paths, weights, variable='pr', chunk_days=31, flip=True, workers=1):
+    """Daily area-weighted means of variable over every zone of weights (see pixel_weights, or a list of them to
+    reduce every file once for several zone layers), for every yearly file in paths (in order), as a ZoneSeries (or
+    a list of them). Days are dated from January 1st of the year of every file (see file_year).
+    With workers > 1 (or None, one worker per core), files are read in parallel by worker processes (see
+    workerpool.py), which receive the reducers once when they start."""
+    several = isinstance(weights, (list, tuple))
+    weights = list(weights) if several else [weights]
+    reducers = [SparseReducer(w) for w in weights]
+    tasks = [(path, variable, chunk_days, flip) for path in paths]
+    try:
+        if workers == 1:
+            _init_worker(reducers)
+            years = [_year_series_task(t) for t in tasks]
+        else:
+            pool = workerpool.pool(workers, initializer=_init_worker, initargs=(reducers,))
+            try:
+                years = list(pool.imap(_year_series_task, tasks))
+            except Exception:
+                pool.terminate()
+                raise
+            finally:
+                pool.close()
+                pool.join()
+    finally:
+        _shared.clear()
+    dates = [np.datetime64(datetime.date(file_year(p), 1, 1)) + np.arange(len(y[0])) for p, y in zip(paths, years)]
+    dates = np.concatenate(dates) if dates else []
+    out = [ZoneSeries(dates, np.vstack([y[i] for y in years]) if years else np.zeros((0, r.nzones)), w.target_keys)
+           for i, (w, r) in enumerate(zip(weights, reducers))]
+    return out if several else out[0]
@@ -0,0 +1,208 @@
+#Creation date: October 2026
+
+#Objective: Zonal statistics of a value raster within polygon zones without arcpy (replaces
+#           arcpy.sa.ZonalStatisticsAsTable, which failed on most of the large inputs of this project)
+#           - Zone polygons (see flatgeom.py) are rasterized on the grid of the value raster into an integer label grid
+#             (a cell gets the label of the polygon that contains its center)
+#           - Count, sum, mean, min and max of every zone are computed in one grouped (np.bincount) pass
+#           - Rasters are processed in blocks of rows so that national 30 m grids never have to fit in memory
+
+import numpy as np
+
+from flatgeom import _local_index, _ranges
+
+
+class Grid(object):
+    """Raster grid with square cells; row 0 is the top (northernmost) row, as in ArcGIS rasters."""
+
+    def __init__(self, xmin, ymax, cellsize, nrows, ncols, crs=None):
+        self.xmin = float(xmin)
+        self.ymax = float(ymax)
+        self.cellsize = float(cellsize)
+        self.nrows = int(nrows)
+        self.ncols = int(ncols)
+        self.crs = crs
+
+    @classmethod
+    def from_arcpy(cls, raster):
+        """Grid of an arcpy.Raster (or of the path to a raster). crs is the factory code of its coordinate system, or its
+        WKT if it has none (custom coordinate systems)."""
+        import arcpy
+        ras = arcpy.Raster(raster) if isinstance(raster, str) else raster
+        sr = ras.spatialReference
+        return cls(ras.extent.XMin, ras.extent.YMax, ras.meanCellWidth, ras.height, ras.width,
+                   sr.factoryCode or sr.exportToString())
+
+    @classmethod
+    def from_extent(cls, xmin, ymin, xmax, ymax, cellsize, crs=None):
+        """Smallest grid with cells of cellsize aligned on multiples of cellsize that covers the extent."""
+        x0 = np.floor(xmin / cellsize) * cellsize
+        y1 = np.ceil(ymax / cellsize) * cellsize
+        return cls(x0, y1, cellsize, int(np.ceil((y1 - ymin) / cellsize)), int(np.ceil((xmax - x0) / cellsize)), crs)
+
+    @property
+    def xmax(self):
+        return self.xmin + self.ncols * self.cellsize
+
+    @property
+    def ymin(self):
+        return self.ymax - self.nrows * self.cellsize
+
+    @property
+    def shape(self):
+        return self.nrows, self.ncols
+
+    def __repr__(self):
+        return 'Grid(xmin={0}, ymax={1}, cellsize={2}, nrows={3}, ncols={4}, crs={5!r})'.format(
+            self.xmin, self.ymax, self.cellsize, self.nrows, self.ncols, self.crs)
+
+
+def row_blocks(nrows, tile_rows):
+    """(row0, row1) of successive blocks of at most tile_rows rows."""
+    return [(r, min(r + tile_rows, nrows)) for r in range(0, nrows, tile_rows)]
+
+
+def label_tiles(geoms, labels, grid, tile_rows=1024):
+    """Rasterize polygons block by block, yielding (row0, row1, int32 label block) for every block of rows.
+
+    Cells whose center falls inside polygon i (even-odd rule, so holes are excluded) get labels[i], other cells 0.
+    Where polygons overlap, the polygon that comes last wins.
+    """
+    labels = np.asarray(labels, dtype=np.int32)
+    x0, y0, x1, y1, g = geoms.edges()
+    cs = grid.cellsize
+    #Rows whose cell center y is in [min(y0, y1), max(y0, y1)) cross the edge (half-open so that a vertex lying exactly
+    #on a row center is only counted once)
+    rfirst = np.floor((grid.ymax - np.maximum(y0, y1)) / cs - 0.5).astype(np.int64) + 1
+    rlast = np.floor((grid.ymax - np.minimum(y0, y1)) / cs - 0.5).astype(np.int64)
+    rfirst = np.maximum(rfirst, 0)
+    rlast = np.minimum(rlast, grid.nrows - 1)
+    crossing = rlast >= rfirst
+    edge = np.flatnonzero(crossing)
+    rfirst, rlast = rfirst[crossing], rlast[crossing]
+    #Assign each edge to every block of rows that it crosses
+    t0, t1 = rfirst // tile_rows, rlast // tile_rows
+    ntiles = t1 - t0 + 1
+    tile_edge = np.repeat(edge, ntiles)
+    tile_id = np.repeat(t0, ntiles) + _local_index(ntiles)
+    order = np.argsort(tile_id, kind='stable')
+    tile_edge, tile_id = tile_edge[order], tile_id[order]
+    bounds = np.searchsorted(tile_id, np.arange(-(-grid.nrows // tile_rows) + 1))
+    #Row range of every edge, indexed by edge
+    efirst = np.zeros(len(x0), dtype=np.int64)
+    elast = np.full(len(x0), -1, dtype=np.int64)
+    efirst[edge], elast[edge] = rfirst, rlast
+    for t, (row0, row1) in enumerate(row_blocks(grid.nrows, tile_rows)):
+        block = np.zeros((row1 - row0, grid.ncols), dtype=np.int32)
+        e = tile_edge[bounds[t]:bounds[t + 1]]
+        if len(e):
+            _fill_block(block, row0, row1, e, x0, y0, x1, y1, g, np.maximum(efirst[e], row0),
+                        np.minimum(elast[e], row1 - 1), labels, grid)
+        yield row0, row1, block
+
+
+def _fill_block(block, row0, row1, e, x0, y0, x1, y1, g, rfirst, rlast, labels, grid):
+    cs = grid.cellsize
+    nrows = rlast - rfirst + 1
+    pe = np.repeat(e, nrows)
+    rows = np.repeat(rfirst, nrows) + _local_index(nrows)
+    yc = grid.ymax - (rows + 0.5) * cs
+    xi = x0[pe] + (yc - y0[pe]) * (x1[pe] - x0[pe]) / (y1[pe] - y0[pe])
+    pg = g[pe]
+    #Crossings of each polygon with each row, sorted from west to east: pairs of crossings delimit the inside
+    order = np.lexsort((xi, rows, pg))
+    xi, rows, pg = xi[order], rows[order], pg[order]
+    xa, xb, rows, pg = xi[0::2], xi[1::2], rows[0::2], pg[0::2]
+    cstart = np.clip(np.ceil((xa - grid.xmin) / cs - 0.5), 0, grid.ncols).astype(np.int64)
+    cend = np.clip(np.ceil((xb - grid.xmin) / cs - 0.5), 0, grid.ncols).astype(np.int64)
+    span = cend > cstart
+    rows, pg, cstart, cend = rows[span], pg[span], cstart[span], cend[span]
+    base = (rows - row0) * grid.ncols
+    cells = _ranges(base + cstart, base + cend)
+    block.flat[cells] = np.repeat(labels[pg], cend - cstart)
+
+
+def rasterize(geoms, labels, grid, out=None, tile_rows=1024):
+    """Label grid of the polygons (see label_tiles), written into out (e.g. a np.memmap) if given."""
+    if out is None:
+        out = np.zeros(grid.shape, dtype=np.int32)
+    for row0, row1, block in label_tiles(geoms, labels, grid, tile_rows=tile_rows):
+        out[row0:row1] = block
+    return out
+
+
+class ZoneAccumulator(object):
+    """Running count, sum, min and max of values for labels 1..nzones (label 0 is outside every zone)."""
+
+    def __init__(self, nzones):
+        self.count = np.zeros(nzones + 1, dtype=np.int64)
+        self.sum = np.zeros(nzones + 1, dtype=np.float64)
+        self.min = np.full(nzones + 1, np.inf)
+        self.max = np.full(nzones + 1, -np.inf)
+
+    def add(self, labels, values, nodata=None):
+        labels = np.asarray(labels).ravel()
+        values = np.asarray(values, dtype=np.float64).ravel()
+        valid = (labels > 0) & ~np.isnan(values)
+        if nodata is not None:
+            valid &= values != nodata
+        lab, val = labels[valid], values[valid]
+        if not len(lab):
+            return
+        n = len(self.count)
+        self.count += np.bincount(lab, minlength=n)
+        self.sum += np.bincount(lab, weights=val, minlength=n)
+        order = np.argsort(lab, kind='stable')
+        lab, val = lab[order], val[order]
+        starts = np.flatnonzero(np.concatenate([[True], lab[1:] != lab[:-1]]))
+        zones = lab[starts]
+        self.min[zones] = np.minimum(self.min[zones], np.minimum.reduceat(val, starts))
+        self.max[zones] = np.maximum(self.max[zones], np.maximum.reduceat(val, starts))
+
+    def table(self, zone_keys, zone_field='ZONE', cellsize=None):
+        """Statistics of every zone that has data, with the column names of ZonalStatisticsAsTable."""
+        has = np.flatnonzero(self.count[1:] > 0) + 1
+        count = self.count[has]
+        out = {zone_field: np.asarray(zone_keys)[has - 1], 'COUNT': count}
+        if cellsize is not None:
+            out['AREA'] = count * cellsize ** 2
+        out['MIN'] = self.min[has]
+        out['MAX'] = self.max[has]
+        out['RANGE'] = out['MAX'] - out['MIN']
+        out['MEAN'] = self.sum[has] / count
+        out['SUM'] = self.sum[has]
+        return out
+
+
+def _value_block(values, row0, row1):
+    if callable(values):
+        return values(row0, row1)
+    return values[row0:row1]
+
+
+def zone_labels(zone_keys):
+    """Unique zone keys and the label (1..n) of every feature, so that multipart zones get a single label."""
+    keys, inverse = np.unique(np.asarray(zone_keys), return_inverse=True)
+    return keys, (inverse + 1).astype(np.int32)
+
+
+def zonal_stats(geoms, zone_keys, values, grid, zone_field='ZONE', nodata=None, tile_rows=1024):
+    """Statistics of values within every zone (features sharing the same zone key form a single zone).
+
+    values is a 2-D array on grid (a np.memmap works and is only read block by block) or a function returning rows
+    row0:row1 of the value raster. Cells equal to nodata or NaN are ignored.
+    Returns a dict of columns: zone_field, COUNT, AREA, MIN, MAX, RANGE, MEAN, SUM.
+    """
+    keys, labels = zone_labels(zone_keys)
+    acc = ZoneAccumulator(len(keys))
+    for row0, row1, block in label_tiles(geoms, labels, grid, tile_rows=tile_rows):
+        acc.add(block, _value_block(values, row0, row1), nodata=nodata)
+    return acc.table(keys, zone_field=zone_field, cellsize=grid.cellsize)
+
+
+def zonal_stats_labels(label_grid, zone_keys, values, zone_field='ZONE', nodata=None, cellsize=None, tile_rows=1024):
+    """Same as zonal_stats for a label grid that was already rasterized (label i + 1 is zone_keys[i])."""
+    acc = ZoneAccumulator(len(zone_keys))
+    for row0, row1 in row_blocks(label_grid.shape[0], tile_rows):
+        acc.add(label_grid[row0:row1], _value_block(values, row0, row1), nodata=nodata)
+    return acc.table(zone_keys, zone_field=zone_field, cellsize=cellsize)